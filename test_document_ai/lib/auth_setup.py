@@ -1,14 +1,12 @@
 """
 Document AI認証設定モジュール
 Google Cloud認証の設定を管理します
+
+認証情報とクライアントは util/cloud_clients.py でプロセス内で共有します。
+キーファイルの読み込み・トークンの取得はキーごとに最初の1回だけで、以降のトークンの更新はバックグラウンドで行われます。
 """
 
-import os
 from pathlib import Path
-import google.auth
-from google.oauth2 import service_account
-from google.auth import load_credentials_from_file
-from google.api_core.client_options import ClientOptions
 from google.cloud import documentai
 
 
@@ -22,21 +20,17 @@ def setup_credentials(service_account_key_path: Path = None) -> tuple:
     Returns:
         tuple: (認証情報, プロジェクトID)
     """
+    # util/ は呼び出し側（main.py・setup_test.py）がパスに追加する
+    from util.cloud_clients import get_credentials
+    
     if service_account_key_path and service_account_key_path.exists():
-        # サービスアカウントキーファイルから認証情報を読み込み
+        # サービスアカウントキーファイルから認証情報を読み込み（Document AI用のスコープ付き）
         print(f"サービスアカウントキーを使用: {service_account_key_path}")
-        
-        # Document AI用のスコープを明示的に設定
-        credentials = service_account.Credentials.from_service_account_file(
-            str(service_account_key_path),
-            scopes=["https://www.googleapis.com/auth/cloud-platform"]
-        )
-        project_id = credentials.project_id
-        return credentials, project_id
+        return get_credentials(service_account_key_path)
     
     # デフォルト認証情報を取得（ADCまたは環境変数から）
     try:
-        credentials, project_id = google.auth.default()
+        credentials, project_id = get_credentials()
         print("デフォルト認証情報を使用")
         return credentials, project_id
     except Exception as e:
@@ -57,33 +51,14 @@ def create_document_ai_client_from_key_file(
     Returns:
         tuple: (Document AIクライアント, プロジェクトID)
     """
+    from util.cloud_clients import get_credentials, get_document_ai_client
+    
     if not service_account_key_path.exists():
         raise FileNotFoundError(f"サービスアカウントキーファイルが見つかりません: {service_account_key_path}")
     
-    # キーファイルから認証情報を読み込み（適切なスコープ付き）
-    credentials = service_account.Credentials.from_service_account_file(
-        str(service_account_key_path),
-        scopes=["https://www.googleapis.com/auth/cloud-platform"]
-    )
-    project_id = credentials.project_id
-    
-    # 認証情報を更新
-    auth_req = google.auth.transport.requests.Request()
-    credentials.refresh(auth_req)
-    
-    # クライアントオプションを設定
-    opts = ClientOptions(
-        api_endpoint=f"{location}-documentai.googleapis.com",
-        quota_project_id=project_id
-    )
-    
-    # クライアントを作成
-    client = documentai.DocumentProcessorServiceClient(
-        client_options=opts,
-        credentials=credentials
-    )
-    
-    return client, project_id
+    # トークンを取得できることを確認（取得済みの場合は何もしない）
+    get_credentials(service_account_key_path, wait=True)
+    return get_document_ai_client(location, service_account_key_path)
 
 
 def create_document_ai_client(location: str = "us", credentials=None, project_id=None) -> documentai.DocumentProcessorServiceClient:
@@ -92,35 +67,40 @@ def create_document_ai_client(location: str = "us", credentials=None, project_id
     
     Args:
         location: Document AIのリージョン
-        credentials: Google Cloud認証情報
+        credentials: Google Cloud認証情報（Noneの場合はデフォルト認証の共有クライアントを返す）
         project_id: Google CloudプロジェクトID
         
     Returns:
         DocumentProcessorServiceClient: Document AIクライアント
     """
-    if credentials is None or project_id is None:
-        credentials, project_id = setup_credentials()
+    from util.cloud_clients import create_channel, document_ai_host, get_credentials, get_document_ai_client
     
-    # 認証情報を更新
-    auth_req = google.auth.transport.requests.Request()
-    credentials.refresh(auth_req)
-    
-    # クライアントオプションを設定
-    opts = ClientOptions(
-        api_endpoint=f"{location}-documentai.googleapis.com",
-        quota_project_id=project_id
-    )
+    if credentials is None or project_id is None:
+        setup_credentials()
+        # トークンを取得できることを確認（取得済みの場合は何もしない）
+        get_credentials(wait=True)
+        client, _ = get_document_ai_client(location)
+        return client
     
-    # クライアントを作成
-    client = documentai.DocumentProcessorServiceClient(
-        client_options=opts,
-        credentials=credentials
+    # 渡された認証情報は共有のキャッシュに入れず、接続設定だけを共通にしたチャネルを作る
+    import google.auth.transport.requests
+    from google.cloud.documentai_v1.services.document_processor_service.transports import (
+        DocumentProcessorServiceGrpcTransport,
     )
     
-    return client
+    credentials.refresh(google.auth.transport.requests.Request())
+    if hasattr(credentials, "with_quota_project"):
+        credentials = credentials.with_quota_project(project_id)
+    channel = create_channel(document_ai_host(location), credentials)
+    return documentai.DocumentProcessorServiceClient(transport=DocumentProcessorServiceGrpcTransport(channel=channel))
 
 
 if __name__ == "__main__":
+    import sys
+    
+    # util/ を読み込めるよう、リポジトリのルートをパスに追加
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+    
     # 認証テスト
     try:
         credentials, project_id = setup_credentials()
@@ -128,10 +108,10 @@ if __name__ == "__main__":
         
         client = create_document_ai_client()
         print("Document AIクライアントの作成に成功しました")
-        
+    
     except Exception as e:
         print(f"認証エラー: {e}")
         print("\n認証設定のヒント:")
         print("1. gcloud auth application-default login を実行")
         print("2. GOOGLE_APPLICATION_CREDENTIALS環境変数にサービスアカウントキーのパスを設定")
-        print("3. サービスアカウントキーファイルをプロジェクトに配置")
\ No newline at end of file
+        print("3. サービスアカウントキーファイルをプロジェクトに配置")
@@ -0,0 +1,287 @@
+"""
+Document AI の Document をバイナリ形式で保存するモジュール
+
+生JSON（*_raw_response.json）は MessageToDict で boundingPoly・normalizedVertices・textAnchor の
+座標がすべて展開され、さらに indent=2 で書き出すため、1ページで数MBになります。
+このモジュールは Document をprotobufのバイナリ形式（Document.serialize）のまま zstd で圧縮して保存します（*_document.pb.zst）。
+
+- ページ画像（pages[].image。入力画像をPNGにしたもので、生JSONの大半を占める）は保存しない（元の画像が残っているため）
+- 保存量は生JSONの 1/10 以下（座標の多いページほど差が大きい）
+- 読み込みはJSONのパースより大幅に速い（オフラインでの再処理向け）
+- StoredDocument は圧縮されたバイト列だけを読み込み、.document に初めてアクセスしたときにデコードする
+- 既存の生JSONとの相互変換ができる（JSONで確認したい場合は to-json で戻す）
+
+使い方:
+    save_document(document, output_dir / "page_001_document.pb.zst")
+    document = load_document(output_dir / "page_001_document.pb.zst")
+
+    # 生JSON -> バイナリ（ファイルまたはディレクトリ。元のJSONは残す。--keep-images でページ画像も保存する）
+    python lib/document_store.py to-binary documents/ocr_results/test
+    # バイナリ -> 生JSON
+    python lib/document_store.py to-json documents/ocr_results/test
+    # 生JSONとバイナリのサイズ・読み込み時間を比較する
+    python lib/document_store.py bench [単語数]
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, Union
+
+import zstandard
+
+if TYPE_CHECKING:
+    # google.cloud.documentai は使う関数の中で読み込む（定数だけを使う main.py の offline モードで読み込まないように）
+    from google.cloud import documentai_v1 as documentai
+
+RAW_FORMATS = ("json", "binary")
+JSON_SUFFIX = "_raw_response.json"
+BINARY_SUFFIX = "_document.pb.zst"
+
+# 圧縮レベル（1-22）。3で十分小さく、書き込みもJSONのダンプより速い
+DEFAULT_LEVEL = 3
+
+
+def strip_page_images(document: documentai.Document) -> documentai.Document:
+    """ページ画像（pages[].image）を除いた Document（画像がない場合はそのまま返す）"""
+    from google.cloud import documentai_v1 as documentai
+
+    pb = documentai.Document.pb(document)
+    if not any(page.HasField("image") for page in pb.pages):
+        return document
+    stripped = type(pb)()
+    stripped.CopyFrom(pb)
+    for page in stripped.pages:
+        page.ClearField("image")
+    return documentai.Document.wrap(stripped)
+
+
+def encode_document(document: documentai.Document, level: int = DEFAULT_LEVEL, keep_images: bool = False) -> bytes:
+    """
+    Document をバイナリ形式 + zstd に変換
+
+    Args:
+        keep_images: Trueの場合はページ画像も保存する（PNGのため圧縮はほとんど効かない）
+    """
+    from google.cloud import documentai_v1 as documentai
+
+    if not keep_images:
+        document = strip_page_images(document)
+    # ZstdCompressor はスレッド間で共有できないため、呼び出しごとに作る（並列送信のワーカーから呼ばれる）
+    return zstandard.ZstdCompressor(level=level).compress(documentai.Document.serialize(document))
+
+
+def decode_document(data: bytes) -> documentai.Document:
+    """encode_document() のバイト列を Document に戻す"""
+    from google.cloud import documentai_v1 as documentai
+
+    return documentai.Document.deserialize(zstandard.ZstdDecompressor().decompress(data))
+
+
+def save_document(document: documentai.Document, path: Path, level: int = DEFAULT_LEVEL,
+                  keep_images: bool = False) -> Path:
+    """
+    Document を保存
+
+    Args:
+        document: 保存する Document
+        path: 保存先（通常は "{stem}_document.pb.zst"）
+        level: zstdの圧縮レベル
+        keep_images: Trueの場合はページ画像も保存する
+
+    Returns:
+        保存先のパス
+    """
+    path = Path(path)
+    path.write_bytes(encode_document(document, level, keep_images))
+    return path
+
+
+def load_document(path: Path) -> documentai.Document:
+    """save_document() で保存した Document を読み込む"""
+    return decode_document(Path(path).read_bytes())
+
+
+class StoredDocument:
+    """
+    保存済みの Document（デコードは .document に初めてアクセスしたときに行う）
+
+    ファイル一覧・サイズの確認や、一部のファイルだけを再処理する場合に、
+    すべてのファイルをデコードせずに済みます。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.data = self.path.read_bytes()
+        self._document: Optional[documentai.Document] = None
+
+    @property
+    def stem(self) -> str:
+        """出力ファイル名の基部（"page_001_document.pb.zst" -> "page_001"）"""
+        return self.path.name[: -len(BINARY_SUFFIX)] if self.path.name.endswith(BINARY_SUFFIX) else self.path.stem
+
+    @property
+    def document(self) -> documentai.Document:
+        if self._document is None:
+            self._document = decode_document(self.data)
+        return self._document
+
+    def to_response_json(self) -> Dict:
+        """生JSON（*_raw_response.json）と同じ形式の辞書"""
+        return document_to_response_json(self.document)
+
+
+def iter_stored_documents(output_dir: Path) -> Iterator[StoredDocument]:
+    """出力ディレクトリの保存済み Document を名前順に返す"""
+    for path in sorted(Path(output_dir).glob(f"*{BINARY_SUFFIX}")):
+        yield StoredDocument(path)
+
+
+def document_to_response_json(document: documentai.Document) -> Dict:
+    """Document を生JSON（ProcessResponse を MessageToDict した形式）の辞書にする"""
+    from google.cloud import documentai_v1 as documentai
+    from google.protobuf.json_format import MessageToDict
+
+    return MessageToDict(documentai.ProcessResponse(document=document)._pb)
+
+
+def response_json_to_document(response_json: Union[Dict, str]) -> documentai.Document:
+    """生JSON（辞書または文字列）から Document を取り出す"""
+    from google.cloud import documentai_v1 as documentai
+
+    text = response_json if isinstance(response_json, str) else json.dumps(response_json)
+    return documentai.ProcessResponse.from_json(text, ignore_unknown_fields=True).document
+
+
+def json_to_binary(json_path: Path, level: int = DEFAULT_LEVEL, keep_images: bool = False) -> Path:
+    """
+    生JSONファイルをバイナリ形式に変換（同じフォルダに "{stem}_document.pb.zst" を作る。元のJSONは残す）
+
+    keep_images がFalseの場合、ページ画像は保存しない（to-json で戻したJSONにも含まれない）
+
+    Returns:
+        作成したファイルのパス
+    """
+    json_path = Path(json_path)
+    stem = json_path.name[: -len(JSON_SUFFIX)] if json_path.name.endswith(JSON_SUFFIX) else json_path.stem
+    document = response_json_to_document(json_path.read_text(encoding="utf-8"))
+    return save_document(document, json_path.with_name(stem + BINARY_SUFFIX), level, keep_images)
+
+
+def binary_to_json(binary_path: Path) -> Path:
+    """
+    バイナリ形式を生JSONファイルに変換（同じフォルダに "{stem}_raw_response.json" を作る）
+
+    Returns:
+        作成したファイルのパス
+    """
+    stored = StoredDocument(binary_path)
+    json_path = stored.path.with_name(stored.stem + JSON_SUFFIX)
+    json_path.write_text(json.dumps(stored.to_response_json(), ensure_ascii=False, indent=2), encoding="utf-8")
+    return json_path
+
+
+def sample_document(n_words: int, n_pages: int = 1) -> documentai.Document:
+    """
+    Form Parserのレスポンスに近い構造の Document（ベンチマーク・フェイクサーバー用）
+
+    1ページ n_words 単語のトークン・行と、10単語ごとに1つのフォームフィールド（名前と値）を持つ。
+    座標・信頼度は実際の値のようにばらつかせる。
+    """
+    import random
+
+    from google.cloud import documentai_v1 as documentai
+
+    rng = random.Random(0)
+    Layout = documentai.Document.Page.Layout
+    words = [f"項目{i:04d}" for i in range(n_words)]
+    text = " ".join(words)
+    tokens = []
+    start = 0
+    for i, word in enumerate(words):
+        x, y = (i % 20) * 120 + rng.randint(0, 15), (i // 20) * 40 + rng.randint(0, 5)
+        poly = documentai.BoundingPoly(
+            vertices=[{"x": x, "y": y}, {"x": x + 100, "y": y}, {"x": x + 100, "y": y + 30}, {"x": x, "y": y + 30}],
+            normalized_vertices=[{"x": x / 2480, "y": y / 3508}, {"x": (x + 100) / 2480, "y": y / 3508},
+                                 {"x": (x + 100) / 2480, "y": (y + 30) / 3508}, {"x": x / 2480, "y": (y + 30) / 3508}],
+        )
+        anchor = documentai.Document.TextAnchor(text_segments=[{"start_index": start, "end_index": start + len(word)}])
+        tokens.append(documentai.Document.Page.Token(
+            layout=Layout(text_anchor=anchor, confidence=rng.uniform(0.7, 1.0), bounding_poly=poly, orientation=Layout.Orientation.PAGE_UP),
+            detected_languages=[{"language_code": "ja", "confidence": rng.uniform(0.9, 1.0)}],
+        ))
+        start += len(word) + 1
+    form_fields = [
+        documentai.Document.Page.FormField(field_name=tokens[i].layout, field_value=tokens[i + 1].layout)
+        for i in range(0, len(tokens) - 1, 10)
+    ]
+    pages = [
+        documentai.Document.Page(
+            page_number=number,
+            dimension={"width": 2480, "height": 3508, "unit": "pixels"},
+            layout=Layout(text_anchor={"text_segments": [{"start_index": 0, "end_index": len(text)}]}),
+            tokens=tokens,
+            lines=[documentai.Document.Page.Line(layout=t.layout) for t in tokens[::5]],
+            form_fields=form_fields,
+        )
+        for number in range(1, n_pages + 1)
+    ]
+    return documentai.Document(text=text, mime_type="image/png", pages=pages)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    usage = ("使い方: python lib/document_store.py to-binary|to-json <ファイルまたはディレクトリ> [--keep-images]\n"
+             "        python lib/document_store.py bench [単語数]")
+    if len(sys.argv) < 2:
+        print(usage)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "bench":
+        n_words = int(sys.argv[2]) if len(sys.argv) > 2 else 3700
+        document = sample_document(n_words)
+        response_json = document_to_response_json(document)
+
+        start = time.perf_counter()
+        json_text = json.dumps(response_json, ensure_ascii=False, indent=2)
+        json_bytes = json_text.encode("utf-8")
+        json_write = time.perf_counter() - start
+        start = time.perf_counter()
+        response_json_to_document(json_bytes.decode("utf-8"))
+        json_load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        binary = encode_document(document)
+        binary_write = time.perf_counter() - start
+        start = time.perf_counter()
+        decode_document(binary)
+        binary_load = time.perf_counter() - start
+
+        print(f"{n_words} 単語の1ページ")
+        print(f"生JSON:   {len(json_bytes) / 1024:8.0f} KB, 書き出し {json_write * 1000:6.1f} ms, "
+              f"読み込み {json_load * 1000:6.1f} ms")
+        print(f"バイナリ: {len(binary) / 1024:8.0f} KB, 書き出し {binary_write * 1000:6.1f} ms, "
+              f"読み込み {binary_load * 1000:6.1f} ms "
+              f"({len(json_bytes) / len(binary):.1f}x 小さい, 読み込み {json_load / binary_load:.0f}x 速い)")
+        sys.exit(0)
+
+    if command not in ("to-binary", "to-json") or len(sys.argv) < 3:
+        print(usage)
+        sys.exit(1)
+
+    target = Path(sys.argv[2])
+    suffix = JSON_SUFFIX if command == "to-binary" else BINARY_SUFFIX
+    paths = sorted(target.glob(f"*{suffix}")) if target.is_dir() else [target]
+    before = after = 0
+    for path in paths:
+        if command == "to-binary":
+            out = json_to_binary(path, keep_images="--keep-images" in sys.argv[3:])
+        else:
+            out = binary_to_json(path)
+        before += path.stat().st_size
+        after += out.stat().st_size
+        print(f"[OK] {path.name} -> {out.name} ({path.stat().st_size / 1024:.0f} KB -> {out.stat().st_size / 1024:.0f} KB)")
+    print(f"{len(paths)} ファイル変換しました ({before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB)")
@@ -0,0 +1,369 @@
+"""
+ローカルのフェイクDocument AI gRPCサーバー
+
+ネットワーク・認証情報・課金なしで、Document AIの呼び出し部分（並列数、タイムアウト、
+出力の書き込み）のスループットを確認するためのサーバーです。
+本物と同じ gRPC サービス（google.cloud.documentai.v1.DocumentProcessorService/ProcessDocument）を実装し、
+指定した遅延のあとに、送られたファイルのサイズ・MIMEタイプを書いたテキストを持つ Document を返します。
+PDF・複数ページTIFFはページごとに1ページを返し（ページ指定にも従う）、ページ数が max_pages を超えるリクエストは
+本物のオンライン処理と同じく INVALID_ARGUMENT にします（lib/request_coalescer.py の確認用）。
+words_per_page を指定すると、本物に近い大きさ（単語ごとの座標・フォームフィールド付き）の Document を返し、
+リクエストの field_mask も本物と同じように適用します。
+
+使い方:
+    with FakeDocumentAIServer(latency=2.0) as server:
+        client = connect_local(server.address)
+        # 以降は通常のクライアントと同じように process_document() を呼べる
+
+    # 単体で起動する場合（main.py の endpoint に表示されたアドレスを設定する）
+    python lib/fake_documentai_server.py serve [遅延秒]
+
+    # 逐次実行と並列実行のスループットを比較する
+    python lib/fake_documentai_server.py [遅延秒] [ファイル数]
+
+    # 同時処理数が上限を超えるとスロットリングする（util/resilience.py の再試行・AIMDの確認）
+    python lib/fake_documentai_server.py throttle [同時処理数の上限] [ファイル数]
+
+    # フィールドマスクごとのレスポンスサイズ・デコード時間を比較する
+    python lib/fake_documentai_server.py fieldmask [1ページの単語数]
+"""
+from __future__ import annotations
+
+import random
+import threading
+import time
+from concurrent import futures
+from typing import Optional
+
+import grpc
+from google.cloud import documentai_v1 as documentai
+from google.protobuf import duration_pb2
+from google.rpc import code_pb2, error_details_pb2, status_pb2
+from grpc_status import rpc_status
+from google.cloud.documentai_v1.services.document_processor_service.transports import (
+    DocumentProcessorServiceGrpcTransport,
+)
+
+SERVICE_NAME = "google.cloud.documentai.v1.DocumentProcessorService"
+_MESSAGE_OPTIONS = [("grpc.max_send_message_length", -1), ("grpc.max_receive_message_length", -1)]
+
+
+class FakeDocumentAIServer:
+    """
+    ProcessDocument だけを実装したフェイクサーバー
+
+    Attributes:
+        address: 接続先（"localhost:ポート"）
+        request_count: 受け付けたリクエスト数
+        max_concurrency: 同時に処理していたリクエスト数の最大値
+        throttled_count: スロットリング（RESOURCE_EXHAUSTED）を返した回数
+    """
+
+    def __init__(self, latency: float = 2.0, jitter: float = 0.0, port: int = 0,
+                 max_workers: int = 64, fail_rate: float = 0.0,
+                 throttle_above: Optional[int] = None, retry_delay: float = 0.5,
+                 words_per_page: int = 0, max_pages: int = 15):
+        """
+        Args:
+            latency: 1リクエストあたりの応答遅延（秒）
+            jitter: 遅延のばらつき（秒）。latency ± jitter の一様乱数になる
+            port: 待ち受けポート（0の場合は空いているポートを使う）
+            max_workers: サーバー側で同時に処理するリクエスト数の上限
+            fail_rate: UNAVAILABLE エラーを返す割合（0.0-1.0）
+            throttle_above: 同時処理数がこれを超えたリクエストに RESOURCE_EXHAUSTED を返す（Noneの場合は返さない）
+            retry_delay: スロットリング時にエラー詳細（RetryInfo）で指定する再試行までの待ち時間（秒）
+            words_per_page: 0より大きい場合は、1ページこの単語数のトークン・座標・フォームフィールドを持つ Document を返す
+            max_pages: 1リクエストで処理するページ数の上限（超えた場合は INVALID_ARGUMENT）
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.throttle_above = throttle_above
+        self.retry_delay = retry_delay
+        self.max_pages = max_pages
+        self._rich_document = None
+        if words_per_page > 0:
+            from lib.document_store import sample_document
+
+            self._rich_document = sample_document(words_per_page)
+        self.request_count = 0
+        self.throttled_count = 0
+        self.max_concurrency = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        # 本物と同じく、数MBの画像・複数ページのPDFを受け付ける（gRPCの既定の上限は4MB）
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), options=_MESSAGE_OPTIONS)
+        handler = grpc.method_handlers_generic_handler(SERVICE_NAME, {
+            "ProcessDocument": grpc.unary_unary_rpc_method_handler(
+                self._process_document,
+                request_deserializer=documentai.ProcessRequest.deserialize,
+                response_serializer=documentai.ProcessResponse.serialize,
+            ),
+        })
+        self._server.add_generic_rpc_handlers((handler,))
+        self.port = self._server.add_insecure_port(f"localhost:{port}")
+        self.address = f"localhost:{self.port}"
+
+    def _throttle(self, context) -> None:
+        # 本物のクォータ超過と同じく、RESOURCE_EXHAUSTED と再試行までの待ち時間（google.rpc.RetryInfo）を返す
+        retry_info = error_details_pb2.RetryInfo(retry_delay=duration_pb2.Duration(
+            seconds=int(self.retry_delay), nanos=int(self.retry_delay % 1 * 1e9)))
+        status = status_pb2.Status(code=code_pb2.RESOURCE_EXHAUSTED, message="fake server: quota exceeded")
+        status.details.add().Pack(retry_info)
+        context.abort_with_status(rpc_status.to_status(status))
+
+    def _process_document(self, request, context):
+        with self._lock:
+            self.request_count += 1
+            throttled = self.throttle_above is not None and self._active >= self.throttle_above
+            if throttled:
+                self.throttled_count += 1
+            else:
+                self._active += 1
+                self.max_concurrency = max(self.max_concurrency, self._active)
+        if throttled:
+            self._throttle(context)
+        try:
+            delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+            # クライアントの期限を過ぎたら待たずに終了する（クライアント側は DEADLINE_EXCEEDED になる）
+            remaining = context.time_remaining()
+            time.sleep(min(delay, remaining) if remaining is not None else delay)
+            if not context.is_active():
+                return documentai.ProcessResponse()
+            if self.fail_rate and random.random() < self.fail_rate:
+                context.abort(grpc.StatusCode.UNAVAILABLE, "fake server: unavailable")
+
+            page_numbers = self._page_numbers(request)
+            if len(page_numbers) > self.max_pages:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                              f"fake server: {len(page_numbers)} pages exceed the limit of {self.max_pages}")
+            if self._rich_document is not None:
+                document = self._rich_document
+            else:
+                document = self._small_document(request, page_numbers)
+            if request.field_mask.paths:
+                document = apply_field_mask(document, request.field_mask.paths)
+            return documentai.ProcessResponse(document=document)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    @staticmethod
+    def _page_numbers(request) -> list:
+        """処理するページ番号（PDF・TIFFはファイルのページ数とページ指定から。それ以外は [1]）"""
+        raw = request.raw_document
+        count = 1
+        if raw.mime_type == "application/pdf":
+            import pymupdf
+
+            with pymupdf.open(stream=raw.content, filetype="pdf") as pdf:
+                count = pdf.page_count
+        elif raw.mime_type == "image/tiff":
+            import io
+
+            from PIL import Image
+
+            with Image.open(io.BytesIO(raw.content)) as img:
+                count = getattr(img, "n_frames", 1)
+        selected = list(request.process_options.individual_page_selector.pages)
+        return [page for page in selected if 1 <= page <= count] if selected else list(range(1, count + 1))
+
+    @staticmethod
+    def _small_document(request, page_numbers: list) -> documentai.Document:
+        # ページごとのテキストに、ページ番号のフォームフィールドとエンティティを付ける（分割・結合の確認用）
+        raw = request.raw_document
+        text = ""
+        pages = []
+        entities = []
+        for index, number in enumerate(page_numbers):
+            start = len(text)
+            text += f"fake document\nprocessor: {request.name}\nmime_type: {raw.mime_type}\nsize: {len(raw.content)}\n"
+            name_start = len(text)
+            text += f"page: {number}\n"
+            value = (name_start + 6, len(text) - 1)
+            pages.append(documentai.Document.Page(
+                page_number=number,
+                layout={"text_anchor": _anchor(start, len(text))},
+                form_fields=[documentai.Document.Page.FormField(
+                    field_name={"text_anchor": _anchor(name_start, name_start + 4)},
+                    field_value={"text_anchor": _anchor(*value)},
+                )],
+            ))
+            entities.append(documentai.Document.Entity(
+                type_="page_number", mention_text=str(number), text_anchor=_anchor(*value),
+                page_anchor={"page_refs": [{"page": index}]},
+            ))
+        return documentai.Document(text=text, mime_type=raw.mime_type, pages=pages, entities=entities)
+
+    def start(self) -> "FakeDocumentAIServer":
+        self._server.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.stop(grace=None)
+
+    def __enter__(self) -> "FakeDocumentAIServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def _anchor(start: int, end: int) -> documentai.Document.TextAnchor:
+    return documentai.Document.TextAnchor(text_segments=[{"start_index": start, "end_index": end}])
+
+
+def _copy_paths(source, dest, tree: dict) -> None:
+    for path_name, children in tree.items():
+        # Pythonの組み込み名と同じ名前のフィールド（Entity.type）は、クライアントライブラリのprotoでは "type_" になっている
+        fields = source.DESCRIPTOR.fields_by_name
+        field = fields.get(path_name) or fields[path_name + "_"]
+        name = field.name
+        repeated = field.is_repeated
+        is_message = field.message_type is not None
+        if not children:
+            if repeated:
+                getattr(dest, name).extend(getattr(source, name))
+            elif is_message:
+                if source.HasField(name):
+                    getattr(dest, name).CopyFrom(getattr(source, name))
+            else:
+                setattr(dest, name, getattr(source, name))
+        elif repeated:
+            for item in getattr(source, name):
+                _copy_paths(item, getattr(dest, name).add(), children)
+        elif source.HasField(name):
+            _copy_paths(getattr(source, name), getattr(dest, name), children)
+
+
+def apply_field_mask(document: documentai.Document, paths) -> documentai.Document:
+    """
+    field_mask のパスに含まれるフィールドだけを残した Document（本物と同じく、繰り返しフィールドの途中のパスも各要素に適用する）
+    """
+    tree: dict = {}
+    for path in paths:
+        node = tree
+        for name in path.split("."):
+            node = node.setdefault(name, {})
+    masked = documentai.Document.pb()()
+    _copy_paths(documentai.Document.pb(document), masked, tree)
+    return documentai.Document.wrap(masked)
+
+
+def connect_local(address: str) -> documentai.DocumentProcessorServiceClient:
+    """
+    ローカルのサーバー（フェイクサーバー）に平文のgRPCで接続するクライアントを作成
+
+    Args:
+        address: 接続先（"localhost:ポート"）
+    """
+    channel = grpc.insecure_channel(address, options=_MESSAGE_OPTIONS)
+    return documentai.DocumentProcessorServiceClient(transport=DocumentProcessorServiceGrpcTransport(channel=channel))
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+
+    # lib/ と util/ を読み込めるようにする
+    project_dir = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(project_dir))
+    sys.path.insert(0, str(project_dir.parent))
+    from lib.form_parser_processor import process_document_with_form_parser
+    from util.prefetch import Prefetcher
+    from util.resilience import create_caller
+
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        latency = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+        server = FakeDocumentAIServer(latency=latency, port=50051).start()
+        print(f"フェイクDocument AIサーバーを起動しました: {server.address} (遅延 {latency} 秒, Ctrl+Cで終了)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "fieldmask":
+        # 出力の設定ごとに必要なフィールドだけを要求し、レスポンスのサイズとデコード時間を比較する
+        from lib.form_parser_processor import field_mask_for_outputs, response_to_outputs, send_form_parser_request
+
+        words = int(sys.argv[2]) if len(sys.argv) > 2 else 3700
+        content = b"\x89PNG" + bytes(64 * 1024)
+        profiles = [
+            ("全フィールド（生データあり）", field_mask_for_outputs(True, True, True)),
+            ("テキスト + 構造化JSON", field_mask_for_outputs(True, False, True)),
+            ("テキストのみ", field_mask_for_outputs(True, False, False)),
+        ]
+        with FakeDocumentAIServer(latency=0.0, words_per_page=words) as server:
+            client = connect_local(server.address)
+            print(f"1ページ {words} 単語のレスポンス")
+            for label, mask in profiles:
+                response = send_form_parser_request(client, "fake-project", "fake-processor", Path("fake.png"),
+                                                    content=content, field_mask=mask)
+                data = documentai.ProcessResponse.serialize(response)
+                runs = 5
+                start = time.perf_counter()
+                for _ in range(runs):
+                    decoded = documentai.ProcessResponse.deserialize(data)
+                decode = (time.perf_counter() - start) / runs
+                start = time.perf_counter()
+                response_to_outputs(decoded)
+                to_json = time.perf_counter() - start
+                print(f"{label}: レスポンス {len(data) / 1024:8.0f} KB, デコード {decode * 1000:6.1f} ms, "
+                      f"JSON変換 {to_json * 1000:6.1f} ms")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "throttle":
+        # 同時処理数の上限を超える並列数で送信し、再試行とAIMDで上限付近に収まることを確認する
+        limit = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+        count = int(sys.argv[3]) if len(sys.argv) > 3 else 48
+        items = [Path(f"fake_{i:03}.png") for i in range(count)]
+        content = b"\x89PNG" + bytes(64 * 1024)
+        with FakeDocumentAIServer(latency=0.5, jitter=0.15, throttle_above=limit, retry_delay=0.2) as server:
+            client = connect_local(server.address)
+            for label, caller in (("再試行のみ", create_caller(max_attempts=8)),
+                                  ("再試行+AIMD", create_caller(max_concurrency=16, max_attempts=8))):
+                caller.on_retry = lambda *args: None
+                server.throttled_count = 0
+
+                def send(path: Path):
+                    return caller.call(lambda remaining: process_document_with_form_parser(
+                        client, "fake-project", "fake-processor", path, content=content,
+                        timeout=remaining, client_retry=False), deadline=30.0, name=path.name)
+
+                start = time.perf_counter()
+                with Prefetcher(items, send, depth=16, workers=16) as dispatcher:
+                    failed = sum(1 for dispatched in dispatcher if dispatched.error is not None)
+                elapsed = time.perf_counter() - start
+                print(f"{label}: {elapsed:.2f} 秒, 失敗 {failed} 件, サーバー側のスロットリング {server.throttled_count} 回")
+                print(f"  {caller.stats.summary()}")
+        sys.exit(0)
+
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    items = [Path(f"fake_{i:03}.png") for i in range(count)]
+    content = b"\x89PNG" + bytes(64 * 1024)
+
+    with FakeDocumentAIServer(latency=latency, jitter=latency * 0.3) as server:
+        client = connect_local(server.address)
+
+        def send(path: Path):
+            return process_document_with_form_parser(client, "fake-project", "fake-processor", path,
+                                                     content=content, timeout=latency * 5)
+
+        start = time.perf_counter()
+        for path in items:
+            send(path)
+        sequential = time.perf_counter() - start
+        print(f"逐次実行: {count} 件 {sequential:.2f} 秒 ({count / sequential:.2f} 件/秒)")
+
+        for max_in_flight in (4, 8, 16):
+            server.max_concurrency = 0
+            start = time.perf_counter()
+            with Prefetcher(items, send, depth=max_in_flight, workers=max_in_flight) as dispatcher:
+                for dispatched in dispatcher:
+                    dispatched.result()
+            elapsed = time.perf_counter() - start
+            print(f"並列実行 (max_in_flight={max_in_flight:2}): {elapsed:.2f} 秒 "
+                  f"({count / elapsed:.2f} 件/秒, {sequential / elapsed:.1f}x, サーバー側の最大同時処理数 {server.max_concurrency})")
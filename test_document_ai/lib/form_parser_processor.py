@@ -3,74 +3,212 @@ Form Parser Document AI処理モジュール（簡素化版）
 
 Document AIのForm Parserを使用して、
 座標や信頼度を含まないシンプルなフィールド抽出を行います。
+
+構造化JSONは Document（protobuf）から直接作ります（create_structured_output_from_document）。
+JSONの辞書への変換（response_to_json）は生JSONを出力する場合だけ行います。
+
+Googleのライブラリは使う関数の中で読み込みます。辞書版の抽出関数（create_combined_structured_output など）だけを
+使う場合（main.py の offline モード）は google.cloud.documentai を読み込みません。
 """
+from __future__ import annotations
 
-import json
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import TYPE_CHECKING, Dict, List, Any, Optional, Sequence
 import mimetypes
 
-from google.cloud import documentai_v1 as documentai
-from google.oauth2 import service_account
+if TYPE_CHECKING:
+    from google.cloud import documentai_v1 as documentai
+
+# 出力ごとに必要なレスポンスのフィールド（ProcessRequest.field_mask のパス）
+# pages.page_number は常に含める（ページ数の集計に使う。lib/response_cache.py）
+FIELD_MASK_PROFILES: Dict[str, List[str]] = {
+    # テキストファイル: 全文のみ
+    "text": ["text", "pages.page_number"],
+    # 構造化JSON（create_combined_structured_output）: 全文・フォームフィールドのテキストアンカー・エンティティ
+    "structured": [
+        "text",
+        "pages.page_number",
+        "pages.form_fields.field_name.text_anchor",
+        "pages.form_fields.field_value.text_anchor",
+        "entities.type",
+        "entities.mention_text",
+    ],
+    # 表のCSV（lib/table_extractor.py）: 全文・表のセルのテキストアンカーと結合
+    "tables": [
+        "text",
+        "pages.page_number",
+        "pages.tables.header_rows.cells.layout.text_anchor",
+        "pages.tables.header_rows.cells.row_span",
+        "pages.tables.header_rows.cells.col_span",
+        "pages.tables.body_rows.cells.layout.text_anchor",
+        "pages.tables.body_rows.cells.row_span",
+        "pages.tables.body_rows.cells.col_span",
+    ],
+}
 
 
 def setup_form_parser_client(location: str = "us", service_account_key_path: Optional[Path] = None):
     """
     Form Parser用のDocument AIクライアントを初期化
     
+    クライアントは util/cloud_clients.py でプロセス内で共有する（キーファイルの読み込み・接続は最初の1回だけ）。
+    
     Args:
         location: Document AIのリージョン
-        service_account_key_path: サービスアカウントキーファイルのパス
+        service_account_key_path: サービスアカウントキーファイルのパス（存在しない場合はデフォルト認証）
         
     Returns:
         tuple: (client, project_id)
+    
+    Raises:
+        ValueError: デフォルト認証でプロジェクトIDが分からず、GOOGLE_CLOUD_PROJECT環境変数も設定されていない場合
     """
-    if service_account_key_path and service_account_key_path.exists():
-        # サービスアカウントキーを使用
-        credentials = service_account.Credentials.from_service_account_file(
-            str(service_account_key_path),
-            scopes=['https://www.googleapis.com/auth/cloud-platform']
-        )
-        
-        # プロジェクトIDをキーファイルから取得
-        with open(service_account_key_path, 'r') as f:
-            key_data = json.load(f)
-        project_id = key_data.get('project_id')
-        
-        client = documentai.DocumentProcessorServiceClient(credentials=credentials)
-    else:
-        # デフォルト認証を使用
-        client = documentai.DocumentProcessorServiceClient()
-        import os
-        project_id = os.environ.get('GOOGLE_CLOUD_PROJECT')
-        if not project_id:
-            raise ValueError("GOOGLE_CLOUD_PROJECT環境変数が設定されていません")
+    # util/ は main.py がパスに追加する（このモジュールの読み込み時にはまだ追加されていない）
+    from util.cloud_clients import get_document_ai_client
     
-    return client, project_id
+    if service_account_key_path and Path(service_account_key_path).exists():
+        return get_document_ai_client(location, service_account_key_path)
+    return get_document_ai_client(location)
 
 
-def process_document_with_form_parser(
+def processor_name(
+    project_id: str,
+    location: str,
+    processor_id: str,
+    processor_version: Optional[str] = None
+) -> str:
+    """
+    リクエスト先のリソース名（processor_version を指定した場合はそのバージョン）
+    
+    Args:
+        processor_version: プロセッサバージョンID（例: "pretrained-form-parser-v2.1-2023-06-26"。Noneの場合はデフォルトバージョン）
+    """
+    name = f"projects/{project_id}/locations/{location}/processors/{processor_id}"
+    if processor_version:
+        name += f"/processorVersions/{processor_version}"
+    return name
+
+
+def field_mask_for_outputs(
+    output_text: bool = True,
+    output_raw_json: bool = True,
+    output_structured_json: bool = True,
+    output_tables: bool = False
+) -> Optional[List[str]]:
+    """
+    出力フラグから、レスポンスに必要なフィールドのパスを求める
+    
+    Returns:
+        field_mask のパス（生データを出力する場合はレスポンス全体が必要なのでNone）
+    """
+    if output_raw_json:
+        return None
+    paths: List[str] = []
+    if output_text:
+        paths += FIELD_MASK_PROFILES["text"]
+    if output_structured_json:
+        paths += FIELD_MASK_PROFILES["structured"]
+    if output_tables:
+        paths += FIELD_MASK_PROFILES["tables"]
+    return sorted(set(paths)) or list(FIELD_MASK_PROFILES["text"])
+
+
+def build_process_options(
+    pages: Optional[Sequence[int]] = None,
+    ocr_config: Optional[Dict[str, Any]] = None
+) -> Optional[documentai.ProcessOptions]:
+    """
+    ページ指定・OCR設定から ProcessOptions を作成（どちらも指定しない場合はNone）
+    
+    Args:
+        pages: 処理するページ番号（1始まり。PDF・複数ページTIFFのみ。None=全ページ）
+        ocr_config: documentai.OcrConfig の引数（例: {"hints": {"language_hints": ["ja"]}, "enable_native_pdf_parsing": True}）
+    """
+    if not pages and not ocr_config:
+        return None
+    from google.cloud import documentai_v1 as documentai
+    
+    options = documentai.ProcessOptions()
+    if pages:
+        options.individual_page_selector = documentai.ProcessOptions.IndividualPageSelector(pages=list(pages))
+    if ocr_config:
+        options.ocr_config = documentai.OcrConfig(**ocr_config)
+    return options
+
+
+def request_variant(
+    field_mask: Optional[Sequence[str]] = None,
+    process_options: Optional[documentai.ProcessOptions] = None
+) -> str:
+    """
+    レスポンスの内容に影響するリクエストの設定を表す文字列（キャッシュのキーに使う。既定の設定では空文字）
+    """
+    parts = []
+    if field_mask:
+        parts.append("mask=" + ",".join(sorted(field_mask)))
+    if process_options is not None:
+        from google.cloud import documentai_v1 as documentai
+        parts.append("options=" + documentai.ProcessOptions.to_json(process_options, indent=None, sort_keys=True))
+    return ";".join(parts)
+
+
+def build_process_request(
+    name: str,
+    content: bytes,
+    mime_type: str,
+    field_mask: Optional[Sequence[str]] = None,
+    process_options: Optional[documentai.ProcessOptions] = None
+) -> documentai.ProcessRequest:
+    """
+    ProcessRequest を作成
+    
+    Args:
+        name: リクエスト先のリソース名（processor_name()）
+        content: ファイル内容
+        mime_type: ファイルのMIMEタイプ
+        field_mask: レスポンスに含めるフィールドのパス（None=全フィールド。field_mask_for_outputs()）
+        process_options: ページ指定・OCR設定（build_process_options()）
+    """
+    from google.cloud import documentai_v1 as documentai
+    from google.protobuf import field_mask_pb2
+    
+    request = documentai.ProcessRequest(
+        name=name,
+        raw_document=documentai.RawDocument(content=content, mime_type=mime_type),
+    )
+    if field_mask:
+        request.field_mask = field_mask_pb2.FieldMask(paths=list(field_mask))
+    if process_options is not None:
+        request.process_options = process_options
+    return request
+
+
+def send_form_parser_request(
     client: documentai.DocumentProcessorServiceClient,
     project_id: str,
     processor_id: str,
     file_path: Path,
-    location: str = "us"
-) -> tuple[documentai.Document, dict]:
+    location: str = "us",
+    content: Optional[bytes] = None,
+    timeout: Optional[float] = None,
+    client_retry: bool = True,
+    processor_version: Optional[str] = None,
+    field_mask: Optional[Sequence[str]] = None,
+    process_options: Optional[documentai.ProcessOptions] = None,
+    mime_type: Optional[str] = None
+) -> documentai.ProcessResponse:
     """
-    Form Parserを使用してOCR処理を実行
+    Form Parserにリクエストを送信し、レスポンスをそのまま返す（引数は process_document_with_form_parser と同じ）
     
     Args:
-        client: Document AIクライアント
-        project_id: Google CloudプロジェクトID
-        processor_id: Form ParserプロセッサID
-        file_path: 処理する画像ファイルのパス
-        location: Document AIのリージョン
-        
+        mime_type: content のMIMEタイプ（Noneの場合は file_path から判定。複数ページをまとめたPDFを送る場合など）
+    
     Returns:
-        tuple[Document, dict]: OCR処理結果とJSONレスポンス
+        documentai.ProcessResponse: レスポンス（lib/response_cache.py でそのまま保存できる）
     """
     # MIMEタイプを自動判定
-    mime_type, _ = mimetypes.guess_type(str(file_path))
+    if mime_type is None:
+        mime_type, _ = mimetypes.guess_type(str(file_path))
     if not mime_type:
         if file_path.suffix.lower() in ['.jpg', '.jpeg']:
             mime_type = 'image/jpeg'
@@ -79,23 +217,94 @@ def process_document_with_form_parser(
         else:
             mime_type = 'application/octet-stream'
     
-    # ファイルを読み込み
-    with open(file_path, "rb") as image_file:
-        image_content = image_file.read()
+    # ファイルを読み込み（先読み済みの場合はそのまま使用）
+    if content is not None:
+        image_content = content
+    else:
+        with open(file_path, "rb") as image_file:
+            image_content = image_file.read()
     
-    # Document AIリクエストを作成
-    raw_document = documentai.RawDocument(content=image_content, mime_type=mime_type)
-    name = f"projects/{project_id}/locations/{location}/processors/{processor_id}"
-    request = documentai.ProcessRequest(name=name, raw_document=raw_document)
+    # Document AIリクエストを作成（必要なフィールドだけを要求すると、レスポンスの転送・デコードが軽くなる）
+    name = processor_name(project_id, location, processor_id, processor_version)
+    request = build_process_request(name, image_content, mime_type, field_mask, process_options)
     
     # Form Parser処理を実行
-    response = client.process_document(request)
+    if not client_retry:
+        return client.process_document(request=request, retry=None, timeout=timeout)
+    if timeout is not None:
+        from google.api_core import exceptions as core_exceptions
+        from google.api_core import retry as retries
+        
+        # デフォルトの再試行はタイムアウトした試行も期限なしに近い300秒まで繰り返すため、
+        # 期限内で一時的な過負荷・接続断だけを再試行する
+        retry = retries.Retry(
+            initial=1.0, maximum=10.0, multiplier=2.0, timeout=timeout,
+            predicate=retries.if_exception_type(
+                core_exceptions.ResourceExhausted, core_exceptions.ServiceUnavailable
+            ),
+        )
+        return client.process_document(request=request, retry=retry, timeout=timeout)
+    return client.process_document(request=request)
+
+
+def response_to_json(response: documentai.ProcessResponse) -> dict:
+    """
+    レスポンスをJSONの辞書（生JSONの形式）に変換
     
-    # レスポンスをJSONに変換
+    MessageToDict はレスポンス全体（座標・ページ画像を含む）を辞書にコピーするため、
+    1ページで数百ms・数十MBかかる。生JSONを出力する場合以外は呼ばない。
+    """
     from google.protobuf.json_format import MessageToDict
-    response_json = MessageToDict(response._pb)
+    return MessageToDict(response._pb)
+
+
+def response_to_outputs(response: documentai.ProcessResponse) -> tuple[documentai.Document, dict]:
+    """
+    レスポンスを (Document, JSONレスポンス) に変換
+    """
+    return response.document, response_to_json(response)
+
+
+def process_document_with_form_parser(
+    client: documentai.DocumentProcessorServiceClient,
+    project_id: str,
+    processor_id: str,
+    file_path: Path,
+    location: str = "us",
+    content: Optional[bytes] = None,
+    timeout: Optional[float] = None,
+    client_retry: bool = True,
+    processor_version: Optional[str] = None,
+    field_mask: Optional[Sequence[str]] = None,
+    process_options: Optional[documentai.ProcessOptions] = None
+) -> tuple[documentai.Document, dict]:
+    """
+    Form Parserを使用してOCR処理を実行
     
-    return response.document, response_json
+    Args:
+        client: Document AIクライアント
+        project_id: Google CloudプロジェクトID
+        processor_id: Form ParserプロセッサID
+        file_path: 処理する画像ファイルのパス
+        location: Document AIのリージョン
+        content: 先読み済みのファイル内容（Noneの場合はfile_pathから読み込む）
+        timeout: リクエストの期限（秒、再試行を含む全体）。超えた場合は google.api_core.exceptions.DeadlineExceeded
+                 などの例外になる（Noneの場合はクライアントライブラリのデフォルト: 再試行を含めて最大300秒）
+        client_retry: Falseの場合はクライアントライブラリ側で再試行しない
+                      （util/resilience.py の ResilientCaller などで再試行・レート制限を行う場合。timeout は1回の試行の期限になる）
+        processor_version: プロセッサバージョンID（Noneの場合はデフォルトバージョン）
+        field_mask: レスポンスに含めるフィールドのパス（None=全フィールド。field_mask_for_outputs()）
+        process_options: ページ指定・OCR設定（build_process_options()）
+        
+    Returns:
+        tuple[Document, dict]: OCR処理結果とJSONレスポンス
+    """
+    response = send_form_parser_request(
+        client, project_id, processor_id, file_path, location, content,
+        timeout=timeout, client_retry=client_retry, processor_version=processor_version,
+        field_mask=field_mask, process_options=process_options
+    )
+    return response_to_outputs(response)
 
 
 def extract_form_fields_from_response(document_ai_response: Dict) -> Dict[str, Any]:
@@ -205,6 +414,89 @@ def create_combined_structured_output(document_ai_response: Dict) -> Dict[str, A
     return result
 
 
+def extract_form_fields_from_document(document: documentai.Document, full_text: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Document（protobuf）からフォームフィールドを抽出（extract_form_fields_from_response と同じ結果）
+    
+    Args:
+        document: Form Parserの Document
+        full_text: document.text（取得済みの場合）
+        
+    Returns:
+        Dict: 抽出されたフォームフィールド情報（フィールド名と値のみ）
+    """
+    from google.cloud import documentai_v1 as documentai
+    
+    # proto-plus のラッパーを経由せず、protobufのメッセージを直接参照する
+    document_pb = documentai.Document.pb(document)
+    if full_text is None:
+        full_text = document_pb.text
+    
+    all_fields = {}
+    for page in document_pb.pages:
+        for form_field in page.form_fields:
+            field_name = _extract_text_from_anchor(form_field.field_name.text_anchor, full_text)
+            field_value = _extract_text_from_anchor(form_field.field_value.text_anchor, full_text)
+            
+            if field_name and field_value:
+                all_fields[field_name] = field_value
+            elif field_value and not field_name:
+                # フィールド名がない場合は番号で管理
+                all_fields[f"フィールド_{len(all_fields) + 1}"] = field_value
+    
+    return all_fields
+
+
+def extract_entities_from_document(document: documentai.Document) -> Dict[str, Any]:
+    """
+    Document（protobuf）からエンティティを抽出（extract_entities_from_response と同じ結果）
+    
+    Returns:
+        Dict: 抽出されたエンティティ情報（タイプと値のみ）
+    """
+    from google.cloud import documentai_v1 as documentai
+    
+    extracted_entities = {}
+    for entity in documentai.Document.pb(document).entities:
+        mention_text = entity.mention_text.strip()
+        if mention_text:  # 空でないテキストのみ
+            extracted_entities.setdefault(entity.type_ or "Unknown", []).append(mention_text)
+    
+    return extracted_entities
+
+
+def create_structured_output_from_document(document: documentai.Document) -> Dict[str, Any]:
+    """
+    Document（protobuf）から構造化データを作成（create_combined_structured_output と同じ結果）
+    
+    MessageToDict を経由しないため、レスポンス全体を辞書にコピーせずに済みます。
+    
+    Args:
+        document: Form Parserの Document（response.document）
+        
+    Returns:
+        Dict: 統合された構造化データ（フィールドと値のみ）
+    """
+    result = extract_form_fields_from_document(document)
+    
+    # エンティティを追加（複数の値がある場合は配列、1つの場合は文字列）
+    for entity_type, entity_values in extract_entities_from_document(document).items():
+        result[entity_type] = entity_values[0] if len(entity_values) == 1 else entity_values
+    
+    return result
+
+
+def _extract_text_from_anchor(text_anchor, full_text: str) -> str:
+    """テキストアンカー（protobuf）からテキストを抽出"""
+    extracted_texts = []
+    for segment in text_anchor.text_segments:
+        text = full_text[segment.start_index:segment.end_index].strip()
+        if text:
+            extracted_texts.append(text)
+    
+    return " ".join(extracted_texts)
+
+
 def _extract_text_from_layout(layout: Dict, full_text: str) -> str:
     """レイアウト情報からテキストを抽出"""
     text_anchor = layout.get("textAnchor", {})
@@ -226,6 +518,52 @@ def _extract_text_from_layout(layout: Dict, full_text: str) -> str:
 
 
 if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        # 保存済みの生JSONで、構造化JSONの作成時間とピークメモリを比較する
+        # 使い方: python lib/form_parser_processor.py bench [生JSONのディレクトリ]
+        import time
+        import tracemalloc
+        from google.cloud import documentai_v1 as documentai
+
+        result_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path(__file__).parent.parent / "documents" / "ocr_results" / "test"
+        json_paths = sorted(result_dir.glob("*_raw_response.json"))
+        if not json_paths:
+            print(f"生JSONが見つかりません: {result_dir}")
+            sys.exit(1)
+
+        def measure(func):
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return result, elapsed, peak
+
+        totals = {"dict": [0.0, 0], "proto": [0.0, 0]}
+        for json_path in json_paths:
+            response = documentai.ProcessResponse.from_json(json_path.read_text(encoding="utf-8"), ignore_unknown_fields=True)
+            from_dict, dict_time, dict_peak = measure(lambda: create_combined_structured_output(response_to_json(response)))
+            from_proto, proto_time, proto_peak = measure(lambda: create_structured_output_from_document(response.document))
+            if from_dict != from_proto:
+                print(f"[ERROR] {json_path.name}: 結果が一致しません")
+                sys.exit(1)
+            totals["dict"][0] += dict_time
+            totals["dict"][1] = max(totals["dict"][1], dict_peak)
+            totals["proto"][0] += proto_time
+            totals["proto"][1] = max(totals["proto"][1], proto_peak)
+            print(f"{json_path.name} ({json_path.stat().st_size / 1024 / 1024:.1f} MB, フィールド数: {len(from_proto)}): "
+                  f"MessageToDict {dict_time * 1000:6.1f} ms / {dict_peak / 1024 / 1024:5.1f} MB, "
+                  f"protobuf {proto_time * 1000:5.2f} ms / {proto_peak / 1024:5.1f} KB")
+
+        n = len(json_paths)
+        print(f"{n} ページの平均: MessageToDict {totals['dict'][0] / n * 1000:.1f} ms (ピーク {totals['dict'][1] / 1024 / 1024:.1f} MB), "
+              f"protobuf {totals['proto'][0] / n * 1000:.2f} ms (ピーク {totals['proto'][1] / 1024:.1f} KB), 結果は一致")
+        sys.exit(0)
+
     # テスト実行
     print("Form Parser Document AI処理モジュール（簡素化版）のテスト")
-    print("実際の処理にはForm ParserプロセッサIDが必要です")
\ No newline at end of file
+    print("実際の処理にはForm ParserプロセッサIDが必要です")
+    print("構造化JSONの作成の比較: python lib/form_parser_processor.py bench")
\ No newline at end of file
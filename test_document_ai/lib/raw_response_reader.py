@@ -0,0 +1,229 @@
+"""
+保存済みの生JSON（*_raw_response.json）から必要な部分だけを読み込むモジュール
+
+生JSONは1ページで2-4MBあり、その大半はページ画像（pages[].image）と座標（boundingPoly など）です。
+json.load はそれらをすべてPythonのオブジェクトにしてから返すため、全文・フォームフィールドを
+読み直すだけでも、ファイルごとに十数MBのメモリを使います。
+
+このモジュールは ijson のイベント（prefix, event, value）を順に読み、指定したパスの部分だけを
+生JSONと同じ形の辞書に組み立てます。それ以外の部分はPythonのオブジェクトを作らずに読み飛ばします。
+
+- 読み込むフィールド: "text", "formFields", "tables", "entities"（READ_FIELDS。必要なパスだけ）
+  または ijson のパス（例: "document.pages.item.dimension"）を直接指定する
+- 結果は create_combined_structured_output() などの辞書版の関数にそのまま渡せる
+- ピークメモリは json.load の約1/4（計測例: 4.3MB 対 16.8MB）で、多数のファイルを並列に再処理しても
+  メモリが足りなくならない。読み込み時間は json.load より遅い（計測例: 15-22 ms/ファイル 対 9.4-10.3 ms、
+  1.5-2.4倍。環境により差が縮まることもある）。速さではなくメモリのために使う
+- ijson のCのバックエンド（yajl2_c）がある場合に使う。ない場合（ijson 未インストール・Pythonのバックエンドのみ）は
+  json.load で読み込んでから同じ形に絞り込む（Pythonのバックエンドは json.load より遅いため）
+
+使用例:
+    response_json = read_raw_response(json_path)  # text, formFields, entities
+    structured = create_combined_structured_output(response_json)
+
+    # 生JSONを全部読み込む場合と比較する（結果が一致することも確認する）
+    python lib/raw_response_reader.py bench documents/ocr_results/test
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+try:
+    import ijson
+
+    # Cのバックエンドでない場合は json.load の方が速い
+    _ijson = ijson if ijson.backend in ("yajl2_c", "yajl2_cffi") else None
+except ImportError:
+    _ijson = None
+
+# 読み込むフィールド -> 必要なパス（ijsonの形式。配列の要素は "item"）
+# 辞書版の抽出関数（lib/form_parser_processor.py）が参照する部分だけを読み込む
+READ_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "text": ("document.text",),
+    "formFields": (
+        "document.pages.item.formFields.item.fieldName.textAnchor",
+        "document.pages.item.formFields.item.fieldValue.textAnchor",
+    ),
+    "tables": (
+        "document.pages.item.tables.item.headerRows.item.cells.item.layout.textAnchor",
+        "document.pages.item.tables.item.headerRows.item.cells.item.rowSpan",
+        "document.pages.item.tables.item.headerRows.item.cells.item.colSpan",
+        "document.pages.item.tables.item.bodyRows.item.cells.item.layout.textAnchor",
+        "document.pages.item.tables.item.bodyRows.item.cells.item.rowSpan",
+        "document.pages.item.tables.item.bodyRows.item.cells.item.colSpan",
+    ),
+    "entities": ("document.entities.item.type", "document.entities.item.mentionText"),
+}
+DEFAULT_FIELDS = ("text", "formFields", "entities")
+
+# 読み込みのバッファ。ijson の既定の64KBでは、ページ画像の base64 文字列（約2MB）の連結に時間がかかる
+# （同梱の生JSONで 64KB: 27 ms/ファイル、512KB: 10 ms。大きくするほどピークメモリが増える）
+BUFFER_SIZE = 512 * 1024
+
+
+def resolve_paths(fields: Iterable[str]) -> Tuple[str, ...]:
+    """フィールド名（READ_FIELDS のキー）またはパスを、読み込むパスの一覧にする"""
+    paths: List[str] = ["document.pages.item.pageNumber"]  # ページの対応が分かるよう、常に含める
+    for field in fields:
+        paths.extend(READ_FIELDS.get(field, (field,)))
+    return tuple(dict.fromkeys(paths))
+
+
+def read_raw_response(path: Path, fields: Sequence[str] = DEFAULT_FIELDS) -> Dict[str, Any]:
+    """
+    生JSONから指定したフィールドだけを読み込む
+
+    Args:
+        path: 生JSON（*_raw_response.json）のパス
+        fields: 読み込むフィールド（READ_FIELDS のキー、またはijsonのパス）
+
+    Returns:
+        生JSONと同じ形の辞書（指定したフィールドと、その親の辞書・配列だけを含む）
+    """
+    paths = resolve_paths(fields)
+    with open(path, "rb") as f:
+        if _ijson is None:
+            return prune(json.load(f), paths)
+        return _read_events(_ijson.parse(f, buf_size=BUFFER_SIZE, use_float=True), paths)
+
+
+def _read_events(events, paths: Tuple[str, ...]) -> Dict[str, Any]:
+    """ijson のイベントから、paths の部分だけを組み立てる"""
+    wanted = set(paths)
+    # paths の親（ここでは空の辞書・配列だけを作り、子は paths の部分だけを入れる）
+    parents = {"", *(path.rsplit(".", 1)[0] for path in paths)}
+    for path in paths:
+        parts = path.split(".")
+        parents.update(".".join(parts[:i]) for i in range(1, len(parts)))
+
+    relevant = wanted | parents
+
+    root: Dict[str, Any] = {}
+    # (容器, 現在のキー)。親の辞書・配列だけを積む
+    stack: List[list] = []
+    builder = None
+    depth = 0
+    for prefix, event, value in events:
+        if builder is None and prefix not in relevant:
+            continue  # 読み飛ばす部分（オブジェクトを作らない。ほとんどのイベントはここで終わる）
+        if builder is not None:
+            # 読み込む部分の途中: そのまま組み立てる
+            builder.event(event, value)
+            if event in ("start_map", "start_array"):
+                depth += 1
+            elif event in ("end_map", "end_array"):
+                depth -= 1
+                if depth == 0:
+                    _attach(stack, builder.value)
+                    builder = None
+            continue
+        if prefix in wanted:
+            if event in ("start_map", "start_array"):
+                builder = _ijson.ObjectBuilder()
+                builder.event(event, value)
+                depth = 1
+            elif event != "map_key":
+                _attach(stack, value)
+            continue
+        if event == "map_key":
+            stack[-1][1] = value
+        elif event in ("start_map", "start_array"):
+            container = {} if event == "start_map" else []
+            if stack:
+                _attach(stack, container)
+            else:
+                root = container
+            stack.append([container, None])
+        elif event in ("end_map", "end_array"):
+            stack.pop()
+    return root
+
+
+def _attach(stack: List[list], value: Any) -> None:
+    container, key = stack[-1]
+    if isinstance(container, list):
+        container.append(value)
+    else:
+        container[key] = value
+
+
+def prune(data: Any, paths: Tuple[str, ...], prefix: str = "") -> Any:
+    """json.load した辞書を、paths の部分と親の辞書・配列だけに絞り込む（ijson がない場合）"""
+    if prefix in paths:
+        return data
+    if isinstance(data, dict):
+        result = {}
+        for key, value in data.items():
+            child = f"{prefix}.{key}" if prefix else key
+            if any(path == child or path.startswith(child + ".") for path in paths):
+                result[key] = prune(value, paths, child)
+        return result
+    if isinstance(data, list):
+        child = f"{prefix}.item" if prefix else "item"
+        return [prune(value, paths, child) for value in data]
+    return data
+
+
+def backend_name() -> str:
+    """使用しているバックエンド（"ijson/yajl2_c" または "json"）"""
+    return f"ijson/{_ijson.backend}" if _ijson is not None else "json"
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+
+    # 生JSONを全部読み込む場合と、必要な部分だけを読み込む場合の比較
+    # 使い方: python lib/raw_response_reader.py bench [生JSONのディレクトリ]
+    if len(sys.argv) < 2 or sys.argv[1] != "bench":
+        print("使い方: python lib/raw_response_reader.py bench [生JSONのディレクトリ]")
+        sys.exit(1)
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from lib.form_parser_processor import create_combined_structured_output
+
+    result_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path(__file__).parent.parent / "documents" / "ocr_results" / "test"
+    json_paths = sorted(result_dir.glob("*_raw_response.json"))
+    if not json_paths:
+        print(f"生JSONが見つかりません: {result_dir}")
+        sys.exit(1)
+
+    def run(read):
+        outputs = []
+        for json_path in json_paths:
+            response_json = read(json_path)
+            outputs.append((response_json["document"].get("text", ""), create_combined_structured_output(response_json)))
+            del response_json
+        return outputs
+
+    def measure(read):
+        # 時間は tracemalloc なしで測る（tracemalloc はオブジェクトの作成を遅くする）
+        run(read)
+        start = time.perf_counter()
+        outputs = run(read)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        run(read)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return outputs, elapsed, peak
+
+    def load_all(json_path):
+        with open(json_path, "rb") as f:
+            return json.load(f)
+
+    full, full_time, full_peak = measure(load_all)
+    partial, partial_time, partial_peak = measure(read_raw_response)
+    if full != partial:
+        print("[ERROR] 全文・構造化JSONが一致しません")
+        sys.exit(1)
+
+    n = len(json_paths)
+    total_mb = sum(path.stat().st_size for path in json_paths) / 1024 / 1024
+    print(f"{n} ファイル ({total_mb:.1f} MB)、全文と構造化JSONを作成（結果は一致）")
+    print(f"json.load:                {full_time / n * 1000:6.1f} ms/ファイル, ピーク {full_peak / 1024 / 1024:5.1f} MB")
+    print(f"read_raw_response ({backend_name()}): {partial_time / n * 1000:6.1f} ms/ファイル, "
+          f"ピーク {partial_peak / 1024 / 1024:5.1f} MB")
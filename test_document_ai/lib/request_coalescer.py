@@ -0,0 +1,568 @@
+"""
+複数ページをまとめて送信するモジュール（リクエストの結合と、レスポンスのページごとの分割）
+
+通常は1ファイル（PNGの1ページ）ごとに ProcessRequest を1回送信するため、22ページの文書では
+22回の往復とリクエストごとのオーバーヘッドがかかり、クォータ（1分あたりのリクエスト数）も22回分消費します。
+このモジュールは連続するページを1つの複数ページPDFにまとめて送信し、返ってきた Document を
+ページごとの Document に分割します（テキストのオフセットとページ番号は、1ページずつ送信した場合と同じになるよう付け直す）。
+
+- まとめるのは1ページの画像（PNG・JPEG）だけ。画像の圧縮データを再エンコードせずにそのままPDFに埋め込む
+  （同梱の 3510x2481 のPNGでは、Pillowの複数ページTIFFは 1.4 倍のサイズになり、15ページで約10秒かかる）
+- 1リクエストあたりのページ数（MAX_ONLINE_PAGES）とサイズ（MAX_REQUEST_BYTES）の上限までまとめる
+- ページ数が上限を超えるPDF・複数ページTIFFは、ページ指定（individual_page_selector）で分割して並列に送信し、
+  結果を1つの Document にまとめる
+- キャッシュ済みのファイルはまとめない（キャッシュから出力を作り直す）
+
+分割後の Document の座標は、normalizedVertices は1ページずつ送信した場合と同じです。
+vertices（ピクセル）はPDFのページを描画した解像度になるため、元の画像のピクセルと一致しない場合があります。
+
+使用例:
+    units = plan_requests(entries, count_pages, max_pages=15)
+    for unit in units:
+        content, mime_type = build_request_content(unit)
+        response = send_form_parser_request(..., content=content, mime_type=mime_type)
+        documents = split_document_by_page(response.document)  # unit.entries と同じ順
+
+    # 画像をまとめたPDFが元の画像と同じ画素になることと、サイズ・作成時間を確認する
+    python lib/request_coalescer.py bench documents/images/test
+"""
+from __future__ import annotations
+
+import mimetypes
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from google.cloud import documentai_v1 as documentai
+
+# オンライン処理（process_document）の1リクエストあたりのページ数の上限（Form Parser）
+MAX_ONLINE_PAGES = 15
+# オンライン処理の1リクエストあたりのファイルサイズの上限（20MB。PDFの構造の分の余裕を残す）
+MAX_REQUEST_BYTES = 20 * 1000 * 1000
+# PDFに埋め込む画像の解像度（画像に解像度の情報がない場合。同梱のPNGは300dpiのA4）
+DEFAULT_DPI = 300
+# PDFにそのまま埋め込める画像の形式（util.payload_optimizer の formats）
+EMBED_FORMATS = ("png", "jpeg")
+
+# 分割・結合に必要なフィールド（フィールドマスクを使う場合に追加する）
+SPLIT_FIELD_MASK_PATHS = ("text", "pages.page_number", "pages.layout.text_anchor", "entities.page_anchor")
+
+_TEXT_SEGMENT = "google.cloud.documentai.v1.Document.TextAnchor.TextSegment"
+_PAGE_REF = "google.cloud.documentai.v1.Document.PageAnchor.PageRef"
+
+Entry = Tuple[Path, str]
+
+
+@dataclass
+class RequestUnit:
+    """
+    1回の送信の単位
+
+    Attributes:
+        entries: (ファイルのパス, 内容のハッシュ) のリスト。2件以上の場合は1つのPDFにまとめて送信する
+        pages: 複数ページ文書を分割して送信する場合のページ番号（1始まり。Noneの場合はファイル全体）
+        part: 分割した場合の番号（1始まり）
+        parts: 分割した数（分割しない場合は1）
+        page_count: 送信するページ数（ページ数のレート制限に使う）
+    """
+    entries: List[Entry]
+    pages: Optional[List[int]] = None
+    part: int = 1
+    parts: int = 1
+    page_count: int = 1
+
+    @property
+    def coalesced(self) -> bool:
+        """複数のファイルを1つのPDFにまとめて送信するかどうか"""
+        return len(self.entries) > 1
+
+    @property
+    def key(self) -> str:
+        """表示用の名前"""
+        name = self.entries[0][0].name
+        if self.coalesced:
+            return f"{name} ほか{len(self.entries) - 1}ファイル"
+        if self.pages is not None:
+            return f"{name}#{self.pages[0]}-{self.pages[-1]}"
+        return name
+
+
+@dataclass
+class _EmbeddedImage:
+    """PDFに埋め込む画像（圧縮データはファイルのまま）"""
+    width: int
+    height: int
+    dpi: Tuple[float, float]
+    color_space: str
+    bits: int
+    filter: str
+    decode_parms: str
+    data: bytes
+
+
+def _png_image(content: bytes, header_only: bool = False) -> Optional[_EmbeddedImage]:
+    """PNGのIDATをそのまま使える場合（インターレースなし・アルファなし・8bit以下）は _EmbeddedImage、それ以外はNone"""
+    if content[:8] != b"\x89PNG\r\n\x1a\n":
+        return None
+    pos = 8
+    width = height = 0
+    dpi = (DEFAULT_DPI, DEFAULT_DPI)
+    palette = b""
+    idat = []
+    while pos + 8 <= len(content):
+        length, chunk_type = struct.unpack(">I4s", content[pos:pos + 8])
+        data = content[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if chunk_type == b"IHDR":
+            width, height, bits, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+            if interlace or color_type not in (0, 2, 3) or bits > 8 or (color_type == 2 and bits != 8):
+                return None
+            if header_only:
+                return _EmbeddedImage(width, height, dpi, "", bits, "", "", b"")
+        elif chunk_type == b"PLTE":
+            palette = data
+        elif chunk_type == b"pHYs":
+            ppu_x, ppu_y, unit = struct.unpack(">IIB", data)
+            if unit == 1 and ppu_x and ppu_y:
+                dpi = (ppu_x * 0.0254, ppu_y * 0.0254)
+        elif chunk_type == b"IDAT":
+            idat.append(data)
+        elif chunk_type == b"IEND":
+            break
+    if not width or not idat:
+        return None
+    colors = 3 if color_type == 2 else 1
+    if color_type == 3:
+        color_space = f"[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{palette.hex()}>]"
+    else:
+        color_space = "/DeviceRGB" if color_type == 2 else "/DeviceGray"
+    decode_parms = f"<< /Predictor 15 /Colors {colors} /BitsPerComponent {bits} /Columns {width} >>"
+    return _EmbeddedImage(width, height, dpi, color_space, bits, "/FlateDecode", decode_parms, b"".join(idat))
+
+
+def _jpeg_image(content: bytes, header_only: bool = False) -> Optional[_EmbeddedImage]:
+    """JPEG（グレースケール・RGB）は _EmbeddedImage、それ以外（CMYKなど）はNone"""
+    if content[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    dpi = (DEFAULT_DPI, DEFAULT_DPI)
+    while pos + 4 <= len(content):
+        if content[pos] != 0xFF:
+            return None
+        marker = content[pos + 1]
+        if marker == 0xFF:
+            pos += 1  # 埋め草
+            continue
+        length = struct.unpack(">H", content[pos + 2:pos + 4])[0]
+        data = content[pos + 4:pos + 2 + length]
+        if marker == 0xE0 and data[:5] == b"JFIF\x00" and len(data) >= 12:
+            unit, x_density, y_density = struct.unpack(">BHH", data[7:12])
+            if x_density and y_density and unit in (1, 2):
+                scale = 1.0 if unit == 1 else 2.54
+                dpi = (x_density * scale, y_density * scale)
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            bits, height, width, components = struct.unpack(">BHHB", data[:6])
+            if components not in (1, 3) or bits != 8:
+                return None
+            color_space = "/DeviceRGB" if components == 3 else "/DeviceGray"
+            return _EmbeddedImage(width, height, dpi, color_space, 8, "/DCTDecode", "",
+                                  b"" if header_only else content)
+        pos += 2 + length
+    return None
+
+
+def _embedded_image(content: bytes, header_only: bool = False) -> Optional[_EmbeddedImage]:
+    return _png_image(content, header_only) or _jpeg_image(content, header_only)
+
+
+def can_embed(path: Path) -> bool:
+    """PDFにそのまま埋め込める1ページの画像かどうか（ファイルの先頭だけを読む）"""
+    from util.page_range import MULTIPAGE_EXTS
+
+    if Path(path).suffix.lower() in MULTIPAGE_EXTS:
+        return False
+    try:
+        with open(path, "rb") as f:
+            header = f.read(64 * 1024)
+    except OSError:
+        return False
+    return _embedded_image(header, header_only=True) is not None
+
+
+def images_to_pdf(contents: Sequence[bytes]) -> bytes:
+    """
+    画像（PNG・JPEG）を1ページずつ並べたPDFを作成（画像の圧縮データは再エンコードしない）
+
+    ページの大きさは画像の解像度（ない場合は DEFAULT_DPI）から求める。
+
+    Raises:
+        ValueError: そのまま埋め込めない画像が含まれる場合
+    """
+    images = []
+    for i, content in enumerate(contents):
+        image = _embedded_image(content)
+        if image is None:
+            raise ValueError(f"PDFに埋め込めない画像です（{i + 1}番目）")
+        images.append(image)
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets: List[int] = []
+
+    def add(body: bytes, stream: Optional[bytes] = None) -> None:
+        offsets.append(len(out))
+        out.extend(f"{len(offsets)} 0 obj\n".encode("ascii") + body)
+        if stream is not None:
+            out.extend(b"\nstream\n" + stream + b"\nendstream")
+        out.extend(b"\nendobj\n")
+
+    # 1: カタログ, 2: ページツリー, 以降はページごとに (ページ, 内容, 画像)
+    page_ids = [3 + i * 3 for i in range(len(images))]
+    add(b"<< /Type /Catalog /Pages 2 0 R >>")
+    add(f"<< /Type /Pages /Kids [{' '.join(f'{n} 0 R' for n in page_ids)}] /Count {len(images)} >>".encode("ascii"))
+    for page_id, image in zip(page_ids, images):
+        width = image.width * 72 / image.dpi[0]
+        height = image.height * 72 / image.dpi[1]
+        add(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.4f} {height:.4f}] "
+            f"/Resources << /XObject << /Im0 {page_id + 2} 0 R >> >> /Contents {page_id + 1} 0 R >>".encode("ascii"))
+        contents_stream = f"q {width:.4f} 0 0 {height:.4f} 0 0 cm /Im0 Do Q".encode("ascii")
+        add(f"<< /Length {len(contents_stream)} >>".encode("ascii"), contents_stream)
+        decode_parms = f" /DecodeParms {image.decode_parms}" if image.decode_parms else ""
+        add(f"<< /Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} "
+            f"/ColorSpace {image.color_space} /BitsPerComponent {image.bits} /Filter {image.filter}{decode_parms} "
+            f"/Length {len(image.data)} >>".encode("ascii"), image.data)
+
+    xref = len(out)
+    out.extend(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode("ascii"))
+    out.extend("".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("ascii"))
+    out.extend(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii"))
+    return bytes(out)
+
+
+def plan_requests(
+    entries: Sequence[Entry],
+    page_count: Callable[[Path], int],
+    max_pages: int = MAX_ONLINE_PAGES,
+    max_bytes: int = MAX_REQUEST_BYTES,
+    standalone: Optional[Callable[[str], bool]] = None
+) -> List[RequestUnit]:
+    """
+    送信するファイルを送信の単位に分ける（入力順を保つ）
+
+    Args:
+        entries: (ファイルのパス, 内容のハッシュ) のリスト
+        page_count: 複数ページ文書のページ数を返す関数
+        max_pages: 1リクエストあたりのページ数の上限
+        max_bytes: 1つのPDFにまとめる画像のサイズの合計の上限
+        standalone: Trueを返したファイル（内容のハッシュで判定。キャッシュ済みなど）はまとめない
+
+    Returns:
+        RequestUnit のリスト
+    """
+    from util.page_range import MULTIPAGE_EXTS
+
+    units: List[RequestUnit] = []
+    group: List[Entry] = []
+    group_bytes = 0
+
+    def flush():
+        nonlocal group, group_bytes
+        if group:
+            units.append(RequestUnit(list(group), page_count=len(group)))
+        group = []
+        group_bytes = 0
+
+    for path, digest in entries:
+        if standalone is not None and standalone(digest):
+            flush()
+            units.append(RequestUnit([(path, digest)]))
+            continue
+        if path.suffix.lower() in MULTIPAGE_EXTS:
+            flush()
+            n_pages = page_count(path)
+            if n_pages <= max_pages:
+                units.append(RequestUnit([(path, digest)], page_count=n_pages))
+                continue
+            # ページ数の上限ごとに分割し、並列に送信する
+            chunks = [list(range(start, min(start + max_pages, n_pages + 1)))
+                      for start in range(1, n_pages + 1, max_pages)]
+            units.extend(RequestUnit([(path, digest)], pages=chunk, part=i + 1, parts=len(chunks),
+                                     page_count=len(chunk))
+                         for i, chunk in enumerate(chunks))
+            continue
+        size = path.stat().st_size
+        if size > max_bytes or not can_embed(path):
+            flush()
+            units.append(RequestUnit([(path, digest)]))
+            continue
+        if len(group) >= max_pages or group_bytes + size > max_bytes:
+            flush()
+        group.append((path, digest))
+        group_bytes += size
+    flush()
+    return units
+
+
+def build_request_content(unit: RequestUnit,
+                          prepare: Optional[Callable[[bytes], bytes]] = None) -> Tuple[bytes, str]:
+    """
+    送信するファイル内容とMIMEタイプ（まとめる場合はPDF、それ以外はファイルのまま）
+
+    Args:
+        prepare: まとめる画像をPDFに埋め込む前に変換する関数（送信データの最適化。PNG・JPEGを返すこと）
+    """
+    if unit.coalesced:
+        contents = [path.read_bytes() for path, _ in unit.entries]
+        if prepare is not None:
+            contents = [prepare(content) for content in contents]
+        return images_to_pdf(contents), "application/pdf"
+    path = unit.entries[0][0]
+    mime_type, _ = mimetypes.guess_type(str(path))
+    return path.read_bytes(), mime_type or "application/octet-stream"
+
+
+def chunk_process_options(
+    process_options: Optional[documentai.ProcessOptions],
+    pages: Sequence[int]
+) -> documentai.ProcessOptions:
+    """process_options（OCR設定など）にページ指定を加えたもの（元のオブジェクトは変更しない）"""
+    from google.cloud import documentai_v1 as documentai
+
+    options = documentai.ProcessOptions() if process_options is None else documentai.ProcessOptions(process_options)
+    options.individual_page_selector = documentai.ProcessOptions.IndividualPageSelector(pages=list(pages))
+    return options
+
+
+# メッセージの型 -> テキストアンカー・ページ参照を含みうるか（型ごとに1回だけ調べる）
+_ANCHOR_TYPES: Dict[str, bool] = {}
+
+
+def _may_contain_anchor(descriptor) -> bool:
+    name = descriptor.full_name
+    if name in (_TEXT_SEGMENT, _PAGE_REF):
+        return True
+    cached = _ANCHOR_TYPES.get(name)
+    if cached is not None:
+        return cached
+    # 型の参照を幅優先でたどる（Entity.properties のように再帰する型があるため）
+    seen = {name}
+    queue = [descriptor]
+    found = False
+    while queue and not found:
+        for field in queue.pop().fields:
+            child = field.message_type
+            if child is None or child.full_name in seen:
+                continue
+            if child.full_name in (_TEXT_SEGMENT, _PAGE_REF):
+                found = True
+                break
+            seen.add(child.full_name)
+            queue.append(child)
+    _ANCHOR_TYPES[name] = found
+    return found
+
+
+def _remap(message, text_offset: int, page_offset: int, text_range: Optional[Tuple[int, int]] = None) -> None:
+    """
+    メッセージ内のすべてのテキストアンカー（TextSegment）とページ参照（PageRef）を付け直す
+
+    Args:
+        text_offset: TextSegment の start_index / end_index に加える値
+        page_offset: PageRef.page に加える値
+        text_range: 指定した場合、TextSegment をこの範囲（付け直す前の位置）に収める
+    """
+    name = message.DESCRIPTOR.full_name
+    if name == _TEXT_SEGMENT:
+        start, end = message.start_index, message.end_index
+        if text_range is not None:
+            start = min(max(start, text_range[0]), text_range[1])
+            end = min(max(end, text_range[0]), text_range[1])
+        message.start_index = start + text_offset
+        message.end_index = end + text_offset
+        return
+    if name == _PAGE_REF:
+        message.page += page_offset
+        return
+    for field, value in message.ListFields():
+        child = field.message_type
+        if child is None or child.GetOptions().map_entry or not _may_contain_anchor(child):
+            continue
+        if field.is_repeated:
+            for item in value:
+                _remap(item, text_offset, page_offset, text_range)
+        else:
+            _remap(value, text_offset, page_offset, text_range)
+
+
+def _page_text_range(page, default_start: int) -> Tuple[int, int]:
+    segments = page.layout.text_anchor.text_segments
+    if not segments:
+        return default_start, default_start
+    return min(segment.start_index for segment in segments), max(segment.end_index for segment in segments)
+
+
+def _entity_page(entity, pages_ranges: List[Tuple[int, int]]) -> Optional[int]:
+    """エンティティが属するページ（0始まり）。ページ参照がない場合はテキストの位置から決める"""
+    refs = entity.page_anchor.page_refs
+    if refs:
+        return min(ref.page for ref in refs)
+    segments = entity.text_anchor.text_segments
+    if not segments:
+        return None
+    start = min(segment.start_index for segment in segments)
+    for i, (page_start, page_end) in enumerate(pages_ranges):
+        if page_start <= start < page_end:
+            return i
+    return None
+
+
+def split_document_by_page(document: documentai.Document) -> List[documentai.Document]:
+    """
+    複数ページの Document を、1ページずつ送信した場合と同じ形の Document に分割
+
+    各ページのテキストは pages[].layout.text_anchor の範囲で切り出し、そのページのすべてのテキストアンカーを
+    付け直す（page_number は1）。エンティティはページ参照（ない場合はテキストの位置）でページに振り分ける。
+    フィールドマスクを使う場合は SPLIT_FIELD_MASK_PATHS が必要。
+
+    Returns:
+        ページ順の Document のリスト
+    """
+    from google.cloud import documentai_v1 as documentai
+
+    pb = documentai.Document.pb(document)
+    if len(pb.pages) > 1 and not any(page.layout.text_anchor.text_segments for page in pb.pages) and pb.text:
+        raise ValueError("ページのテキストの範囲（pages.layout.text_anchor）がないため分割できません")
+    ranges = []
+    end = 0
+    for page in pb.pages:
+        start, end = _page_text_range(page, end)
+        ranges.append((start, end))
+
+    entities: Dict[int, list] = {}
+    for entity in pb.entities:
+        index = _entity_page(entity, ranges)
+        if index is not None:
+            entities.setdefault(index, []).append(entity)
+
+    documents = []
+    for index, (page, (start, end)) in enumerate(zip(pb.pages, ranges)):
+        split = type(pb)()
+        split.uri = pb.uri
+        split.text = pb.text[start:end]
+        split.mime_type = pb.mime_type
+        split_page = split.pages.add()
+        split_page.CopyFrom(page)
+        split_page.page_number = 1
+        _remap(split_page, -start, -index, (start, end))
+        for entity in entities.get(index, []):
+            split_entity = split.entities.add()
+            split_entity.CopyFrom(entity)
+            # 他のページへの参照は除く（1ページの Document には存在しない）
+            refs = [ref for ref in split_entity.page_anchor.page_refs if ref.page == index]
+            del split_entity.page_anchor.page_refs[:]
+            split_entity.page_anchor.page_refs.extend(refs)
+            _remap(split_entity, -start, -index, (start, end))
+        documents.append(documentai.Document.wrap(split))
+    return documents
+
+
+def merge_documents(documents: Sequence[documentai.Document]) -> documentai.Document:
+    """
+    分割して送信した Document を1つにまとめる（テキストを連結し、テキストアンカー・ページ番号を付け直す）
+
+    Args:
+        documents: ページ順の Document（ページ指定で分割して送信した結果）
+    """
+    from google.cloud import documentai_v1 as documentai
+
+    merged = documentai.Document.pb()()
+    texts = []
+    text_offset = 0
+    for document in documents:
+        pb = documentai.Document.pb(document)
+        page_offset = len(merged.pages)
+        if not merged.mime_type:
+            merged.uri = pb.uri
+            merged.mime_type = pb.mime_type
+        for page in pb.pages:
+            merged_page = merged.pages.add()
+            merged_page.CopyFrom(page)
+            merged_page.page_number = len(merged.pages)
+            _remap(merged_page, text_offset, page_offset)
+        for entity in pb.entities:
+            merged_entity = merged.entities.add()
+            merged_entity.CopyFrom(entity)
+            _remap(merged_entity, text_offset, page_offset)
+        texts.append(pb.text)
+        text_offset += len(pb.text)
+    merged.text = "".join(texts)
+    return documentai.Document.wrap(merged)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # 画像をまとめたPDFの確認（元の画像と同じ画素か・サイズ・作成時間）と、生JSONの結合 -> 分割で構造化JSONが変わらないことの確認
+    # 使い方: python lib/request_coalescer.py bench [画像ディレクトリ] [生JSONのディレクトリ]
+    if len(sys.argv) < 2 or sys.argv[1] != "bench":
+        print("使い方: python lib/request_coalescer.py bench [画像ディレクトリ] [生JSONのディレクトリ]")
+        sys.exit(1)
+
+    import numpy as np
+    from PIL import Image
+
+    project_dir = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(project_dir))
+    sys.path.insert(0, str(project_dir.parent))
+    from lib.document_store import JSON_SUFFIX, response_json_to_document
+    from lib.form_parser_processor import create_structured_output_from_document
+    from util.pdf_rasterizer import PdfRasterizer
+
+    images_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else project_dir / "documents" / "images" / "test"
+    result_dir = Path(sys.argv[3]) if len(sys.argv) > 3 else project_dir / "documents" / "ocr_results" / "test"
+    image_paths = sorted(path for path in images_dir.iterdir() if path.suffix.lower() in (".png", ".jpg", ".jpeg"))
+    units = plan_requests([(path, "") for path in image_paths], lambda path: 1)
+    print(f"{len(image_paths)} ファイル -> {len(units)} リクエスト "
+          f"(1リクエスト {MAX_ONLINE_PAGES} ページ・{MAX_REQUEST_BYTES / 1000 / 1000:.0f} MB まで)")
+
+    unit = max(units, key=lambda unit: len(unit.entries))
+    contents = [path.read_bytes() for path, _ in unit.entries]
+    start = time.perf_counter()
+    pdf_bytes = images_to_pdf(contents)
+    elapsed = time.perf_counter() - start
+    print(f"PDFの作成: {len(contents)} ページ, 画像 {sum(map(len, contents)) / 1024 / 1024:.1f} MB -> "
+          f"PDF {len(pdf_bytes) / 1024 / 1024:.1f} MB, {elapsed * 1000:.1f} ms")
+
+    # PDFのページを画像の解像度で描画し、元の画像と画素が一致することを確認する
+    with PdfRasterizer(data=pdf_bytes) as pdf:
+        for number, (path, _) in enumerate(unit.entries, start=1):
+            with Image.open(path) as img:
+                expected = np.asarray(img.convert("RGB"))[:, :, ::-1]
+                dpi = img.info.get("dpi", (DEFAULT_DPI, DEFAULT_DPI))[0]
+            rendered = pdf.render(number, dpi=round(dpi))
+            if rendered.shape != expected.shape or not np.array_equal(rendered, expected):
+                diff = np.abs(rendered.astype(int) - expected.astype(int)).max() if rendered.shape == expected.shape else "-"
+                print(f"[ERROR] {path.name}: 画素が一致しません (描画 {rendered.shape}, 元 {expected.shape}, 最大差 {diff})")
+                sys.exit(1)
+    print("PDFの各ページは元の画像と画素が一致しました")
+
+    # 保存済みの生JSONを1つの Document に結合し、ページごとに分割し直して構造化JSON・全文を比較する
+    json_paths = sorted(result_dir.glob(f"*{JSON_SUFFIX}"))
+    if not json_paths:
+        sys.exit(0)
+    documents = [response_json_to_document(path.read_text(encoding="utf-8")) for path in json_paths]
+    start = time.perf_counter()
+    merged = merge_documents(documents)
+    merge_time = time.perf_counter() - start
+    start = time.perf_counter()
+    split = split_document_by_page(merged)
+    split_time = time.perf_counter() - start
+    for path, original, restored in zip(json_paths, documents, split):
+        if (original.text != restored.text
+                or create_structured_output_from_document(original) != create_structured_output_from_document(restored)):
+            print(f"[ERROR] {path.name}: 分割後の全文・構造化JSONが一致しません")
+            sys.exit(1)
+    print(f"生JSON {len(json_paths)} ファイルを結合 ({len(merged.pages)} ページ, {merge_time * 1000:.0f} ms) -> "
+          f"分割 ({split_time * 1000:.0f} ms): 全文・構造化JSONは一致しました")
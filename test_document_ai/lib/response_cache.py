@@ -0,0 +1,194 @@
+"""
+Document AIレスポンスのキャッシュモジュール
+
+同じ内容のファイルを同じプロセッサ（バージョン）で処理した結果をディスクに保存し、
+再実行・出力先の変更・出力フラグの変更のたびに Form Parser へ再送信（再課金）しないようにします。
+
+- キー: SHA-256(ファイル内容のSHA-256, プロセッサID, プロセッサバージョン, リクエストの設定)
+  ファイル名・パスには依存しないため、別のフォルダに置いた同じファイルもヒットする
+  リクエストの設定（フィールドマスク・ページ指定・OCR設定）が違うレスポンスは別のエントリになる
+- 値: ProcessResponse をシリアライズしたバイト列（cache_dir/キーの先頭2文字/キー.pb）
+- 保存量が max_mb を超えると、最後に使われてから最も時間が経ったものから削除する（LRU、更新時刻で管理）
+
+processor_version を指定しない場合はデフォルトバージョンとして扱います。
+Google側でデフォルトバージョンが更新されても古い結果が返るため、結果を固定したい場合は
+バージョンを明示してください。
+
+使用例:
+    cache = ResponseCache(cache_dir, processor_id, processor_version=None, max_mb=1024)
+    response = cache.get(content_hash)
+    if response is None:
+        response = send_form_parser_request(...)
+        cache.put(content_hash, response)
+    print(cache.stats.summary())
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from google.cloud import documentai_v1 as documentai
+
+
+@dataclass
+class CacheStats:
+    """
+    キャッシュの集計（1回の実行分）
+
+    Attributes:
+        hits: ヒット数（Form Parserへの送信を省略した数）
+        misses: ミス数
+        pages_saved: ヒットしたレスポンスのページ数の合計（課金を省略したページ数）
+        stores: 保存数
+        evictions: 容量超過で削除した数
+    """
+    hits: int = 0
+    misses: int = 0
+    pages_saved: int = 0
+    stores: int = 0
+    evictions: int = 0
+
+    def summary(self) -> str:
+        return (f"ヒット={self.hits}, ミス={self.misses}, 節約したページ数={self.pages_saved}, "
+                f"保存={self.stores}, 削除={self.evictions}")
+
+
+def cache_key(content_hash: str, processor_id: str, processor_version: Optional[str] = None,
+              variant: str = "") -> str:
+    """
+    キャッシュのキー（ファイル内容のSHA-256・プロセッサID・バージョン・リクエストの設定から作る）
+
+    Args:
+        variant: レスポンスに影響するリクエストの設定（lib.form_parser_processor.request_variant()。既定の設定では空文字）
+    """
+    source = f"{content_hash}\0{processor_id}\0{processor_version or 'default'}"
+    if variant:
+        source += f"\0{variant}"
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    ディスク上のレスポンスキャッシュ（スレッドセーフ。並列送信のワーカーから呼ばれる）
+    """
+
+    def __init__(self, cache_dir: Path, processor_id: str, processor_version: Optional[str] = None,
+                 max_mb: float = 1024, variant: str = ""):
+        """
+        Args:
+            cache_dir: キャッシュの保存先（複数の出力ディレクトリ・実行で共有できる）
+            processor_id: Form ParserプロセッサID
+            processor_version: プロセッサバージョンID（Noneの場合はデフォルトバージョン）
+            max_mb: 保存量の上限（MB）
+            variant: レスポンスに影響するリクエストの設定（cache_key() を参照）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.processor_id = processor_id
+        self.processor_version = processor_version
+        self.variant = variant
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+        # 既存のエントリを古い順に並べる（キー -> サイズ）
+        entries = []
+        for path in self.cache_dir.glob("*/*.pb"):
+            stat = path.stat()
+            entries.append((stat.st_mtime_ns, path.stem, stat.st_size))
+        self._index: "OrderedDict[str, int]" = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._total = sum(self._index.values())
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.pb"
+
+    def has(self, content_hash: str) -> bool:
+        """キャッシュ済みかどうか（集計・LRUの順序は変えない）"""
+        key = cache_key(content_hash, self.processor_id, self.processor_version, self.variant)
+        with self._lock:
+            return key in self._index
+
+    def get(self, content_hash: str) -> Optional[documentai.ProcessResponse]:
+        """
+        キャッシュ済みのレスポンスを取得（ない場合はNone）
+
+        Args:
+            content_hash: ファイル内容のSHA-256（util.manifest.RunManifest.content_hash）
+        """
+        key = cache_key(content_hash, self.processor_id, self.processor_version, self.variant)
+        path = self._path(key)
+        with self._lock:
+            if key not in self._index:
+                self.stats.misses += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            response = documentai.ProcessResponse.deserialize(path.read_bytes())
+            os.utime(path)  # LRUの順序をディスクにも残す（次回の実行で引き継ぐ）
+        except Exception:
+            # 削除済み・壊れたエントリはミスとして扱い、次の保存で置き換える
+            self._remove(key)
+            with self._lock:
+                self.stats.misses += 1
+            return None
+        with self._lock:
+            self.stats.hits += 1
+            self.stats.pages_saved += len(response.document.pages)
+        return response
+
+    def put(self, content_hash: str, response: documentai.ProcessResponse) -> None:
+        """レスポンスを保存し、上限を超えた分を古いものから削除"""
+        key = cache_key(content_hash, self.processor_id, self.processor_version, self.variant)
+        path = self._path(key)
+        data = documentai.ProcessResponse.serialize(response)
+        if len(data) > self.max_bytes:
+            return
+        path.parent.mkdir(exist_ok=True)
+        # 書き込み途中のファイルが読まれないよう、一時ファイルに書いてから置き換える
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        evict = []
+        with self._lock:
+            self._total += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self.stats.stores += 1
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old_key, size = self._index.popitem(last=False)
+                self._total -= size
+                self.stats.evictions += 1
+                evict.append(old_key)
+        for old_key in evict:
+            self._path(old_key).unlink(missing_ok=True)
+
+    def _remove(self, key: str) -> None:
+        with self._lock:
+            self._total -= self._index.pop(key, 0)
+        self._path(key).unlink(missing_ok=True)
+
+    @property
+    def size_bytes(self) -> int:
+        """現在の保存量（バイト）"""
+        return self._total
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+if __name__ == "__main__":
+    # キャッシュの件数・保存量を表示する
+    # 使い方: python lib/response_cache.py <キャッシュディレクトリ>
+    import sys
+
+    if len(sys.argv) < 2:
+        print("使い方: python lib/response_cache.py <キャッシュディレクトリ>")
+        sys.exit(1)
+
+    cache = ResponseCache(Path(sys.argv[1]), processor_id="")
+    print(f"{cache.cache_dir}: {len(cache)} 件, {cache.size_bytes / 1024 / 1024:.1f} MB")
@@ -9,6 +9,8 @@ import sys
 # プロジェクトルートをパスに追加
 project_root = Path(__file__).parent.parent  # lib/ から test_document_ai/ へ
 sys.path.insert(0, str(project_root))
+# 共通モジュール util/ を読み込めるよう、リポジトリのルートも追加
+sys.path.insert(0, str(project_root.parent))
 
 from lib.auth_setup import setup_credentials, create_document_ai_client, create_document_ai_client_from_key_file
 from lib.document_processor import DocumentAIProcessor, TextExtractor
@@ -0,0 +1,301 @@
+"""
+Form Parserのレスポンスから表（pages[].tables）を抽出するモジュール
+
+構造化JSON（create_combined_structured_output）はフォームフィールドとエンティティのみで、表は含みません。
+このモジュールは表のセルのテキストアンカーと行・列の結合（row_span / col_span）を解決して、
+表ごとに2次元のグリッドにします。
+
+- 表ごとにCSV（"{stem}_p{ページ}_table{番号}.csv"、Excelで開けるようBOM付きUTF-8）を出力する
+- 1回の実行（バッチ）で抽出したすべての表を、セル単位の列形式のファイル（tables.npz）にまとめる
+  列: source（入力ファイル）, page, table, row, col, header（見出し行か）, text
+  再実行時は、処理したファイルの行だけを置き換える（スキップしたファイルの行は残る）
+- 集計は load_table_batch() で1回読み込むだけで、ページごとの生JSONを解析し直す必要がない
+
+結合セルは、結合された各セルに同じテキストを入れます（集計でグループの列が空にならないように）。
+
+使用例:
+    grids = extract_tables_from_document(response.document, source="page_008.png")
+    write_table_csvs(grids, output_dir, "page_008")
+    update_table_batch(output_dir / TABLE_BATCH_NAME, grids, sources=["page_008.png"])
+
+    cells = load_table_batch(output_dir / TABLE_BATCH_NAME)
+    body = cells["text"][~cells["header"] & (cells["col"] == 1)]
+
+    # 保存済みの生データ（生JSON・バイナリ）から表を抽出し直す
+    python lib/table_extractor.py documents/ocr_results/test
+    # 生JSONを毎回解析する場合と tables.npz を読み込む場合を比較
+    python lib/table_extractor.py bench documents/ocr_results/test
+"""
+from __future__ import annotations
+
+import csv
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from google.cloud import documentai_v1 as documentai
+
+TABLE_BATCH_NAME = "tables.npz"
+TABLE_COLUMNS = ("source", "page", "table", "row", "col", "header", "text")
+
+
+@dataclass
+class TableGrid:
+    """
+    1つの表のグリッド
+
+    Attributes:
+        source: 入力ファイル（マニフェストのキー。バッチファイルの source 列）
+        page: ページ番号（1始まり）
+        index: ページ内の表の番号（1始まり）
+        header_rows: 見出し行の数（rows の先頭から）
+        rows: セルのテキスト（行 x 列。すべての行は同じ列数）
+    """
+    source: str
+    page: int
+    index: int
+    header_rows: int
+    rows: List[List[str]]
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.rows)
+
+    @property
+    def n_cols(self) -> int:
+        return len(self.rows[0]) if self.rows else 0
+
+    def csv_name(self, stem: str) -> str:
+        """CSVのファイル名（stem は出力ファイル名の基部）"""
+        return f"{stem}_p{self.page}_table{self.index}.csv"
+
+
+def extract_tables_from_document(document: documentai.Document, source: str = "") -> List[TableGrid]:
+    """
+    Document からすべての表を抽出
+
+    Args:
+        document: Form Parserの Document（フィールドマスクを使う場合は FIELD_MASK_PROFILES["tables"] が必要）
+        source: 入力ファイル（TableGrid.source）
+
+    Returns:
+        ページ順・ページ内の順の TableGrid のリスト
+    """
+    from google.cloud import documentai_v1 as documentai
+
+    document_pb = documentai.Document.pb(document)
+    full_text = document_pb.text
+    grids = []
+    for page_idx, page in enumerate(document_pb.pages):
+        page_number = page.page_number or page_idx + 1
+        for table_idx, table in enumerate(page.tables):
+            rows = list(table.header_rows) + list(table.body_rows)
+            grids.append(TableGrid(
+                source=source,
+                page=page_number,
+                index=table_idx + 1,
+                header_rows=len(table.header_rows),
+                rows=_rows_to_grid(rows, full_text),
+            ))
+    return grids
+
+
+def _rows_to_grid(rows, full_text: str) -> List[List[str]]:
+    """表の行（TableRow）を、結合セルを展開したグリッドにする"""
+    cells: Dict[Tuple[int, int], str] = {}
+    for r, row in enumerate(rows):
+        c = 0
+        for cell in row.cells:
+            # 上の行から縦に結合されたセルが占めている列は飛ばす
+            while (r, c) in cells:
+                c += 1
+            text = _cell_text(cell.layout.text_anchor, full_text)
+            row_span = max(1, cell.row_span)
+            col_span = max(1, cell.col_span)
+            for dr in range(min(row_span, len(rows) - r)):
+                for dc in range(col_span):
+                    cells[(r + dr, c + dc)] = text
+            c += col_span
+
+    n_cols = max((c for _, c in cells), default=-1) + 1
+    return [[cells.get((r, c), "") for c in range(n_cols)] for r in range(len(rows))]
+
+
+def _cell_text(text_anchor, full_text: str) -> str:
+    """セルのテキストアンカーからテキストを抽出（複数のセグメントは空白で結合）"""
+    texts = []
+    for segment in text_anchor.text_segments:
+        text = full_text[segment.start_index:segment.end_index].strip()
+        if text:
+            texts.append(text)
+    return " ".join(texts)
+
+
+def write_table_csvs(grids: Iterable[TableGrid], output_dir: Path, stem: str) -> List[Path]:
+    """
+    表ごとにCSVを出力
+
+    Args:
+        grids: extract_tables_from_document() の結果
+        output_dir: 出力ディレクトリ
+        stem: 出力ファイル名の基部（入力ファイル名の拡張子なし）
+
+    Returns:
+        出力したCSVのパス
+    """
+    paths = []
+    for grid in grids:
+        path = Path(output_dir) / grid.csv_name(stem)
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            csv.writer(f).writerows(grid.rows)
+        paths.append(path)
+    return paths
+
+
+def grids_to_columns(grids: Iterable[TableGrid]) -> Dict[str, np.ndarray]:
+    """TableGrid をセル単位の列（TABLE_COLUMNS）に変換"""
+    values: Dict[str, list] = {name: [] for name in TABLE_COLUMNS}
+    for grid in grids:
+        for r, row in enumerate(grid.rows):
+            for c, text in enumerate(row):
+                values["source"].append(grid.source)
+                values["page"].append(grid.page)
+                values["table"].append(grid.index)
+                values["row"].append(r)
+                values["col"].append(c)
+                values["header"].append(r < grid.header_rows)
+                values["text"].append(text)
+    return {
+        "source": np.array(values["source"], dtype=str),
+        "page": np.array(values["page"], dtype=np.int32),
+        "table": np.array(values["table"], dtype=np.int32),
+        "row": np.array(values["row"], dtype=np.int32),
+        "col": np.array(values["col"], dtype=np.int32),
+        "header": np.array(values["header"], dtype=bool),
+        "text": np.array(values["text"], dtype=str),
+    }
+
+
+def load_table_batch(path: Path) -> Dict[str, np.ndarray]:
+    """
+    バッチファイル（tables.npz）を読み込む
+
+    Returns:
+        列名 -> 配列（TABLE_COLUMNS。ファイルがない場合は空の配列）
+    """
+    path = Path(path)
+    if not path.exists():
+        return grids_to_columns([])
+    with np.load(path) as data:
+        return {name: data[name] for name in TABLE_COLUMNS}
+
+
+def update_table_batch(path: Path, grids: Iterable[TableGrid], sources: Optional[Iterable[str]] = None) -> int:
+    """
+    バッチファイルに表を追加（sources の既存の行は置き換える）
+
+    Args:
+        path: バッチファイルのパス（tables.npz）
+        grids: 追加する表
+        sources: 今回処理した入力ファイル（表がなかったファイルも含める。Noneの場合は grids の source）
+
+    Returns:
+        バッチファイルのセル数
+    """
+    grids = list(grids)
+    sources = set(sources) if sources is not None else {grid.source for grid in grids}
+    existing = load_table_batch(path)
+    keep = ~np.isin(existing["source"], list(sources)) if sources else np.ones(len(existing["source"]), dtype=bool)
+    added = grids_to_columns(grids)
+    columns = {name: np.concatenate([existing[name][keep], added[name]]) for name in TABLE_COLUMNS}
+
+    # 書き込み途中のファイルが読まれないよう、一時ファイルに書いてから置き換える
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp.npz")
+    np.savez_compressed(tmp_path, **columns)
+    tmp_path.replace(path)
+    return len(columns["source"])
+
+
+def table_rows(cells: Dict[str, np.ndarray], source: str, page: int = 1, table: int = 1) -> List[List[str]]:
+    """バッチファイルの列から1つの表のグリッドを取り出す（確認用）"""
+    mask = (cells["source"] == source) & (cells["page"] == page) & (cells["table"] == table)
+    if not mask.any():
+        return []
+    rows, cols, texts = cells["row"][mask], cells["col"][mask], cells["text"][mask]
+    grid = [[""] * (cols.max() + 1) for _ in range(rows.max() + 1)]
+    for r, c, text in zip(rows, cols, texts):
+        grid[r][c] = str(text)
+    return grid
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # lib.document_store を読み込むため、プロジェクトのディレクトリをパスに追加
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from lib.document_store import JSON_SUFFIX, iter_stored_documents, response_json_to_document
+
+    usage = ("使い方: python lib/table_extractor.py <出力ディレクトリ>\n"
+             "        python lib/table_extractor.py bench <出力ディレクトリ>")
+    args = sys.argv[1:]
+    bench = bool(args) and args[0] == "bench"
+    if bench:
+        args = args[1:]
+    if not args:
+        print(usage)
+        sys.exit(1)
+    result_dir = Path(args[0])
+
+    def stored_documents():
+        # (出力ファイル名の基部, Document)。同じ基部の生JSONとバイナリがある場合はバイナリを使う
+        found = {stored.stem: stored for stored in iter_stored_documents(result_dir)}
+        for json_path in sorted(result_dir.glob(f"*{JSON_SUFFIX}")):
+            found.setdefault(json_path.name[: -len(JSON_SUFFIX)], json_path)
+        for stem in sorted(found):
+            entry = found[stem]
+            if isinstance(entry, Path):
+                yield stem, response_json_to_document(entry.read_text(encoding="utf-8"))
+            else:
+                yield stem, entry.document
+
+    if not bench:
+        grids = []
+        stems = []
+        for stem, document in stored_documents():
+            page_grids = extract_tables_from_document(document, source=stem)
+            for path, grid in zip(write_table_csvs(page_grids, result_dir, stem), page_grids):
+                print(f"[OK] {path.name} ({grid.n_rows} 行 x {grid.n_cols} 列)")
+            grids += page_grids
+            stems.append(stem)
+        n_cells = update_table_batch(result_dir / TABLE_BATCH_NAME, grids, stems)
+        print(f"{len(stems)} ファイルから {len(grids)} 個の表を抽出しました ({TABLE_BATCH_NAME}: {n_cells} セル)")
+        sys.exit(0)
+
+    # ページごとに生JSONを解析して表を集める場合と、バッチファイルを1回読み込む場合の比較
+    json_paths = sorted(result_dir.glob(f"*{JSON_SUFFIX}"))
+    if not json_paths:
+        print(f"生JSONが見つかりません: {result_dir}")
+        sys.exit(1)
+    start = time.perf_counter()
+    grids = []
+    for json_path in json_paths:
+        document = response_json_to_document(json_path.read_text(encoding="utf-8"))
+        grids += extract_tables_from_document(document, source=json_path.name[: -len(JSON_SUFFIX)])
+    from_json = time.perf_counter() - start
+
+    batch_path = result_dir / TABLE_BATCH_NAME
+    update_table_batch(batch_path, grids, [path.name[: -len(JSON_SUFFIX)] for path in json_paths])
+    start = time.perf_counter()
+    cells = load_table_batch(batch_path)
+    from_batch = time.perf_counter() - start
+
+    json_mb = sum(path.stat().st_size for path in json_paths) / 1024 / 1024
+    print(f"{len(json_paths)} ファイル・{len(grids)} 個の表・{len(cells['text'])} セル")
+    print(f"生JSONを解析:     {from_json * 1000:8.1f} ms ({json_mb:.1f} MB)")
+    print(f"{TABLE_BATCH_NAME} を読み込み: {from_batch * 1000:8.1f} ms ({batch_path.stat().st_size / 1024:.1f} KB, "
+          f"{from_json / from_batch:.0f}x 速い)")
@@ -2,12 +2,49 @@ from __future__ import annotations
 
 import json
 import mimetypes
+import sys
+from dataclasses import replace
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, Sequence, Union
 
-import google.auth
-from google.api_core.client_options import ClientOptions
-from google.cloud import documentai
+# Googleのライブラリは使う関数の中で読み込む（offline モードは認証・ネットワークなしで、すぐに起動できるように）
+from lib.document_store import BINARY_SUFFIX, JSON_SUFFIX, RAW_FORMATS, save_document
+from lib.form_parser_processor import (
+    build_process_options,
+    create_combined_structured_output,
+    create_structured_output_from_document,
+    field_mask_for_outputs,
+    request_variant,
+    response_to_json,
+    send_form_parser_request,
+)
+from lib.raw_response_reader import DEFAULT_FIELDS, read_raw_response
+from lib.request_coalescer import (
+    EMBED_FORMATS,
+    SPLIT_FIELD_MASK_PATHS,
+    RequestUnit,
+    build_request_content,
+    chunk_process_options,
+    merge_documents,
+    plan_requests,
+    split_document_by_page,
+)
+from lib.table_extractor import TABLE_BATCH_NAME, extract_tables_from_document, update_table_batch, write_table_csvs
+
+# プロジェクトルート（共通モジュール util/）をパスに追加
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from util.cloud_clients import get_document_ai_client
+from util.manifest import RunManifest
+from util.page_range import MULTIPAGE_EXTS
+from util.prefetch import Prefetched, Prefetcher, read_bytes
+from util.resilience import ResilientCaller, create_caller
+from util.watch_folder import FolderWatcher, move_to_done
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+    from lib.response_cache import ResponseCache
+    # 送信データの最適化（OpenCV）は使う関数の中で読み込む（offline モードで読み込まないように）
+    from util.payload_optimizer import PayloadProfile
 
 
 def setup_document_ai_client(
@@ -17,6 +54,10 @@ def setup_document_ai_client(
     """
     Document AIクライアントをセットアップ
     
+    認証情報・gRPCチャネル・クライアントはプロセス内で共有し（util/cloud_clients.py）、
+    2回目以降はキーファイルの読み込み・トークンの取得・接続を行わない。
+    トークンはバックグラウンドで期限の前に更新される。
+    
     Args:
         location: Document AIのリージョン
         service_account_key_path: サービスアカウントキーファイルのパス（オプション）
@@ -24,32 +65,29 @@ def setup_document_ai_client(
     Returns:
         tuple: (Document AIクライアント, プロジェクトID)
     """
-    # 認証情報を取得
-    if service_account_key_path:
-        from google.oauth2 import service_account
-        credential = service_account.Credentials.from_service_account_file(
-            service_account_key_path,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"]
-        )
-        project_id = credential.project_id
-    else:
-        credential, project_id = google.auth.default()
-        auth_req = google.auth.transport.requests.Request()
-        credential.refresh(auth_req)
-    
-    # クライアントを作成
-    opts = ClientOptions(
-        api_endpoint=f"{location}-documentai.googleapis.com", 
-        quota_project_id=project_id
-    )
-    client = documentai.DocumentProcessorServiceClient(
-        client_options=opts, 
-        credentials=credential
-    )
-    
-    return client, project_id
+    return get_document_ai_client(location, service_account_key_path)
 
 
+def create_client(
+    location: str,
+    service_account_key_path: Optional[str] = None,
+    endpoint: Optional[str] = None
+) -> tuple[documentai.DocumentProcessorServiceClient, str]:
+    """
+    Document AIクライアントを作成（endpoint を指定した場合はローカルのフェイクサーバーに接続）
+    
+    Args:
+        location: Document AIのリージョン
+        service_account_key_path: サービスアカウントキーファイルのパス（オプション）
+        endpoint: ローカルサーバーのアドレス（例: "localhost:50051"。lib/fake_documentai_server.py）
+        
+    Returns:
+        tuple: (Document AIクライアント, プロジェクトID)
+    """
+    if endpoint:
+        return get_document_ai_client(endpoint=endpoint)
+    return setup_document_ai_client(location, service_account_key_path)
+
 
 def main(
     images_dir: Path, 
@@ -60,11 +98,38 @@ def main(
     service_account_key_path: Optional[str] = None,
     output_text: bool = True,
     output_raw_json: bool = True, 
-    output_structured_json: bool = True
+    output_structured_json: bool = True,
+    incremental: bool = True,
+    max_in_flight: int = 4,
+    request_timeout: Optional[float] = 120.0,
+    endpoint: Optional[str] = None,
+    rate_limits: Optional[Dict[str, Any]] = None,
+    processor_version: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+    cache_max_mb: float = 1024,
+    raw_format: str = "json",
+    field_mask: Union[str, Sequence[str], None] = "auto",
+    pages: Optional[Sequence[int]] = None,
+    ocr_config: Optional[Dict[str, Any]] = None,
+    output_tables: bool = False,
+    coalesce_pages: int = 0,
+    payload_profile: Optional[PayloadProfile] = None
 ):
     """
     Document AI Form Parserを使用してOCR処理を実行
     
+    処理状況は出力ディレクトリのマニフェスト（util/manifest.py）に記録され、
+    再実行時は処理済みのファイルをスキップします（Document AIへの再課金を防ぐ）。
+    リクエストは最大 max_in_flight 件を並列に送信し（ファイルの読み込みも各リクエストのスレッドで行う）、
+    出力の書き込みとマニフェストへの記録は入力順に行います（util/prefetch.py）。
+    送信はクォータに合わせて間隔を調整し、スロットリング・一時的な障害は再試行します（util/resilience.py）。
+    cache_dir を指定すると、同じ内容のファイルはキャッシュ済みのレスポンスから出力を作り直し、
+    Form Parserに送信しません（lib/response_cache.py）。
+    output_tables の場合は、表を1つずつCSVに出力し、実行の最後に全ファイルの表を tables.npz にまとめます
+    （lib/table_extractor.py）。
+    coalesce_pages を指定すると、連続する1ページの画像を1つのPDFにまとめて送信し、結果をページごとに分けて出力します。
+    ページ数が上限を超えるPDF・複数ページTIFFは分割して並列に送信し、結果を1つにまとめます（lib/request_coalescer.py）。
+    
     Args:
         images_dir: 処理する画像ファイルが格納されているディレクトリ
         output_dir: OCR結果のテキストファイルを保存するディレクトリ  
@@ -75,9 +140,30 @@ def main(
         output_text: テキストファイル出力フラグ
         output_raw_json: 生JSONファイル出力フラグ
         output_structured_json: 構造化JSONファイル出力フラグ
+        incremental: Trueの場合、前回から内容・設定が変わらず出力が揃っているファイルをスキップする
+        max_in_flight: 同時に送信するリクエスト数の上限（1の場合は逐次実行）
+        request_timeout: 1リクエストあたりの期限（秒、再試行を含む）。超えたファイルは失敗として記録する
+        endpoint: ローカルのフェイクサーバーのアドレス（Noneの場合は本物のDocument AIに接続）
+        rate_limits: レート制限・再試行の設定（create_resilient_caller() の引数）
+        processor_version: プロセッサバージョンID（Noneの場合はデフォルトバージョン）
+        cache_dir: レスポンスキャッシュの保存先（Noneの場合はキャッシュしない）
+        cache_max_mb: レスポンスキャッシュの保存量の上限（MB）
+        raw_format: 生データの保存形式（"json"=生JSON、"binary"=Document のバイナリ + zstd。lib/document_store.py）
+        field_mask: レスポンスに含めるフィールド（"auto"=出力フラグから必要なものだけ、None=全フィールド、またはパスのリスト）
+        pages: 処理するページ番号（PDF・複数ページTIFF。None=全ページ）
+        ocr_config: OCRの設定（documentai.OcrConfig の引数。None=プロセッサの既定）
+        output_tables: 表のCSV・tables.npz 出力フラグ
+        coalesce_pages: 1リクエストにまとめるページ数の上限（0=まとめない。pages を指定した場合はまとめない）
+        payload_profile: 1ページの画像の送信データの最適化の設定（util/payload_optimizer.py。None=ファイルのまま送信する）
     """
+    if raw_format not in RAW_FORMATS:
+        raise ValueError(f"raw_format は {RAW_FORMATS} のいずれかを指定してください: {raw_format}")
     if exts is None:
         exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
+    if coalesce_pages and pages:
+        # ページ指定はファイルごとの指定のため、まとめたPDFには使えない
+        print("[警告] pages を指定した場合は、ページをまとめて送信しません")
+        coalesce_pages = 0
     
     # ディレクトリの存在確認
     if not images_dir.exists():
@@ -95,62 +181,771 @@ def main(
         print(f"No images found in: {images_dir}")
         return
     
-    # Document AIクライアントをセットアップ
+    manifest = open_manifest(output_dir, processor_id, location, output_text, output_raw_json, output_structured_json,
+                             processor_version, raw_format, pages, ocr_config, output_tables, payload_profile)
+    request_options = resolve_request_options(field_mask, pages, ocr_config,
+                                              output_text, output_raw_json, output_structured_json, output_tables,
+                                              payload_profile)
+    cache = open_cache(cache_dir, processor_id, processor_version, cache_max_mb, request_options)
+    
+    # 処理済みのファイルを除外（全件処理済みならクライアントの初期化も省略する）
+    pending = []
+    skipped = 0
+    for img_path in image_paths:
+        digest = manifest.content_hash(img_path, img_path.name)
+        if incremental and manifest.is_up_to_date(img_path.name, digest):
+            print(f"[SKIP] {img_path.name} -> 処理済み")
+            skipped += 1
+        else:
+            pending.append((img_path, digest))
+    
+    if not pending:
+        manifest.close()
+        print(f"処理完了. 成功=0, 失敗=0, スキップ={skipped}, 合計={len(image_paths)}")
+        return
+    
+    # Document AIクライアントをセットアップ（全件キャッシュ済みなら省略する）
+    client, project_id = None, None
+    if cache is None or not all(cache.has(digest) for _, digest in pending):
+        try:
+            client, project_id = create_client(location, service_account_key_path, endpoint)
+            print(f"Document AIクライアントを初期化しました (プロジェクト: {project_id})")
+        except Exception as e:
+            print(f"Document AIクライアントの初期化に失敗: {e}")
+            print("Google Cloud認証が正しく設定されているか確認してください")
+            manifest.close()
+            return
+    
+    ok = 0
+    ng = 0
+    tables = [] if output_tables else None
+    caller = create_resilient_caller(max_in_flight, rate_limits)
+    
+    def send(entry):
+        img_path, digest = entry
+        return call_form_parser(client, project_id, processor_id, location, img_path, manifest,
+                                img_path.name, digest, timeout=request_timeout, caller=caller,
+                                cache=cache, processor_version=processor_version, **request_options)
+    
+    def send_unit(unit):
+        return call_form_parser_unit(client, project_id, processor_id, location, unit, manifest,
+                                     timeout=request_timeout, caller=caller, cache=cache,
+                                     processor_version=processor_version, **request_options)
+    
+    # 完了順ではなく入力順に結果を受け取る（先頭のリクエストが終わるまで後続の書き込みは待つ）
+    if coalesce_pages:
+        units = plan_requests(pending, count_pages, max_pages=coalesce_pages,
+                              standalone=cache.has if cache is not None else None)
+        print(f"送信: {len(pending)} ファイル -> {len(units)} リクエスト (1リクエスト最大 {coalesce_pages} ページ)")
+        dispatcher = Prefetcher(units, send_unit, depth=max(1, max_in_flight), workers=max(1, max_in_flight))
+        results = iter_unit_results(dispatcher, cache)
+    else:
+        dispatcher = Prefetcher(pending, send, depth=max(1, max_in_flight), workers=max(1, max_in_flight))
+        results = dispatcher
+    with dispatcher:
+        for dispatched in results:
+            img_path, digest = dispatched.item
+            if write_results(dispatched, img_path, output_dir, manifest, img_path.name, digest,
+                             output_text, output_raw_json, output_structured_json, raw_format, tables):
+                ok += 1
+            else:
+                ng += 1
+    
+    manifest.close()
+    print(f"処理完了. 成功={ok}, 失敗={ng}, スキップ={skipped}, 合計={len(image_paths)}")
+    if tables:
+        save_table_batch(output_dir, tables)
+    print(f"再試行・スロットリング: {caller.stats.summary()}")
+    if cache is not None:
+        print(f"レスポンスキャッシュ: {cache.stats.summary()}")
+
+
+def create_resilient_caller(max_in_flight: int, rate_limits: Optional[Dict[str, Any]] = None) -> ResilientCaller:
+    """
+    送信のレート制限・再試行を行う ResilientCaller を作成
+    
+    同時実行数は max_in_flight を上限として、スロットリングされると自動的に減らす（AIMD）。
+    
+    Args:
+        max_in_flight: 同時に送信するリクエスト数の上限
+        rate_limits: requests_per_minute, pages_per_minute, max_attempts, latency_target
+                     （util.resilience.create_caller() の引数。Noneの場合は再試行のみ）
+    """
+    return create_caller(max_concurrency=max(1, max_in_flight), **(rate_limits or {}))
+
+
+def save_table_batch(output_dir: Path, tables: List[tuple]) -> None:
+    """
+    今回の実行で抽出した表を tables.npz にまとめる（処理したファイルの行だけを置き換える）
+    
+    Args:
+        tables: write_results が追加した (マニフェストのキー, TableGrid のリスト) のリスト
+    """
+    grids = [grid for _, file_grids in tables for grid in file_grids]
+    n_cells = update_table_batch(output_dir / TABLE_BATCH_NAME, grids, [key for key, _ in tables])
+    print(f"表: {len(grids)} 個 ({len(tables)} ファイル) -> {TABLE_BATCH_NAME} ({n_cells} セル)")
+
+
+def resolve_request_options(
+    field_mask: Union[str, Sequence[str], None],
+    pages: Optional[Sequence[int]],
+    ocr_config: Optional[Dict[str, Any]],
+    output_text: bool,
+    output_raw_json: bool,
+    output_structured_json: bool,
+    output_tables: bool = False,
+    payload_profile: Optional[PayloadProfile] = None
+) -> Dict[str, Any]:
+    """
+    リクエストの設定（call_form_parser() の field_mask, process_options, payload_profile）を作成
+    
+    field_mask が "auto" の場合は、出力に必要なフィールドだけを要求する（生データを出力する場合は全フィールド）。
+    """
+    if field_mask == "auto":
+        field_mask = field_mask_for_outputs(output_text, output_raw_json, output_structured_json, output_tables)
+    return {
+        "field_mask": list(field_mask) if field_mask else None,
+        "process_options": build_process_options(pages, ocr_config),
+        "payload_profile": payload_profile,
+    }
+
+
+def open_cache(
+    cache_dir: Optional[Path],
+    processor_id: str,
+    processor_version: Optional[str],
+    cache_max_mb: float,
+    request_options: Dict[str, Any]
+) -> Optional[ResponseCache]:
+    """レスポンスキャッシュを開く（cache_dir がNoneの場合はNone）。リクエストの設定ごとに別のエントリになる"""
+    if not cache_dir:
+        return None
+    from lib.response_cache import ResponseCache
+    
+    variant = request_variant(request_options["field_mask"], request_options["process_options"])
+    if request_options.get("payload_profile") is not None:
+        # 最適化した画像のレスポンスは元のファイルのものと異なるため、別のエントリにする
+        variant = ";".join(filter(None, [variant, "payload=" + request_options["payload_profile"].describe()]))
+    return ResponseCache(cache_dir, processor_id, processor_version, cache_max_mb, variant)
+
+
+def count_pages(path: Path) -> int:
+    """ページ数のレート制限に使うページ数（PDF・複数ページTIFF以外は1）"""
+    # PDFを開くため PyMuPDF を読み込む（offline モードでは読み込まないよう、ここで読み込む）
+    from util.page_source import page_numbers
+    
     try:
-        client, project_id = setup_document_ai_client(location, service_account_key_path)
-        print(f"Document AIクライアントを初期化しました (プロジェクト: {project_id})")
+        return len(page_numbers(path))
+    except Exception:
+        return 1  # 開けないファイルは送信時のエラーに任せる
+
+
+def open_manifest(
+    output_dir: Path,
+    processor_id: str,
+    location: str,
+    output_text: bool,
+    output_raw_json: bool,
+    output_structured_json: bool,
+    processor_version: Optional[str] = None,
+    raw_format: str = "json",
+    pages: Optional[Sequence[int]] = None,
+    ocr_config: Optional[Dict[str, Any]] = None,
+    output_tables: bool = False,
+    payload_profile: Optional[PayloadProfile] = None
+) -> RunManifest:
+    """出力ディレクトリのマニフェストを開く（プロセッサ・出力フラグが変わると再処理される）"""
+    settings = {
+        "processor_id": processor_id,
+        "location": location,
+        "output_text": output_text,
+        "output_raw_json": output_raw_json,
+        "output_structured_json": output_structured_json,
+    }
+    if processor_version:
+        # デフォルトバージョンのまま使う既存のマニフェストは再処理にならないよう、指定した場合だけ含める
+        settings["processor_version"] = processor_version
+    if raw_format != "json":
+        settings["raw_format"] = raw_format
+    if output_tables:
+        settings["output_tables"] = output_tables
+    # フィールドマスクは出力の内容を変えないので含めない（ページ指定・OCR設定は変える）
+    if pages:
+        settings["pages"] = list(pages)
+    if ocr_config:
+        settings["ocr_config"] = ocr_config
+    if payload_profile is not None:
+        settings["payload"] = payload_profile.to_dict()
+    return RunManifest(output_dir, engine="documentai-form-parser", settings=settings)
+
+
+def call_form_parser(
+    client: documentai.DocumentProcessorServiceClient,
+    project_id: str,
+    processor_id: str,
+    location: str,
+    img_path: Path,
+    manifest: RunManifest,
+    key: str,
+    digest: str,
+    content: Optional[bytes] = None,
+    timeout: Optional[float] = None,
+    caller: Optional[ResilientCaller] = None,
+    cache: Optional[ResponseCache] = None,
+    processor_version: Optional[str] = None,
+    field_mask: Optional[Sequence[str]] = None,
+    process_options: Optional[documentai.ProcessOptions] = None,
+    payload_profile: Optional[PayloadProfile] = None
+) -> documentai.ProcessResponse:
+    """
+    1ファイルをForm Parserに送信（並列送信時はワーカースレッドで実行される）
+    
+    Args:
+        content: 先読み済みのファイル内容（Noneの場合はファイルから読み込む）
+        timeout: リクエストの期限（秒、再試行を含む）
+        caller: レート制限・再試行を行う ResilientCaller（Noneの場合はクライアントライブラリの再試行のみ）
+        cache: レスポンスキャッシュ（ヒットした場合は送信しない。Noneの場合はキャッシュしない）
+        processor_version: プロセッサバージョンID（Noneの場合はデフォルトバージョン）
+        field_mask: レスポンスに含めるフィールドのパス（None=全フィールド）
+        process_options: ページ指定・OCR設定
+        payload_profile: 送信データの最適化の設定（1ページの画像だけに適用する。None=ファイルのまま送信する）
+    
+    Returns:
+        documentai.ProcessResponse: レスポンス（JSONへの変換は write_results で必要な場合だけ行う）
+    """
+    print(f"処理中: {key}")
+    manifest.mark_running(key, digest, img_path)
+    if cache is not None:
+        response = cache.get(digest)
+        if response is not None:
+            print(f"[CACHE] {key} -> キャッシュ済みのレスポンスを使用 ({len(response.document.pages)} ページ)")
+            return response
+    if content is None:
+        content = read_bytes(img_path)
+    mime_type = None
+    if payload_profile is not None and img_path.suffix.lower() not in MULTIPAGE_EXTS:
+        from util.payload_optimizer import optimize_payload
+        
+        optimized = optimize_payload(content, payload_profile, mimetypes.guess_type(str(img_path))[0])
+        content, mime_type = optimized.content, optimized.mime_type
+    
+    # Form Parserを使用してDocument AIのモデル側で構造抽出（パターンマッチング不使用）
+    def attempt(remaining: Optional[float]):
+        return send_form_parser_request(
+            client, project_id, processor_id, img_path, location, content,
+            timeout=remaining, client_retry=caller is None, processor_version=processor_version,
+            field_mask=field_mask, process_options=process_options, mime_type=mime_type
+        )
+    
+    if caller is None:
+        response = attempt(timeout)
+    else:
+        pages = count_pages(img_path) if caller.pages is not None else 1
+        response = caller.call(attempt, pages=pages, deadline=timeout, name=key)
+    if cache is not None:
+        cache.put(digest, response)
+    return response
+
+
+def call_form_parser_unit(
+    client: documentai.DocumentProcessorServiceClient,
+    project_id: str,
+    processor_id: str,
+    location: str,
+    unit: RequestUnit,
+    manifest: RunManifest,
+    timeout: Optional[float] = None,
+    caller: Optional[ResilientCaller] = None,
+    cache: Optional[ResponseCache] = None,
+    processor_version: Optional[str] = None,
+    field_mask: Optional[Sequence[str]] = None,
+    process_options: Optional[documentai.ProcessOptions] = None,
+    payload_profile: Optional[PayloadProfile] = None
+) -> List[documentai.ProcessResponse]:
+    """
+    送信の単位（lib/request_coalescer.py の RequestUnit）をForm Parserに送信（並列送信時はワーカースレッドで実行される）
+    
+    複数のファイルをまとめた場合は、レスポンスをページごとに分けてファイルごとのレスポンスにし、それぞれキャッシュに保存する。
+    分割して送信した複数ページ文書の場合は、その部分のレスポンスを返す（1つにまとめるのは iter_unit_results）。
+    引数は call_form_parser と同じ。
+    
+    Returns:
+        レスポンスのリスト（unit.entries と同じ順。分割して送信した場合はその部分の1件）
+    """
+    if not unit.coalesced and unit.pages is None:
+        img_path, digest = unit.entries[0]
+        return [call_form_parser(client, project_id, processor_id, location, img_path, manifest,
+                                 img_path.name, digest, timeout=timeout, caller=caller, cache=cache,
+                                 processor_version=processor_version, field_mask=field_mask,
+                                 process_options=process_options, payload_profile=payload_profile)]
+    
+    print(f"処理中: {unit.key} ({unit.page_count} ページ)")
+    for img_path, digest in unit.entries:
+        manifest.mark_running(img_path.name, digest, img_path)
+    prepare = None
+    if payload_profile is not None and unit.coalesced:
+        from util.payload_optimizer import optimize_payload
+        
+        # まとめたPDFに埋め込めるのは PNG・JPEG だけ（2値はTIFF G4ではなく1bitのPNGになる）
+        embed_profile = replace(payload_profile, formats=EMBED_FORMATS)
+        prepare = lambda data: optimize_payload(data, embed_profile).content
+    content, mime_type = build_request_content(unit, prepare)
+    if unit.pages is not None:
+        process_options = chunk_process_options(process_options, unit.pages)
+    if field_mask:
+        # ページごとに分ける・1つにまとめるために、ページのテキストの範囲などが必要
+        field_mask = sorted(set(field_mask) | set(SPLIT_FIELD_MASK_PATHS))
+    
+    def attempt(remaining: Optional[float]):
+        return send_form_parser_request(
+            client, project_id, processor_id, unit.entries[0][0], location, content,
+            timeout=remaining, client_retry=caller is None, processor_version=processor_version,
+            field_mask=field_mask, process_options=process_options, mime_type=mime_type
+        )
+    
+    if caller is None:
+        response = attempt(timeout)
+    else:
+        response = caller.call(attempt, pages=unit.page_count, deadline=timeout, name=unit.key)
+    if not unit.coalesced:
+        return [response]
+    
+    from google.cloud import documentai
+    
+    documents = split_document_by_page(response.document)
+    if len(documents) != len(unit.entries):
+        raise ValueError(f"レスポンスのページ数が送信したページ数と一致しません: {len(documents)} / {len(unit.entries)}")
+    responses = [documentai.ProcessResponse(document=document) for document in documents]
+    if cache is not None:
+        for (_, digest), page_response in zip(unit.entries, responses):
+            cache.put(digest, page_response)
+    return responses
+
+
+def iter_unit_results(dispatched_units, cache: Optional[ResponseCache] = None):
+    """
+    送信の単位ごとの結果を、ファイルごとの結果（Prefetched。item は (ファイルのパス, 内容のハッシュ)）に展開する
+    
+    分割して送信した複数ページ文書は、すべての部分が揃ってから1つのレスポンスにまとめる（まとめたものはキャッシュに保存する）。
+    いずれかの部分が失敗した場合は、そのファイルを失敗とする。
+    """
+    parts = []
+    for dispatched in dispatched_units:
+        unit = dispatched.item
+        if unit.parts > 1:
+            parts.append(dispatched)
+            if unit.part < unit.parts:
+                continue
+            entry = unit.entries[0]
+            try:
+                from google.cloud import documentai
+                
+                documents = [part.result()[0].document for part in parts]
+                response = documentai.ProcessResponse(document=merge_documents(documents))
+                if cache is not None:
+                    cache.put(entry[1], response)
+                result = Prefetched(entry, response)
+            except Exception as e:
+                result = Prefetched(entry, error=e)
+            parts = []
+            yield result
+        elif dispatched.error is not None:
+            for entry in unit.entries:
+                yield Prefetched(entry, error=dispatched.error)
+        else:
+            for entry, response in zip(unit.entries, dispatched.value):
+                yield Prefetched(entry, response)
+
+
+def write_results(
+    dispatched: Prefetched,
+    img_path: Path,
+    output_dir: Path,
+    manifest: RunManifest,
+    key: str,
+    digest: str,
+    output_text: bool = True,
+    output_raw_json: bool = True,
+    output_structured_json: bool = True,
+    raw_format: str = "json",
+    tables: Optional[list] = None
+) -> bool:
+    """
+    Form Parserの結果を出力し、マニフェストに記録
+    
+    Args:
+        dispatched: call_form_parser の結果（失敗した場合はその例外を持つ。まとめて送信した場合は iter_unit_results の結果）
+        raw_format: 生データの保存形式（"json" または "binary"）
+        tables: 表を出力する場合のリスト（表のCSVを出力し、(key, TableGrid のリスト) を追加する。Noneの場合は出力しない）
+    
+    Returns:
+        成功した場合True
+    """
+    try:
+        response = dispatched.result()
+        document = response.document
+        
+        # 出力カウント
+        generated_files = []
+        output_paths = []
+        
+        # 1. テキストファイル出力（フラグ制御）
+        if output_text:
+            full_text = document.text if document.text else ""
+            text_file = output_dir / f"{img_path.stem}_text.txt"
+            text_file.write_text(full_text, encoding="utf-8")
+            output_paths.append(text_file)
+            generated_files.append(f"テキスト: {text_file.name} ({len(full_text)} 文字)")
+        
+        # 2. 生データ出力（フラグ制御）。binary の場合は Document をバイナリ + zstd で保存（生JSONの1/10以下）
+        if output_raw_json and raw_format == "binary":
+            binary_file = save_document(document, output_dir / f"{img_path.stem}{BINARY_SUFFIX}")
+            output_paths.append(binary_file)
+            generated_files.append(f"生データ: {binary_file.name} ({binary_file.stat().st_size} bytes)")
+        elif output_raw_json:
+            json_file = output_dir / f"{img_path.stem}{JSON_SUFFIX}"
+            json_file.write_text(json.dumps(response_to_json(response), ensure_ascii=False, indent=2), encoding="utf-8")
+            output_paths.append(json_file)
+            generated_files.append(f"生JSON: {json_file.name} ({json_file.stat().st_size} bytes)")
+        
+        # 3. 構造化JSONファイル出力（フラグ制御）。Document から直接作る（JSONの辞書を経由しない）
+        if output_structured_json:
+            form_parser_data = create_structured_output_from_document(document)
+            structured_file = output_dir / f"{img_path.stem}_structured_fields.json"
+            structured_file.write_text(json.dumps(form_parser_data, ensure_ascii=False, indent=2), encoding="utf-8")
+            output_paths.append(structured_file)
+            generated_files.append(f"構造化JSON: {structured_file.name} (フィールド数: {len(form_parser_data)}個)")
+        
+        # 4. 表のCSV出力（フラグ制御）。tables.npz へのまとめは実行の最後に行う
+        if tables is not None:
+            grids = extract_tables_from_document(document, source=key)
+            table_files = write_table_csvs(grids, output_dir, img_path.stem)
+            output_paths.extend(table_files)
+            generated_files.extend(f"表: {path.name} ({grid.n_rows} 行 x {grid.n_cols} 列)"
+                                   for path, grid in zip(table_files, grids))
+            tables.append((key, grids))
+        
+        manifest.mark_done(key, digest, output_paths, img_path)
+        
+        # 結果表示
+        file_count = len(generated_files)
+        print(f"[OK] {key} -> {file_count}ファイル生成")
+        for file_info in generated_files:
+            print(f"     {file_info}")
+        return True
+        
     except Exception as e:
-        print(f"Document AIクライアントの初期化に失敗: {e}")
-        print("Google Cloud認証が正しく設定されているか確認してください")
+        manifest.mark_failed(key, digest, f"{type(e).__name__}: {e}", img_path)
+        print(f"[NG] {key} -> エラー: {e}")
+        return False
+
+
+def find_stored_responses(output_dir: Path) -> List[Path]:
+    """出力ディレクトリの保存済みの生データ（同じファイルの生JSONとバイナリがある場合はバイナリ）"""
+    found = {path.name[: -len(JSON_SUFFIX)]: path for path in output_dir.glob(f"*{JSON_SUFFIX}")}
+    found.update((path.name[: -len(BINARY_SUFFIX)], path) for path in output_dir.glob(f"*{BINARY_SUFFIX}"))
+    return [found[stem] for stem in sorted(found)]
+
+
+def rebuild_outputs(
+    raw_path: Path,
+    output_text: bool = True,
+    output_structured_json: bool = True
+) -> tuple[str, List[str], Optional[str]]:
+    """
+    1ファイルの保存済みの生データから、テキスト・構造化JSONを作り直す（offline のワーカープロセスで実行される）
+    
+    生JSONは必要な部分だけを読み込む（lib/raw_response_reader.py。Googleのライブラリは使わない）。
+    バイナリ（*_document.pb.zst）の場合は Document に戻すため google.cloud.documentai を読み込む（認証・通信はしない）。
+    
+    Returns:
+        tuple: (生データのファイル名, 生成したファイルの説明, エラー（成功した場合None）)
+    """
+    try:
+        generated_files = []
+        if raw_path.name.endswith(BINARY_SUFFIX):
+            from lib.document_store import load_document
+            
+            stem = raw_path.name[: -len(BINARY_SUFFIX)]
+            document = load_document(raw_path)
+            full_text = document.text
+            form_parser_data = create_structured_output_from_document(document) if output_structured_json else None
+        else:
+            stem = raw_path.name[: -len(JSON_SUFFIX)]
+            response_json = read_raw_response(raw_path, DEFAULT_FIELDS if output_structured_json else ("text",))
+            full_text = response_json.get("document", {}).get("text", "")
+            form_parser_data = create_combined_structured_output(response_json) if output_structured_json else None
+        
+        if output_text:
+            text_file = raw_path.with_name(f"{stem}_text.txt")
+            text_file.write_text(full_text, encoding="utf-8")
+            generated_files.append(f"テキスト: {text_file.name} ({len(full_text)} 文字)")
+        
+        if output_structured_json:
+            structured_file = raw_path.with_name(f"{stem}_structured_fields.json")
+            structured_file.write_text(json.dumps(form_parser_data, ensure_ascii=False, indent=2), encoding="utf-8")
+            generated_files.append(f"構造化JSON: {structured_file.name} (フィールド数: {len(form_parser_data)}個)")
+        
+        return raw_path.name, generated_files, None
+    except Exception as e:
+        return raw_path.name, [], f"{type(e).__name__}: {e}"
+
+
+def offline(
+    output_dir: Path,
+    output_text: bool = True,
+    output_structured_json: bool = True,
+    workers: Optional[int] = None
+):
+    """
+    保存済みの生データ（生JSON・バイナリ）から、テキスト・構造化JSONを作り直す（Document AIには送信しない）
+    
+    構造化JSONの作り方やテキストの出力を変えた場合に、再課金せずに出力を更新できます。
+    クライアントの作成・認証は行わないため、認証情報・ネットワークのない環境でも実行できます。
+    ファイルごとの処理は、CPUのコア数のプロセスで並列に行います（結果の表示は入力順）。
+    マニフェストは変更しません。
+    
+    Args:
+        output_dir: 生データが保存されている出力ディレクトリ（出力も同じディレクトリに書き込む）
+        output_text: テキストファイル出力フラグ
+        output_structured_json: 構造化JSONファイル出力フラグ
+        workers: 並列に処理するプロセス数（Noneの場合はCPUのコア数、1の場合は逐次実行）
+    """
+    import os
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    
+    if not output_dir.exists():
+        raise FileNotFoundError(f"output_dir not found: {output_dir}")
+    raw_paths = find_stored_responses(output_dir)
+    if not raw_paths:
+        print(f"保存済みの生データが見つかりません: {output_dir}")
         return
     
+    workers = max(1, min(workers or os.cpu_count() or 1, len(raw_paths)))
+    print(f"オフライン再処理: {len(raw_paths)} ファイル ({workers} プロセス)")
+    start = time.perf_counter()
+    rebuild = partial(rebuild_outputs, output_text=output_text, output_structured_json=output_structured_json)
     ok = 0
     ng = 0
     
-    for img_path in image_paths:
-        try:
-            print(f"処理中: {img_path.name}")
-            
-            # Form Parserを使用してDocument AIのモデル側で構造抽出（パターンマッチング不使用）
-            from lib.form_parser_processor import process_document_with_form_parser, create_combined_structured_output
-            
-            document, response_json = process_document_with_form_parser(client, project_id, processor_id, img_path, location)
-            
-            # 出力カウント
-            generated_files = []
-            
-            # 1. テキストファイル出力（フラグ制御）
-            if output_text:
-                full_text = document.text if document.text else ""
-                text_file = output_dir / f"{img_path.stem}_text.txt"
-                text_file.write_text(full_text, encoding="utf-8")
-                generated_files.append(f"テキスト: {text_file.name} ({len(full_text)} 文字)")
-            
-            # 2. 生JSONファイル出力（フラグ制御）
-            if output_raw_json:
-                json_file = output_dir / f"{img_path.stem}_raw_response.json"
-                json_file.write_text(json.dumps(response_json, ensure_ascii=False, indent=2), encoding="utf-8")
-                generated_files.append(f"生JSON: {json_file.name} ({json_file.stat().st_size} bytes)")
-            
-            # 3. 構造化JSONファイル出力（フラグ制御）
-            if output_structured_json:
-                form_parser_data = create_combined_structured_output(response_json)
-                structured_file = output_dir / f"{img_path.stem}_structured_fields.json"
-                structured_file.write_text(json.dumps(form_parser_data, ensure_ascii=False, indent=2), encoding="utf-8")
-                generated_files.append(f"構造化JSON: {structured_file.name} (フィールド数: {len(form_parser_data)}個)")
-            
-            # 結果表示
-            file_count = len(generated_files)
-            print(f"[OK] {img_path.name} -> {file_count}ファイル生成")
-            for file_info in generated_files:
-                print(f"     {file_info}")
-            ok += 1
-            
-        except Exception as e:
-            print(f"[NG] {img_path.name} -> エラー: {e}")
-            ng += 1
+    def report(results):
+        nonlocal ok, ng
+        for name, generated_files, error in results:
+            if error is None:
+                ok += 1
+                print(f"[OK] {name} -> {len(generated_files)}ファイル生成")
+                for file_info in generated_files:
+                    print(f"     {file_info}")
+            else:
+                ng += 1
+                print(f"[NG] {name} -> エラー: {error}")
+    
+    if workers == 1:
+        report(map(rebuild, raw_paths))
+    else:
+        # プロセス間の受け渡しの回数を減らすため、数ファイルずつまとめて渡す
+        chunksize = max(1, len(raw_paths) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            report(executor.map(rebuild, raw_paths, chunksize=chunksize))
     
-    print(f"処理完了. 成功={ok}, 失敗={ng}, 合計={len(image_paths)}")
+    elapsed = time.perf_counter() - start
+    print(f"処理完了. 成功={ok}, 失敗={ng}, 合計={len(raw_paths)} ({elapsed:.2f} 秒)")
+
+
+def watch(
+    inbox_dir: Path,
+    output_dir: Path,
+    done_dir: Path,
+    processor_id: str,
+    location: str,
+    exts: set = None,
+    service_account_key_path: Optional[str] = None,
+    output_text: bool = True,
+    output_raw_json: bool = True,
+    output_structured_json: bool = True,
+    stable_seconds: float = 2.0,
+    poll_interval: float = 1.0,
+    max_in_flight: int = 4,
+    request_timeout: Optional[float] = 120.0,
+    endpoint: Optional[str] = None,
+    rate_limits: Optional[Dict[str, Any]] = None,
+    processor_version: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+    cache_max_mb: float = 1024,
+    raw_format: str = "json",
+    field_mask: Union[str, Sequence[str], None] = "auto",
+    pages: Optional[Sequence[int]] = None,
+    ocr_config: Optional[Dict[str, Any]] = None,
+    output_tables: bool = False,
+    payload_profile: Optional[PayloadProfile] = None
+):
+    """
+    受信フォルダを監視し、到着したファイルをForm Parserで処理し続ける（Ctrl+Cで終了）
+    
+    クライアントは起動時に1度だけ作成し、到着ごとの認証・接続コストを省きます。
+    処理に成功したファイルは完了フォルダへ移動し、失敗したファイルは受信フォルダに残します。
+    続けて到着したファイルは最大 max_in_flight 件を並列に送信し、到着順に書き込みます。
+    
+    Args:
+        inbox_dir: 監視する受信フォルダ（サブフォルダも対象）
+        output_dir: OCR結果を保存するディレクトリ
+        done_dir: 処理済みファイルの移動先
+        processor_id: Document AI Form ParserプロセッサID
+        location: Document AIのリージョン
+        exts: 対象とする拡張子セット
+        service_account_key_path: サービスアカウントキーファイルのパス（オプション）
+        output_text: テキストファイル出力フラグ
+        output_raw_json: 生JSONファイル出力フラグ
+        output_structured_json: 構造化JSONファイル出力フラグ
+        stable_seconds: サイズ・更新時刻がこの秒数変化しなければ書き込み完了とみなす
+        poll_interval: 監視間隔（秒）
+        max_in_flight: 同時に送信するリクエスト数の上限
+        request_timeout: 1リクエストあたりの期限（秒、再試行を含む）
+        endpoint: ローカルのフェイクサーバーのアドレス（Noneの場合は本物のDocument AIに接続）
+        rate_limits: レート制限・再試行の設定（create_resilient_caller() の引数）
+        processor_version: プロセッサバージョンID（Noneの場合はデフォルトバージョン）
+        cache_dir: レスポンスキャッシュの保存先（Noneの場合はキャッシュしない）
+        cache_max_mb: レスポンスキャッシュの保存量の上限（MB）
+        raw_format: 生データの保存形式（"json"=生JSON、"binary"=Document のバイナリ + zstd。lib/document_store.py）
+        field_mask: レスポンスに含めるフィールド（"auto"=出力フラグから必要なものだけ、None=全フィールド、またはパスのリスト）
+        pages: 処理するページ番号（PDF・複数ページTIFF。None=全ページ）
+        ocr_config: OCRの設定（documentai.OcrConfig の引数。None=プロセッサの既定）
+        output_tables: 表のCSV・tables.npz 出力フラグ
+        payload_profile: 1ページの画像の送信データの最適化の設定（util/payload_optimizer.py。None=ファイルのまま送信する）
+    """
+    if raw_format not in RAW_FORMATS:
+        raise ValueError(f"raw_format は {RAW_FORMATS} のいずれかを指定してください: {raw_format}")
+    if exts is None:
+        exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
+    
+    output_dir.mkdir(parents=True, exist_ok=True)
+    client, project_id = create_client(location, service_account_key_path, endpoint)
+    print(f"Document AIクライアントを初期化しました (プロジェクト: {project_id})")
+    
+    manifest = open_manifest(output_dir, processor_id, location, output_text, output_raw_json, output_structured_json,
+                             processor_version, raw_format, pages, ocr_config, output_tables, payload_profile)
+    caller = create_resilient_caller(max_in_flight, rate_limits)
+    request_options = resolve_request_options(field_mask, pages, ocr_config,
+                                              output_text, output_raw_json, output_structured_json, output_tables,
+                                              payload_profile)
+    cache = open_cache(cache_dir, processor_id, processor_version, cache_max_mb, request_options)
+    tables = [] if output_tables else None
+    watcher = FolderWatcher(
+        inbox_dir, exts, stable_seconds=stable_seconds, poll_interval=poll_interval, exclude_dirs=[done_dir]
+    )
+    
+    def arrivals():
+        # 到着したファイルを読み込み、処理済みかどうかを判定してから送信側へ渡す
+        for img_path in watcher.watch():
+            key = img_path.resolve().relative_to(inbox_dir.resolve()).as_posix()
+            try:
+                content = read_bytes(img_path)
+                # 読み込み後に移動・削除された場合は stat() で失敗するため、読み込みと同じく読み飛ばす
+                digest = manifest.content_hash(img_path, key, content)
+            except OSError as e:
+                print(f"[NG] {key} -> 読み込みエラー: {e}")
+                continue
+            yield img_path, key, digest, content, manifest.is_up_to_date(key, digest)
+    
+    def send(entry):
+        img_path, key, digest, content, up_to_date = entry
+        if up_to_date:
+            return None
+        return call_form_parser(client, project_id, processor_id, location, img_path, manifest,
+                                key, digest, content, timeout=request_timeout, caller=caller,
+                                cache=cache, processor_version=processor_version, **request_options)
+    
+    dispatcher = Prefetcher(arrivals(), send, depth=max(1, max_in_flight), workers=max(1, max_in_flight))
+    
+    print(f"受信フォルダを監視しています: {inbox_dir} (Ctrl+Cで終了)")
+    try:
+        for dispatched in dispatcher:
+            img_path, key, digest, _, up_to_date = dispatched.item
+            if up_to_date:
+                print(f"[SKIP] {key} -> 処理済み")
+                move_to_done(img_path, inbox_dir, done_dir)
+            elif write_results(dispatched, img_path, output_dir, manifest, key, digest,
+                               output_text, output_raw_json, output_structured_json, raw_format, tables):
+                move_to_done(img_path, inbox_dir, done_dir)
+            if tables:
+                # 監視は終わらないため、表はファイルごとに tables.npz へ反映し、メモリに溜めない
+                save_table_batch(output_dir, tables)
+                tables.clear()
+    except KeyboardInterrupt:
+        print("\n監視を終了しました。")
+    finally:
+        dispatcher.close()
+        manifest.close()
+        if tables:
+            # 反映する前に中断されたファイルの表
+            save_table_batch(output_dir, tables)
+        print(f"再試行・スロットリング: {caller.stats.summary()}")
+        if cache is not None:
+            print(f"レスポンスキャッシュ: {cache.stats.summary()}")
+
+
+def tune(
+    images_dir: Path,
+    store_path: Path,
+    document_type: str,
+    processor_id: str,
+    location: str,
+    exts: set = None,
+    service_account_key_path: Optional[str] = None,
+    n_samples: int = 3,
+    min_accuracy: float = 0.99,
+    endpoint: Optional[str] = None,
+    processor_version: Optional[str] = None,
+    ocr_config: Optional[Dict[str, Any]] = None
+) -> Optional[PayloadProfile]:
+    """
+    文書の種類ごとの送信データの最適化の設定を選び、store_path に保存する（util.payload_optimizer.tune_profile）
+    
+    先頭の n_samples 個の1ページの画像を、元のファイルと候補の設定それぞれでForm Parserに送信し、
+    送信量・応答時間・精度（元のファイルの全文テキストとの文字の一致率）を測ります。
+    候補の数 + 1 回ずつ送信するため、その分の料金がかかります（キャッシュは使わない）。
+    
+    Args:
+        images_dir: 代表的な画像のディレクトリ（PDF・複数ページTIFFは使わない）
+        store_path: 設定の保存先（JSON）
+        document_type: 文書の種類（保存のキー。payload_profile = "auto" のときにこのキーの設定を使う）
+        n_samples: 送信するサンプルの数
+        min_accuracy: 精度の下限（0-1）
+    
+    Returns:
+        選ばれた設定（どの候補も精度の下限を満たさない場合はNone=ファイルのまま）
+    """
+    from util.payload_optimizer import TARGET_FORMATS, ProfileStore, format_results, tune_profile
+    
+    if exts is None:
+        exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
+    paths = sorted(p for p in images_dir.iterdir() if p.is_file() and p.suffix.lower() in exts - MULTIPAGE_EXTS)
+    samples = [(path.read_bytes(), mimetypes.guess_type(str(path))[0]) for path in paths[:n_samples]]
+    if not samples:
+        print(f"1ページの画像が見つかりません: {images_dir}")
+        return None
+    
+    client, project_id = create_client(location, service_account_key_path, endpoint)
+    process_options = build_process_options(None, ocr_config)
+    
+    def ocr(content: bytes, mime_type: str) -> str:
+        # 精度の比較には全文テキストだけを使う
+        response = send_form_parser_request(
+            client, project_id, processor_id, paths[0], location, content,
+            processor_version=processor_version, field_mask=["text"], process_options=process_options,
+            mime_type=mime_type
+        )
+        return response.document.text
+    
+    print(f"送信データの最適化の設定を選びます: {document_type} ({len(samples)} ファイル, 精度の下限 {min_accuracy:.2%})")
+    profile, results = tune_profile(samples, ocr, min_accuracy=min_accuracy, formats=TARGET_FORMATS["documentai"])
+    for line in format_results(results):
+        print(f"  {line}")
+    ProfileStore(store_path).put(document_type, profile, results)
+    print(f"選ばれた設定: {profile.describe() if profile else 'ファイルのまま'} -> {store_path}")
+    return profile
 
 
 if __name__ == "__main__":
@@ -192,6 +987,7 @@ if __name__ == "__main__":
     location = "us"  # プロセッサのリージョン（通常は "us" または "eu"）
     # Parserプロセッサを使用する場合は以下
     processor_id = "41fc98b4e98caeae"
+    processor_version = None  # プロセッサバージョンID（None=デフォルトバージョン。結果を固定したい場合は明示する）
     
     # 認証設定（どちらか一つを選択）
     # オプション1: Application Default Credentials (ADC) を使用
@@ -206,15 +1002,116 @@ if __name__ == "__main__":
     # ===== 出力ファイル制御フラグ =====
     output_text = True            # テキストファイル(.txt)出力
     output_raw_json = True        # 生JSONファイル(.json)出力  
+    # 生データの保存形式: "json"=生JSON（*_raw_response.json）、"binary"=バイナリ + zstd（*_document.pb.zst、1/10以下のサイズ）
+    # 相互変換: python lib/document_store.py to-binary|to-json <出力ディレクトリ>
+    raw_format = "json"
+    
+    # リクエストの設定
+    # field_mask: "auto"=出力に必要なフィールドだけを要求（レスポンスの転送・デコードが軽くなる。生データを出力する場合は全フィールド）
+    #             None=全フィールド、またはパスのリスト（例: ["text", "pages.form_fields"]）
+    field_mask = "auto"
+    pages = None              # 処理するページ番号（PDF・複数ページTIFF。例: [1, 2]。None=全ページ）
+    ocr_config = None         # OCRの設定（例: {"hints": {"language_hints": ["ja"]}}。None=プロセッサの既定）
+    # 1リクエストにまとめるページ数（0=ファイルごとに送信。上限はオンライン処理の15ページ。lib/request_coalescer.py）
+    # 連続する1ページの画像（PNG・JPEG）を1つのPDFにまとめて送信し、結果はファイルごとに出力する（リクエスト数・往復が減る）
+    # 15ページを超えるPDF・複数ページTIFFは分割して並列に送信する。request_timeout はまとめたリクエストごとの期限
+    coalesce_pages = 0
+    # 送信データの最適化（util/payload_optimizer.py。1ページの画像をグレースケール・2値にし、解像度の上限を設け、
+    # PNG・JPEG・TIFF G4 のうち最も小さい形式で送信する。まとめて送信する場合はPDFに埋め込める PNG・JPEG から選ぶ）
+    # None=ファイルのまま, "auto"=python main.py tune [サンプル数] で選んだ設定, 辞書=指定した設定（例: {"color": "bilevel"}）
+    payload_profile = None
+    profile_store_path = current_dir / "documents" / "payload_profiles.json"
+    document_type = images_dir.name   # 設定を保存・選択する文書の種類
+    tune_min_accuracy = 0.99          # tune で許容する精度の下限（元のファイルの全文テキストとの文字の一致率）
     output_structured_json = True # 構造化JSONファイル(.json)出力
+    output_tables = False         # 表のCSV(.csv)と、全ファイルの表をまとめた tables.npz を出力（lib/table_extractor.py）
+    
+    # 処理済みのファイルをスキップするかどうか（False=全ファイルを再処理・再課金）
+    incremental = True
+    
+    # レスポンスキャッシュ（同じ内容のファイルはForm Parserに送信せず、保存済みのレスポンスから出力を作り直す）
+    # 出力先・出力フラグを変えた場合や incremental = False の場合も再課金されない
+    cache_dir = current_dir / "documents" / "response_cache"  # None=キャッシュしない
+    cache_max_mb = 1024       # 保存量の上限（MB）。超えると最後に使われてから最も時間が経ったものから削除する
+    
+    # 並列送信の設定（Form Parserの応答待ちの間に次のファイルを送信する）
+    max_in_flight = 4         # 同時に送信するリクエスト数の上限（1=逐次実行。プロセッサのクォータに合わせる）
+    request_timeout = 120.0   # 1リクエストあたりの期限（秒、再試行を含む）
+    
+    # クォータに合わせたレート制限と再試行（util/resilience.py）
+    # スロットリング（RESOURCE_EXHAUSTED / UNAVAILABLE）されると同時送信数を自動的に減らし、応答が戻れば増やす
+    rate_limits = {
+        "requests_per_minute": 120,   # 1分あたりのリクエスト数（プロジェクトのクォータ。None=制限なし）
+        "pages_per_minute": None,     # 1分あたりのページ数（None=制限なし）
+        "max_attempts": 5,            # 最大試行回数（1=再試行しない）
+    }
+    
+    # ローカルのフェイクサーバーに接続する場合のアドレス（例: "localhost:50051"。None=本物のDocument AI）
+    # python main.py fake で、フェイクサーバーを起動してスループットを確認できる（課金・ネットワーク不要）
+    endpoint = None
+    fake_latency = 2.0        # フェイクサーバーの応答遅延（秒）
+    
+    # オフライン再処理: python main.py offline [出力ディレクトリ] で、保存済みの生データ（生JSON・バイナリ）から
+    # テキスト・構造化JSONを作り直す（Document AIに送信しない。認証情報・ネットワーク不要。出力フラグは上の設定を使う）
+    offline_workers = None    # 並列に処理するプロセス数（None=CPUのコア数、1=逐次実行）
+    
+    # 常駐（受信フォルダ監視）モード: python main.py watch で起動
+    inbox_dir = current_dir / "documents" / "inbox"
+    done_dir = current_dir / "documents" / "done"
     # ===== 設定ここまで =====
     
+    if len(sys.argv) > 1 and sys.argv[1] == "offline":
+        offline(Path(sys.argv[2]) if len(sys.argv) > 2 else output_dir, output_text, output_structured_json, offline_workers)
+        sys.exit(0)
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "tune":
+        tune(images_dir, profile_store_path, document_type, processor_id, location, exts, service_account_key_path,
+             int(sys.argv[2]) if len(sys.argv) > 2 else 3, tune_min_accuracy, endpoint, processor_version, ocr_config)
+        sys.exit(0)
+    
+    from util.payload_optimizer import resolve_profile
+    
+    payload_profile = resolve_profile(payload_profile, profile_store_path, document_type, target="documentai")
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        inbox_dir.mkdir(parents=True, exist_ok=True)
+        watch(inbox_dir, output_dir, done_dir, processor_id, location, exts, service_account_key_path,
+              output_text, output_raw_json, output_structured_json,
+              max_in_flight=max_in_flight, request_timeout=request_timeout, endpoint=endpoint,
+              rate_limits=rate_limits, processor_version=processor_version,
+              cache_dir=cache_dir, cache_max_mb=cache_max_mb, raw_format=raw_format,
+              field_mask=field_mask, pages=pages, ocr_config=ocr_config, output_tables=output_tables,
+              payload_profile=payload_profile)
+        sys.exit(0)
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "fake":
+        # フェイクサーバーを起動し、出力先を分けて全ファイルを処理する
+        import time
+        from lib.fake_documentai_server import FakeDocumentAIServer
+        
+        with FakeDocumentAIServer(latency=fake_latency, jitter=fake_latency * 0.3) as server:
+            print(f"フェイクDocument AIサーバー: {server.address} (遅延 {fake_latency} 秒, max_in_flight={max_in_flight})")
+            start = time.perf_counter()
+            main(images_dir, output_dir.parent / (output_dir.name + "_fake"), processor_id, location, exts,
+                 None, output_text, output_raw_json, output_structured_json, incremental=False,
+                 max_in_flight=max_in_flight, request_timeout=request_timeout, endpoint=server.address,
+                 rate_limits=rate_limits, processor_version=processor_version,
+                 # フェイクの結果が本物のキャッシュに混ざらないよう、保存先を分ける
+                 cache_dir=cache_dir.parent / (cache_dir.name + "_fake") if cache_dir else None,
+                 cache_max_mb=cache_max_mb, raw_format=raw_format,
+                 field_mask=field_mask, pages=pages, ocr_config=ocr_config, output_tables=output_tables,
+                 coalesce_pages=coalesce_pages, payload_profile=payload_profile)
+            elapsed = time.perf_counter() - start
+            print(f"所要時間: {elapsed:.2f} 秒 (リクエスト {server.request_count} 件, "
+                  f"最大同時処理数 {server.max_concurrency})")
+        sys.exit(0)
+    
     print("Document AI OCR処理を開始します")
     print(f"画像ディレクトリ: {images_dir}")
     print(f"出力ディレクトリ: {output_dir}")
     print(f"プロセッサID: {processor_id}")
     print(f"処理モード: Form Parser (モデル側構造抽出 - パターンマッチング不使用)")
-    print(f"出力設定: テキスト={output_text}, 生JSON={output_raw_json}, 構造化JSON={output_structured_json}")
+    print(f"出力設定: テキスト={output_text}, 生JSON={output_raw_json}, 構造化JSON={output_structured_json}, 表={output_tables}")
     print(f"画像ディレクトリ存在確認: {images_dir.exists()}")
     if service_account_key_path:
         print(f"認証方法: サービスアカウントキーファイル ({service_account_key_path})")
@@ -227,4 +1124,6 @@ if __name__ == "__main__":
         exit(1)
     
     main(images_dir, output_dir, processor_id, location, exts, service_account_key_path, 
-            output_text, output_raw_json, output_structured_json)
\ No newline at end of file
+            output_text, output_raw_json, output_structured_json, incremental,
+            max_in_flight, request_timeout, endpoint, rate_limits, processor_version, cache_dir, cache_max_mb,
+            raw_format, field_mask, pages, ocr_config, output_tables, coalesce_pages, payload_profile)
\ No newline at end of file
@@ -308,6 +308,42 @@ class DataParser:
         
         return self.strategy.parse(ocr_text, self.fields)
     
+    def parse_word_boxes(
+        self,
+        word_boxes,
+        region: Optional[Tuple[float, float, float, float]] = None,
+        page: int = 0,
+        min_confidence: float = 0.0
+    ) -> ParseResult:
+        """
+        保存済みの単語ボックス（util/word_boxes.py の WordBoxes）からフィールドを抽出
+        
+        Vision APIのOCR結果（test_ocr_for_doc2 の *_words.bin）を、APIを呼び直さずに解析する。
+        region を指定すると、その領域の単語だけを行ごとに並べたテキストを解析する。
+        
+        Args:
+            word_boxes: util.word_boxes.load_word_boxes() で読み込んだ WordBoxes
+            region: 解析する領域 (x0, y0, x1, y1)（ピクセル座標。Noneの場合は全文）
+            page: region のページ番号（0始まり）
+            min_confidence: この信頼度未満の単語があれば警告に含める（0の場合は確認しない）
+            
+        Returns:
+            ParseResult: 解析結果
+        """
+        text = word_boxes.text if region is None else word_boxes.region_text(region, page)
+        result = self.parse(text)
+        
+        if min_confidence > 0:
+            low = word_boxes.low_confidence(min_confidence)
+            if region is not None:
+                inside = set(word_boxes.words_in(region, page).tolist())
+                low = [i for i in low if i in inside]
+            if len(low):
+                words = ", ".join(word_boxes.word_text(i) for i in low[:10])
+                result.warnings.append(f"信頼度が {min_confidence} 未満の単語が {len(low)} 件あります: {words}")
+        
+        return result
+    
     def set_fields(self, fields: List[Field]) -> None:
         """
         フィールド定義を設定
@@ -417,4 +453,23 @@ if __name__ == "__main__":
     
     if result3.missing_fields:
         print("\n欠落フィールド:", result3.missing_fields)
+    
+    # 保存済みの単語ボックスの解析: python lib/data_parser.py 出力/page_001_words.bin
+    import sys
+    if len(sys.argv) > 1:
+        from pathlib import Path
+        
+        # util/ を読み込めるよう、リポジトリのルートをパスに追加
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+        from util.word_boxes import load_word_boxes
+        
+        print(f"\n=== 単語ボックスの解析: {sys.argv[1]} ===")
+        with load_word_boxes(sys.argv[1]) as boxes:
+            result4 = DataParser(strategy=KeyValuePairParser()).parse_word_boxes(boxes, min_confidence=0.8)
+        
+        print("抽出データ:")
+        for key, value in result4.data.items():
+            print(f"  {key}: {value}")
+        for warning in result4.warnings:
+            print(f"  - {warning}")
 
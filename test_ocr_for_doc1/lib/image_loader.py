@@ -1,26 +1,284 @@
+from __future__ import annotations
+
 import cv2
+import mmap
+import numpy as np
+from dataclasses import dataclass
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional, Tuple
+
+if TYPE_CHECKING:
+    from util.page_range import PageSpec
+
+# 読み込みモードと縮小率 -> cv2.imread のフラグ
+# 縮小デコード（IMREAD_REDUCED_*）はJPEGではDCT段階で縮小するため、全画素をデコードするより大幅に速い
+_IMREAD_FLAGS = {
+    ("color", 1): cv2.IMREAD_COLOR,
+    ("color", 2): cv2.IMREAD_REDUCED_COLOR_2,
+    ("color", 4): cv2.IMREAD_REDUCED_COLOR_4,
+    ("color", 8): cv2.IMREAD_REDUCED_COLOR_8,
+    ("gray", 1): cv2.IMREAD_GRAYSCALE,
+    ("gray", 2): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    ("gray", 4): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    ("gray", 8): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    ("unchanged", 1): cv2.IMREAD_UNCHANGED,
+}
+
+
+def page_key(name: str, page: Optional[int]) -> str:
+    """マニフェストのキー（複数ページ文書は "文書名#ページ"）"""
+    return name if page is None else f"{name}#{page}"
+
+
+def page_stem(stem: str, page: Optional[int]) -> str:
+    """出力ファイル名の基部（複数ページ文書は "文書名#003" のようにページ番号を付ける）"""
+    return stem if page is None else f"{stem}#{page:03d}"
+
+
+def _open_pdf(path):
+    # PDFのレンダリングとテキストレイヤーの取得は util.pdf_rasterizer（PyMuPDF、プロセス内）に任せる
+    # （util はプロジェクトルートにあるため、main.py が sys.path に追加している前提）
+    from util.pdf_rasterizer import PdfRasterizer
+
+    return PdfRasterizer(path)
+
+
+def _pil_to_array(img, mode: str) -> np.ndarray:
+    # PIL画像 -> OpenCVと同じ並び（BGR または グレースケール）
+    if mode == "gray":
+        return np.asarray(img.convert("L"))
+    rgb = np.asarray(img.convert("RGB"))
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    """
+    画素をデコードせずに取得した画像の情報
+
+    Attributes:
+        width: 幅（ピクセル）
+        height: 高さ（ピクセル）
+        dpi: 解像度 (x, y)。ファイルに記録がない場合はNone
+        mode: PILの画像モード（"RGB", "L", "1" など）
+        format: ファイル形式（"PNG", "JPEG", "TIFF" など）
+        n_frames: ページ数（複数ページTIFFの場合は2以上）
+    """
+    width: int
+    height: int
+    dpi: Optional[Tuple[float, float]]
+    mode: str
+    format: Optional[str]
+    n_frames: int = 1
+
 
 class ImageLoader:
-    def load_image(self, image_path)->cv2.Mat:
+    def load_image(self, image_path, mode: str = "color", reduce: int = 1, use_mmap: bool = False) -> cv2.Mat:
         """
         指定されたパスから画像を読み込みます。
+
+        Args:
+            image_path: 画像ファイルのパス
+            mode: "color"（BGR 3チャンネル）, "gray"（グレースケール）, "unchanged"（ファイルのまま）
+            reduce: 縮小デコードの倍率（1, 2, 4, 8）。分類・検出用のサムネイルに使う
+            use_mmap: Trueの場合、ファイルをメモリマップしてデコードする
+                      （中間のbytesコピーなし。Windowsの日本語パスでも読み込める）
+
+        Returns:
+            画像（np.ndarray）
         """
-        image = cv2.imread(image_path)
+        flags = _IMREAD_FLAGS.get((mode, reduce))
+        if flags is None:
+            raise ValueError(f"未対応の読み込みモードです: mode={mode}, reduce={reduce}")
+
+        if use_mmap:
+            image = self._decode_mmap(image_path, flags)
+        else:
+            image = cv2.imread(str(image_path), flags)
         if image is None:
             raise FileNotFoundError(f"画像ファイルが見つかりません: {image_path}")
         return image
 
+    @staticmethod
+    def _decode_mmap(image_path, flags: int) -> Optional[np.ndarray]:
+        try:
+            with open(image_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                buf = np.frombuffer(mm, dtype=np.uint8)
+                try:
+                    return cv2.imdecode(buf, flags)
+                finally:
+                    # mmapを閉じる前にビューを解放する（残っているとBufferErrorになる）
+                    del buf
+        except (FileNotFoundError, ValueError):
+            # ファイルなし、または空ファイル（0バイトはmmapできない）
+            return None
+
+    # ----------------------------
+    # 複数ページ文書（PDF・複数ページTIFF）
+    # ----------------------------
+    @staticmethod
+    def is_multipage(image_path) -> bool:
+        """ページ単位で処理すべき文書か（PDF、または2ページ以上のTIFF）"""
+        suffix = Path(image_path).suffix.lower()
+        if suffix == ".pdf":
+            return True
+        if suffix in (".tif", ".tiff"):
+            return ImageLoader.page_count(image_path) > 1
+        return False
+
+    @staticmethod
+    def page_count(image_path) -> int:
+        """ページ数（画素はデコードしない）"""
+        suffix = Path(image_path).suffix.lower()
+        if suffix == ".pdf":
+            with _open_pdf(image_path) as doc:
+                return doc.page_count
+        if suffix in (".tif", ".tiff"):
+            from PIL import Image
+
+            with Image.open(image_path) as img:
+                return getattr(img, "n_frames", 1)
+        return 1
+
+    def load_page(self, image_path, page: int, mode: str = "color", dpi: int = 300) -> np.ndarray:
+        """
+        文書の1ページだけを読み込みます（ランダムアクセス用）。
+
+        Args:
+            image_path: PDF・TIFFファイルのパス
+            page: ページ番号（1始まり）
+            mode: "color"（BGR）または "gray"
+            dpi: PDFのレンダリング解像度
+
+        Returns:
+            画像（np.ndarray）
+        """
+        for _, image in self.iter_pages(image_path, [page], mode=mode, dpi=dpi):
+            return image
+        raise ValueError(f"ページが存在しません: {image_path} (page={page})")
+
+    @staticmethod
+    def text_layer(image_path, page: int, min_chars: int = 20):
+        """
+        PDFのページが持つテキストレイヤー（電子的に作成されたPDF・OCR済みPDF）を取得します。
+
+        Args:
+            image_path: ファイルのパス
+            page: ページ番号（1始まり）
+            min_chars: テキストレイヤーとみなす最小文字数（空白を除く）
+
+        Returns:
+            util.pdf_rasterizer.TextLayer（PDF以外、またはテキストがないページの場合はNone）
+        """
+        if Path(image_path).suffix.lower() != ".pdf":
+            return None
+        with _open_pdf(image_path) as pdf:
+            if not 1 <= page <= pdf.page_count:
+                raise ValueError(f"ページが存在しません: {image_path} (page={page})")
+            return pdf.text_layer(page, min_chars)
+
+    def iter_pages(self, image_path, pages: PageSpec = None, mode: str = "color",
+                   dpi: int = 300) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        複数ページ文書を1ページずつデコードしながら返します（ファイル全体を展開しない）。
+
+        Args:
+            image_path: PDF・TIFF（または通常の画像）ファイルのパス
+            pages: ページ指定（None=全ページ, "1-3,5", [1, 2]）
+            mode: "color"（BGR）または "gray"
+            dpi: PDFのレンダリング解像度
+
+        Yields:
+            (ページ番号（1始まり）, 画像)
+        """
+        from util.page_range import parse_page_range
+
+        if mode not in ("color", "gray"):
+            raise ValueError(f"未対応の読み込みモードです: mode={mode}")
+        image_path = Path(image_path)
+        if not image_path.exists():
+            raise FileNotFoundError(f"画像ファイルが見つかりません: {image_path}")
+        suffix = image_path.suffix.lower()
+
+        if suffix == ".pdf":
+            color = "gray" if mode == "gray" else "rgb"
+            with _open_pdf(image_path) as pdf:
+                for page in pdf.iter_pages(pages, dpi=dpi, color=color, detect_text=False):
+                    yield page.number, page.render()
+            return
+
+        if suffix in (".tif", ".tiff"):
+            from PIL import Image
+
+            with Image.open(image_path) as img:
+                for page in parse_page_range(pages, getattr(img, "n_frames", 1)):
+                    # seek() は指定ページのIFDに移動するだけで、デコードは変換時に1ページ分だけ行われる
+                    img.seek(page - 1)
+                    yield page, _pil_to_array(img, mode)
+            return
+
+        # 通常の画像は1ページの文書として扱う
+        if parse_page_range(pages, 1):
+            yield 1, self.load_image(str(image_path), mode=mode)
+
+    @staticmethod
+    def probe(image_path) -> ImageInfo:
+        """
+        ヘッダのみを読み、画素をデコードせずにサイズ・DPIを取得します。
+
+        Args:
+            image_path: 画像ファイルのパス
+
+        Returns:
+            ImageInfo
+        """
+        from PIL import Image
+
+        try:
+            # Image.open はヘッダだけを読み、画素は load() されるまでデコードしない
+            with Image.open(image_path) as img:
+                dpi = img.info.get("dpi")
+                return ImageInfo(
+                    width=img.width,
+                    height=img.height,
+                    dpi=(float(dpi[0]), float(dpi[1])) if dpi else None,
+                    mode=img.mode,
+                    format=img.format,
+                    n_frames=getattr(img, "n_frames", 1),
+                )
+        except FileNotFoundError:
+            raise FileNotFoundError(f"画像ファイルが見つかりません: {image_path}")
+
+
 if __name__ == "__main__":
     # image_loader.pyのテストコード
+    # 使い方: python lib/image_loader.py [bench]
+    #   bench を付けると読み込みモードごとの所要時間を比較する（画像は表示しない）
+    import sys
+    import time
+
     # 現在のファイル位置から相対パスを計算
     current_dir = Path(__file__).parent
     test_imagefile_path = current_dir.parent / "documents" / "images" / "sample" / "sample.png"
-    
+
     print(f"Looking for image at: {test_imagefile_path}")
     print(f"File exists: {test_imagefile_path.exists()}")
 
     loader = ImageLoader()
+    print(f"Probe: {loader.probe(test_imagefile_path)}")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        repeat = 10
+        for mode, reduce in [("color", 1), ("gray", 1), ("gray", 2), ("gray", 4), ("gray", 8)]:
+            for use_mmap in (False, True):
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    img = loader.load_image(str(test_imagefile_path), mode=mode, reduce=reduce, use_mmap=use_mmap)
+                elapsed = (time.perf_counter() - start) / repeat
+                print(f"mode={mode:<5} reduce={reduce} mmap={use_mmap!s:<5}: "
+                      f"{elapsed * 1000:7.1f} ms  shape={img.shape}")
+        sys.exit(0)
+
     img = loader.load_image(str(test_imagefile_path))
     cv2.imshow("Loaded Image", img)
     cv2.waitKey(0)
@@ -0,0 +1,273 @@
+"""
+計測モジュール
+
+パイプラインのページ単位・ステージ単位で以下を記録します。
+
+- 経過時間（wall）とCPU時間
+- ワーカープロセスのピークRSS
+- 画素数（入力画像・OCR対象画像）
+- 最も遅いNページについての cProfile / tracemalloc の結果（任意）
+
+結果はJSONL（1行1ページ）と、ステージごとの p50/p95/p99 をまとめたサマリー表として出力します。
+計測を無効にした場合はレコーダーを生成せず、各処理は None チェックのみで素通りします。
+"""
+from __future__ import annotations
+
+import heapq
+import json
+import marshal
+import math
+import re
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 計測レベル
+LEVEL_OFF = 0
+LEVEL_TIMING = 1
+LEVEL_PROFILE = 2
+
+
+def peak_rss_mb() -> Optional[float]:
+    """このプロセスのピークRSS（MB）。取得できない環境ではNone"""
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linuxはキロバイト、macOSはバイト単位
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+class StageRecorder:
+    """ステージごとの経過時間・CPU時間を積算するレコーダー（1ページ・1スレッド用）"""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.values: Dict[str, Any] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        wall0 = time.perf_counter()
+        cpu0 = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall0, time.thread_time() - cpu0)
+
+    def add(self, name: str, wall: float, cpu: float) -> None:
+        entry = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+        entry["wall"] += wall
+        entry["cpu"] += cpu
+
+    def set(self, name: str, value: Any) -> None:
+        """画素数などステージ以外の値を記録"""
+        self.values[name] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"stages": self.stages, "values": self.values}
+
+
+def stage(recorder: Optional[StageRecorder], name: str):
+    """recorder が None の場合は何もしないコンテキストを返す"""
+    return recorder.stage(name) if recorder is not None else nullcontext()
+
+
+def run_instrumented(fn: Callable, level: int, *args) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """
+    fn(recorder, *args) を計測レベルに応じて実行（ワーカープロセス側で使う）
+
+    Returns:
+        (fnの戻り値, 計測結果の辞書またはNone)
+    """
+    if level == LEVEL_OFF:
+        return fn(None, *args), None
+
+    recorder = StageRecorder()
+    profiler = None
+    if level >= LEVEL_PROFILE:
+        import cProfile
+        import tracemalloc
+
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        result = fn(recorder, *args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    info = recorder.to_dict()
+    info["peak_rss_mb"] = peak_rss_mb()
+    if profiler is not None:
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profiler.create_stats()
+        info["profile"] = marshal.dumps(profiler.stats)
+        info["tracemalloc"] = {
+            "peak_mb": peak / (1024 * 1024),
+            "top": [str(s) for s in snapshot.statistics("lineno")[:15]],
+        }
+    return result, info
+
+
+# ----------------------------
+# 集計（親プロセス側）
+# ----------------------------
+@dataclass
+class PageMetrics:
+    """
+    1ページ分の計測結果
+
+    Attributes:
+        index: 入力順のインデックス
+        name: ページ名（ファイル名）
+        success: 処理に成功したかどうか
+        wall_total: パイプラインへの投入から書き込み完了までの経過時間（秒、キュー待ちを含む）
+        stages: ステージ名 -> {"wall": 秒, "cpu": 秒}
+        values: 画素数などの付加情報
+        peak_rss_mb: プロセス種別 -> ピークRSS（MB）
+        profiles: ステージ名 -> cProfile/tracemalloc の結果（プロファイル時のみ）
+    """
+    index: int
+    name: str
+    success: bool = True
+    wall_total: float = 0.0
+    stages: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    values: Dict[str, Any] = field(default_factory=dict)
+    peak_rss_mb: Dict[str, Optional[float]] = field(default_factory=dict)
+    profiles: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def add_worker_info(self, process_kind: str, info: Optional[Dict[str, Any]]) -> None:
+        if not info:
+            return
+        for name, entry in info.get("stages", {}).items():
+            stage_entry = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            stage_entry["wall"] += entry["wall"]
+            stage_entry["cpu"] += entry["cpu"]
+        self.values.update(info.get("values", {}))
+        self.peak_rss_mb[process_kind] = info.get("peak_rss_mb")
+        if "profile" in info:
+            self.profiles[process_kind] = {"profile": info["profile"], "tracemalloc": info["tracemalloc"]}
+
+    def to_json(self) -> Dict[str, Any]:
+        record = {
+            "index": self.index,
+            "name": self.name,
+            "success": self.success,
+            "wall_total": round(self.wall_total, 6),
+            "stages": {
+                k: {"wall": round(v["wall"], 6), "cpu": round(v["cpu"], 6)} for k, v in self.stages.items()
+            },
+            "peak_rss_mb": self.peak_rss_mb,
+        }
+        record.update(self.values)
+        return record
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """ソート済みリストのパーセンタイル（最近傍法）"""
+    if not sorted_values:
+        return 0.0
+    # 順位は ceil(q/100 × n)（1始まり。q / 100 を先に計算すると 7 / 100 * 100 = 7.000…01 のように誤差で1つずれる）
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values) / 100) - 1))
+    return sorted_values[k]
+
+
+class MetricsCollector:
+    """
+    ページごとの計測結果をJSONLに書き出し、サマリーと遅いページのプロファイルを出力する
+
+    出力ファイル（metrics_dir 以下、実行ごとに時刻付きの名前）:
+        metrics_YYYYmmdd_HHMMSS.jsonl: 1行1ページの計測結果
+        summary_YYYYmmdd_HHMMSS.txt: ステージごとの p50/p95/p99 表
+        profiles_YYYYmmdd_HHMMSS/: 遅いページの .prof（pstatsで読める）と tracemalloc の結果
+    """
+
+    def __init__(self, metrics_dir: Path, profile_slowest: int = 0):
+        self.metrics_dir = Path(metrics_dir)
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        self.profile_slowest = profile_slowest
+        self.run_id = time.strftime("%Y%m%d_%H%M%S")
+        self.jsonl_path = self.metrics_dir / f"metrics_{self.run_id}.jsonl"
+        self.summary_path = self.metrics_dir / f"summary_{self.run_id}.txt"
+        self._file = open(self.jsonl_path, "w", encoding="utf-8")
+        self._stage_walls: Dict[str, List[float]] = {}
+        self._stage_cpus: Dict[str, List[float]] = {}
+        self._totals: List[float] = []
+        # 最も遅いNページのプロファイルだけを保持する（wall_total の最小ヒープ）
+        self._slowest: List[Tuple[float, int, PageMetrics]] = []
+
+    @property
+    def level(self) -> int:
+        return LEVEL_PROFILE if self.profile_slowest > 0 else LEVEL_TIMING
+
+    def record(self, metrics: PageMetrics) -> None:
+        self._file.write(json.dumps(metrics.to_json(), ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._totals.append(metrics.wall_total)
+        for name, entry in metrics.stages.items():
+            self._stage_walls.setdefault(name, []).append(entry["wall"])
+            self._stage_cpus.setdefault(name, []).append(entry["cpu"])
+        if metrics.profiles and self.profile_slowest > 0:
+            item = (metrics.wall_total, metrics.index, metrics)
+            if len(self._slowest) < self.profile_slowest:
+                heapq.heappush(self._slowest, item)
+            elif item > self._slowest[0]:
+                heapq.heapreplace(self._slowest, item)
+        else:
+            metrics.profiles.clear()
+
+    def summary_table(self) -> str:
+        """ステージごとの p50/p95/p99（ミリ秒）の表"""
+        header = f"{'stage':<16}{'count':>7}{'wall p50':>11}{'p95':>10}{'p99':>10}{'cpu p50':>11}{'total(s)':>11}"
+        lines = [header, "-" * len(header)]
+        rows = list(self._stage_walls.items()) + [("page_total", self._totals)]
+        for name, walls in rows:
+            walls_sorted = sorted(walls)
+            cpus_sorted = sorted(self._stage_cpus.get(name, []))
+            lines.append(
+                f"{name:<16}{len(walls):>7}"
+                f"{percentile(walls_sorted, 50) * 1000:>11.1f}"
+                f"{percentile(walls_sorted, 95) * 1000:>10.1f}"
+                f"{percentile(walls_sorted, 99) * 1000:>10.1f}"
+                f"{(percentile(cpus_sorted, 50) * 1000 if cpus_sorted else 0.0):>11.1f}"
+                f"{sum(walls):>11.2f}"
+            )
+        lines.append("(wall/cpu の単位はミリ秒)")
+        return "\n".join(lines)
+
+    def close(self) -> str:
+        """JSONLを閉じ、サマリーとプロファイルを書き出してサマリー表を返す"""
+        self._file.close()
+        table = self.summary_table()
+        self.summary_path.write_text(table + "\n", encoding="utf-8")
+        if self._slowest:
+            profile_dir = self.metrics_dir / f"profiles_{self.run_id}"
+            profile_dir.mkdir(exist_ok=True)
+            for wall_total, _, metrics in sorted(self._slowest, reverse=True):
+                # "文書.pdf#3" のようなページ名もファイル名として使える形にする
+                stem = re.sub(r"[^\w\-#]", "_", metrics.name)
+                for process_kind, prof in metrics.profiles.items():
+                    (profile_dir / f"{stem}_{process_kind}.prof").write_bytes(prof["profile"])
+                    tm = prof["tracemalloc"]
+                    (profile_dir / f"{stem}_{process_kind}_tracemalloc.txt").write_text(
+                        f"page: {metrics.name} (wall_total={wall_total:.3f}s)\n"
+                        f"peak traced memory: {tm['peak_mb']:.1f} MB\n\n" + "\n".join(tm["top"]) + "\n",
+                        encoding="utf-8",
+                    )
+        return table
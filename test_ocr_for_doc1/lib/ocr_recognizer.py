@@ -13,14 +13,18 @@ pytesseract.pytesseract.tesseract_cmd = r"C:\Users\NakanoShiryu\AppData\Local\Pr
 
 
 class OCRRecognizer:
-    def __init__(self):
+    def __init__(self, timeout: float = 0):
         """
         Tesseractの実行パスを設定します。
         環境に合わせて、コメントアウトを解除しパスを修正してください。
+
+        Args:
+            timeout: 1ページあたりのTesseract実行タイムアウト（秒）。0の場合は無制限。
+                     タイムアウトした場合はTesseractプロセスを強制終了し、TimeoutErrorを送出します。
         """
         # Tesseractの実行パスを設定（環境に応じて変更してください）
         # pytesseract.pytesseract.tesseract_cmd = r'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
-        pass
+        self.timeout = timeout
 
     def recognize_text(self, image):
         """
@@ -37,19 +41,28 @@ class OCRRecognizer:
 
         try:
             # まず日本語で試す
-            text = pytesseract.image_to_string(image, lang='jpn')
+            text = pytesseract.image_to_string(image, lang='jpn', timeout=self.timeout)
             return text
         except pytesseract.TesseractError as e:
             # 日本語が利用できない場合は英語で実行
             print(f"日本語言語データエラー: {e}")
             print("英語で処理を続行します。")
-            text = pytesseract.image_to_string(image, lang='eng')
+            text = pytesseract.image_to_string(image, lang='eng', timeout=self.timeout)
+            return text
+        except RuntimeError as e:
+            # pytesseractはタイムアウト時にプロセスをkillしてRuntimeErrorを送出する
+            # ハングしたページを英語で再実行しても同じ結果になるため、ここで打ち切る
+            if "timeout" in str(e).lower():
+                raise TimeoutError(f"Tesseractの実行が{self.timeout}秒でタイムアウトしました") from e
+            print(f"OCR処理中にエラー: {e}")
+            print("英語で処理を続行します。")
+            text = pytesseract.image_to_string(image, lang='eng', timeout=self.timeout)
             return text
         except Exception as e:
             # その他のエラーも英語で再試行
             print(f"OCR処理中にエラー: {e}")
             print("英語で処理を続行します。")
-            text = pytesseract.image_to_string(image, lang='eng')
+            text = pytesseract.image_to_string(image, lang='eng', timeout=self.timeout)
             return text
 
 
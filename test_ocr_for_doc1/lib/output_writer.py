@@ -4,7 +4,7 @@ from typing import Dict, Any
 
 class OutputWriter:
     @staticmethod
-    def write_json(data: Dict[str, Any], filename: str, output_dir: str = ".")-> None:
+    def write_json(data: Dict[str, Any], filename: str, output_dir: str = ".", verbose: bool = True)-> None:
         """
         抽出されたデータをJSON形式でファイルに書き込みます。
         このメソッドは静的メソッドとして定義されています。
@@ -13,6 +13,7 @@ class OutputWriter:
             data (Dict[str, Any]): 出力する辞書形式のデータ。複数階層を含むことができます。
             filename (str): 出力ファイル名。
             output_dir (str): 出力ディレクトリ。デフォルトはカレントディレクトリ。
+            verbose (bool): Falseの場合、生成メッセージを表示しない。
         """
         if not isinstance(data, dict):
             raise TypeError("dataは辞書型である必要があります。")
@@ -23,7 +24,8 @@ class OutputWriter:
         try:
             with open(output_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"JSONファイルを生成しました: {output_path}")
+            if verbose:
+                print(f"JSONファイルを生成しました: {output_path}")
         except IOError as e:
             raise IOError(f"JSONファイルの書き込み中にエラーが発生しました: {e}")
         except Exception as e:
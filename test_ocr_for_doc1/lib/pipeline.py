@@ -0,0 +1,596 @@
+"""
+ステージ並列OCRパイプライン
+
+画像読み込み → 前処理 → OCR → フィールド分割・出力 の各ステージを
+有界キューでつなぎ、ページ単位で並列に処理します。
+
+- 読み込み・書き出し: I/Oスレッド（OpenCVのデコード・ファイル書き込みはGILを解放する）
+- 前処理・OCR: ステージごとに独立したプロセスプール（ワーカー数はステージごとに指定）
+- キューはすべて有界のため、下流が詰まると上流が待機し、メモリ使用量は一定に保たれる
+- 処理結果は入力順に報告される（処理自体は順不同で完了する）
+- PDF・複数ページTIFFはページ単位（PageRef）で投入でき、読み込みステージで該当ページだけをデコードする
+- 1ページあたりのタイムアウトを超えたTesseractは強制終了される
+- プロセス間の画像は共有メモリのハンドルで受け渡す（lib/shm_transport.py）
+- metrics_dir を指定するとページ・ステージ単位の計測結果を出力する（lib/metrics.py）
+"""
+from __future__ import annotations
+
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from lib.image_loader import ImageLoader, page_key, page_stem
+from lib.data_parser import DataParser
+from lib.output_writer import OutputWriter
+from lib.metrics import (
+    LEVEL_OFF,
+    MetricsCollector,
+    PageMetrics,
+    StageRecorder,
+    peak_rss_mb,
+    run_instrumented,
+    stage,
+)
+from lib.shm_transport import (
+    ImageHandle,
+    SharedImageSlab,
+    attach_worker_slab,
+    resolve_image,
+    store_result,
+)
+
+
+def _default_cpu_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+# ----------------------------
+# 設定・データコンテナ
+# ----------------------------
+@dataclass
+class PipelineConfig:
+    """
+    パイプラインの設定
+
+    Attributes:
+        use_preprocessing: 前処理（射影変換）を使用するかどうか
+        pdf_dpi: PDFをページ画像にレンダリングする解像度
+        use_text_layer: Trueの場合、テキストレイヤーを持つPDFページ（電子的に作成されたPDF）は
+                        レンダリング・前処理・OCRを行わず、そのテキストと単語の座標を出力する
+        min_text_chars: テキストレイヤーとみなす最小文字数（これより少ないページはOCRする）
+        grayscale: Trueの場合、画像をグレースケールでデコードする（以降のステージはすべてグレースケールで処理され、
+                   デコード・共有メモリ・プロセス間転送の量が約1/3になる）
+        load_workers: 画像読み込みスレッド数
+        preprocess_workers: 前処理プロセス数
+        ocr_workers: OCRプロセス数（Tesseractはページごとにシングルスレッドで実行する）
+        write_workers: 出力書き込みスレッド数
+        queue_size: ステージ間キューの最大長（バックプレッシャーの閾値）
+        page_timeout: 1ページあたりのステージ処理タイムアウト（秒）。Noneの場合は無制限
+        use_shared_memory: プロセス間の画像受け渡しに共有メモリを使うかどうか（Falseではpickle転送）
+        shm_slot_mb: 共有メモリの1スロットのサイズ（MB）。これを超える画像はpickle転送になる
+        shm_slots: 共有メモリのスロット数。Noneの場合は同時処理ページ数から自動決定
+        metrics_dir: 計測結果（JSONL・サマリー表）の出力先。Noneの場合は計測しない
+        profile_slowest: 0より大きい場合、最も遅いNページの cProfile / tracemalloc の結果を保存する
+        verbose: Falseの場合、ページごとのファイル生成メッセージを表示しない
+    """
+    use_preprocessing: bool = True
+    pdf_dpi: int = 300
+    use_text_layer: bool = True
+    min_text_chars: int = 20
+    grayscale: bool = False
+    load_workers: int = 2
+    preprocess_workers: int = field(default_factory=lambda: max(1, _default_cpu_workers() // 4))
+    ocr_workers: int = field(default_factory=_default_cpu_workers)
+    write_workers: int = 2
+    queue_size: int = 4
+    page_timeout: Optional[float] = 300.0
+    use_shared_memory: bool = True
+    shm_slot_mb: int = 32
+    shm_slots: Optional[int] = None
+    metrics_dir: Optional[Path] = None
+    profile_slowest: int = 0
+    verbose: bool = True
+
+    def resolved_shm_slots(self) -> int:
+        if self.shm_slots is not None:
+            return self.shm_slots
+        return self.preprocess_workers + self.ocr_workers + self.queue_size * 2
+
+
+@dataclass(frozen=True)
+class PageRef:
+    """
+    複数ページ文書の1ページを指す参照
+
+    Attributes:
+        path: 文書（PDF・TIFF）のパス
+        page: ページ番号（1始まり）。Noneの場合はファイル全体を1枚の画像として読み込む
+    """
+    path: Path
+    page: Optional[int] = None
+
+    @property
+    def key(self) -> str:
+        """表示・マニフェスト用の名前（"文書名#ページ"）"""
+        return page_key(self.path.name, self.page)
+
+    @property
+    def stem(self) -> str:
+        """出力ファイル名の基部（"文書名#003"）"""
+        return page_stem(self.path.stem, self.page)
+
+
+@dataclass
+class PageResult:
+    """
+    1ページ分の処理結果
+
+    Attributes:
+        index: 入力順のインデックス
+        path: 入力画像のパス
+        page: ページ番号（複数ページ文書の場合）
+        success: 処理に成功したかどうか
+        transformed: 射影変換が適用されたかどうか
+        text_length: OCRテキストの文字数
+        source: テキストの取得元（"ocr" または PDFのテキストレイヤーを使った場合は "text_layer"）
+        output_paths: 生成したファイルのパス
+        error: 失敗時のエラーメッセージ
+    """
+    index: int
+    path: Path
+    success: bool
+    page: Optional[int] = None
+    transformed: bool = False
+    text_length: int = 0
+    source: str = "ocr"
+    output_paths: List[Path] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+@dataclass
+class _PageTask:
+    """ステージ間を流れる作業単位"""
+    index: int
+    path: Path
+    page: Optional[int] = None
+    image: Any = None
+    transformed: bool = False
+    ocr_text: Optional[str] = None
+    text_layer: Any = None
+    output_paths: List[Path] = field(default_factory=list)
+    error: Optional[str] = None
+    started: float = 0.0
+    recorder: Optional[StageRecorder] = None
+    worker_infos: Dict[str, Any] = field(default_factory=dict)
+
+
+_SENTINEL = object()
+
+
+# ----------------------------
+# ワーカープロセス側の処理
+# ----------------------------
+# ワーカープロセスごとに一度だけエンジンを生成し、ページ間で使い回す
+_preprocessor = None
+_ocr_recognizer = None
+
+
+def _ignore_sigint() -> None:
+    # Ctrl+Cは親プロセスで受けて後始末するため、ワーカー側では無視する
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _init_preprocess_worker(slab_args: Optional[tuple]) -> None:
+    global _preprocessor
+    import cv2
+    from lib.preprocess import Preprocessor
+
+    _ignore_sigint()
+    # プロセス単位で並列化するため、OpenCV内部のスレッド並列は無効化する
+    cv2.setNumThreads(1)
+    if slab_args is not None:
+        attach_worker_slab(*slab_args)
+    _preprocessor = Preprocessor()
+
+
+def _preprocess_body(recorder: Optional[StageRecorder], image_ref):
+    result = _preprocessor.process_one(resolve_image(image_ref), recorder=recorder)
+    if result.matrix is None:
+        # 射影変換なし: 呼び出し元が元画像を保持しているので送り返さない
+        return None, False
+    # 変換結果は入力と同じスロットに書き戻し、ハンドルだけを返す
+    return store_result(image_ref, result.transformed), True
+
+
+def _preprocess_task(image_ref, level: int = LEVEL_OFF):
+    return run_instrumented(_preprocess_body, level, image_ref)
+
+
+def _init_ocr_worker(timeout: float, slab_args: Optional[tuple]) -> None:
+    global _ocr_recognizer
+    _ignore_sigint()
+    # TesseractのOpenMPによるスレッド並列を無効化（プロセス並列と競合して遅くなるため）
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    from lib.ocr_recognizer import OCRRecognizer
+
+    if slab_args is not None:
+        attach_worker_slab(*slab_args)
+    _ocr_recognizer = OCRRecognizer(timeout=timeout)
+
+
+def _ocr_body(recorder: Optional[StageRecorder], image_ref) -> str:
+    image = resolve_image(image_ref)
+    if recorder is not None:
+        recorder.set("pixels_ocr", int(image.shape[0] * image.shape[1]))
+    with stage(recorder, "tesseract"):
+        return _ocr_recognizer.recognize_text(image)
+
+
+class TesseractTimeout(RuntimeError):
+    """
+    ワーカー内でTesseractの実行がタイムアウトした
+
+    TimeoutError のままでは親プロセスの future.result() の待ち時間切れと区別できず、
+    プールごと作り直してしまうため、別の型にして送る（Tesseractのプロセスは pytesseract が終了済み）。
+    """
+
+
+def _ocr_task(image_ref, level: int = LEVEL_OFF):
+    try:
+        return run_instrumented(_ocr_body, level, image_ref)
+    except TimeoutError as e:
+        raise TesseractTimeout(str(e)) from None
+    except Exception as e:
+        # pytesseractの例外には親プロセスで復元（unpickle）できないものがあり、
+        # そのまま送るとプール全体が BrokenProcessPool になるため、メッセージだけを渡す
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+# ----------------------------
+# ステージ実行基盤
+# ----------------------------
+class _WorkerPool:
+    """
+    ステージ専用のプロセスプール
+
+    タイムアウトしたページがワーカーを占有し続けないよう、
+    タイムアウト時はプールごと強制終了して作り直す。
+    巻き添えで失敗したページは新しいプールで1回だけ再実行する。
+    """
+
+    def __init__(self, workers: int, initializer: Callable, initargs: tuple = ()):
+        self.workers = workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self._lock = threading.Lock()
+        self._executor = self._create()
+
+    def _create(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers, initializer=self.initializer, initargs=self.initargs
+        )
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is not broken:
+                return  # 他のスレッドが既に作り直している
+            for process in list((broken._processes or {}).values()):
+                process.terminate()
+            manager = broken._executor_manager_thread
+            broken.shutdown(wait=False, cancel_futures=True)
+            # 管理スレッドはワーカーの終了を検知して後始末するので、それを待ってから作り直す
+            # （残したままにすると、インタプリタ終了時に閉じたパイプへの書き込みでエラーになる）
+            if manager is not None:
+                manager.join(timeout=10)
+            self._executor = self._create()
+
+    def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        for attempt in range(2):
+            executor = self._executor
+            try:
+                future = executor.submit(fn, *args)
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                if future.done():
+                    raise  # ワーカー内で送出された TimeoutError（プールは正常なので作り直さない）
+                self._restart(executor)
+                raise TimeoutError(f"ページ処理が{timeout}秒でタイムアウトしました")
+            except BrokenProcessPool:
+                self._restart(executor)
+                if attempt == 1:
+                    raise
+        raise RuntimeError("unreachable")
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class _Stage:
+    """有界キューから作業を取り出して処理し、次のキューへ渡すスレッド群"""
+
+    def __init__(self, name: str, fn: Callable[[_PageTask], None], workers: int,
+                 in_q: queue.Queue, out_q: queue.Queue,
+                 on_error: Optional[Callable[[_PageTask], None]] = None):
+        self.name = name
+        self.fn = fn
+        self.on_error = on_error
+        self.in_q = in_q
+        self.out_q = out_q
+        self.threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+
+    def start(self) -> None:
+        for t in self.threads:
+            t.start()
+        threading.Thread(target=self._close_when_done, name=f"{self.name}-closer", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            task = self.in_q.get()
+            if task is _SENTINEL:
+                self.in_q.put(_SENTINEL)  # 同じステージの他のスレッドにも終了を伝える
+                return
+            if task.error is None:
+                try:
+                    with stage(task.recorder, self.name):
+                        self.fn(task)
+                except Exception as e:
+                    task.error = f"[{self.name}] {type(e).__name__}: {e}"
+                    if self.on_error is not None:
+                        self.on_error(task)
+                    task.image = None
+            self.out_q.put(task)
+
+    def _close_when_done(self) -> None:
+        for t in self.threads:
+            t.join()
+        self.out_q.put(_SENTINEL)
+
+
+# ----------------------------
+# 公開API
+# ----------------------------
+def write_page_outputs(
+    output_dir: Path,
+    base_filename: str,
+    ocr_text: str,
+    extracted_data: Dict[str, str],
+    output_writer: OutputWriter,
+    verbose: bool = True,
+    recorder: Optional[StageRecorder] = None,
+) -> List[Path]:
+    """
+    OCRテキスト(.txt)と構造化データ(.json)を出力
+
+    Returns:
+        生成したファイルのパスのリスト
+    """
+    txt_filepath = output_dir / (base_filename + "_ocr_text.txt")
+    with stage(recorder, "write_txt"):
+        with open(txt_filepath, 'w', encoding='utf-8') as f:
+            f.write(ocr_text)
+
+    json_filename = base_filename + "_structured_data.json"
+    with stage(recorder, "write_json"):
+        output_writer.write_json(extracted_data, json_filename, str(output_dir), verbose=verbose)
+    return [txt_filepath, output_dir / json_filename]
+
+
+def run_pipeline(
+    image_paths: Iterable[Union[Path, PageRef]],
+    output_dir: Path,
+    config: Optional[PipelineConfig] = None,
+    on_result: Optional[Callable[[PageResult], None]] = None,
+    collect_results: bool = True,
+) -> List[PageResult]:
+    """
+    画像群をステージ並列で処理
+
+    image_pathsは遅延評価されるため、ジェネレータを渡すと到着順にストリーミング処理できる。
+    PDF・複数ページTIFFはページごとの PageRef として渡す。
+
+    Args:
+        image_paths: 処理対象の画像パスまたは PageRef（イテラブル）
+        output_dir: 出力ディレクトリ
+        config: パイプライン設定（デフォルト: PipelineConfig()）
+        on_result: 各ページの処理完了時に入力順で呼ばれるコールバック
+        collect_results: Falseの場合は結果をリストに溜めない（終わらない入力を処理し続ける監視モード用。
+                         結果は on_result で受け取る）
+
+    Returns:
+        入力順に並んだPageResultのリスト（collect_results=False の場合は空）
+    """
+    config = config or PipelineConfig()
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    image_loader = ImageLoader()
+    data_parser = DataParser()
+    output_writer = OutputWriter()
+    timeout = config.page_timeout
+
+    # 計測を無効にした場合はレコーダーを作らず、各ステージは None チェックのみで素通りする
+    collector = None
+    if config.metrics_dir is not None:
+        collector = MetricsCollector(config.metrics_dir, config.profile_slowest)
+    level = collector.level if collector is not None else LEVEL_OFF
+
+    # 共有メモリのスロット数が同時に保持できるページ数の上限になる
+    slab = None
+    if config.use_shared_memory:
+        slab = SharedImageSlab.create(config.resolved_shm_slots(), config.shm_slot_mb * 1024 * 1024)
+    slab_args = slab.attach_args() if slab is not None else None
+
+    preprocess_pool = None
+    if config.use_preprocessing:
+        preprocess_pool = _WorkerPool(config.preprocess_workers, _init_preprocess_worker, (slab_args,))
+    # Tesseract自体のタイムアウト（プロセスkill）を優先し、プール側は少し長めに待つ
+    ocr_pool = _WorkerPool(config.ocr_workers, _init_ocr_worker, (timeout or 0, slab_args))
+    pool_timeout = timeout * 1.5 if timeout else None
+
+    def release(task: _PageTask) -> None:
+        if isinstance(task.image, ImageHandle):
+            slab.release(task.image.slot)
+        task.image = None
+
+    def load(task: _PageTask) -> None:
+        if task.page is not None and config.use_text_layer:
+            # テキストレイヤーがあればそれを使い、レンダリング以降のステージを素通りさせる
+            with stage(task.recorder, "text_layer"):
+                task.text_layer = image_loader.text_layer(task.path, task.page, config.min_text_chars)
+            if task.text_layer is not None:
+                task.ocr_text = task.text_layer.text
+                return
+        mode = "gray" if config.grayscale else "color"
+        if task.page is None:
+            image = image_loader.load_image(str(task.path), mode=mode)
+        else:
+            # 文書全体は展開せず、該当ページだけをデコードする
+            image = image_loader.load_page(task.path, task.page, mode=mode, dpi=config.pdf_dpi)
+        if task.recorder is not None:
+            task.recorder.set("pixels_in", int(image.shape[0] * image.shape[1]))
+        if slab is not None and slab.fits(image):
+            # 空きスロットがなければここで待機する（1ページの処理時間を過ぎても空かなければpickle転送にする）
+            try:
+                task.image = slab.put(image, timeout=timeout)
+            except TimeoutError:
+                task.image = image
+        else:
+            task.image = image
+
+    def preprocess(task: _PageTask) -> None:
+        if task.text_layer is not None:
+            return
+        (transformed, task.transformed), info = preprocess_pool.run(
+            _preprocess_task, task.image, level, timeout=timeout
+        )
+        if info is not None:
+            task.worker_infos["preprocess"] = info
+        if task.transformed:
+            if isinstance(task.image, ImageHandle) and not isinstance(transformed, ImageHandle):
+                # 結果がスロットに収まらずndarrayで返った場合は、入力のスロットを空きに戻す
+                slab.release(task.image.slot)
+            task.image = transformed
+
+    def ocr(task: _PageTask) -> None:
+        if task.text_layer is not None:
+            return
+        try:
+            task.ocr_text, info = ocr_pool.run(_ocr_task, task.image, level, timeout=pool_timeout)
+            if info is not None:
+                task.worker_infos["ocr"] = info
+        finally:
+            release(task)
+
+    def write(task: _PageTask) -> None:
+        with stage(task.recorder, "parse"):
+            extracted_data = data_parser.parse_fields(task.ocr_text)
+        task.output_paths = write_page_outputs(
+            output_dir, page_stem(task.path.stem, task.page), task.ocr_text, extracted_data, output_writer,
+            verbose=config.verbose, recorder=task.recorder,
+        )
+        if task.text_layer is not None:
+            # 単語の座標はレンダリングした場合の画像と同じピクセル座標で出力する
+            words_filename = page_stem(task.path.stem, task.page) + "_words.json"
+            with stage(task.recorder, "write_words"):
+                output_writer.write_json(task.text_layer.to_dict(dpi=config.pdf_dpi), words_filename,
+                                         str(output_dir), verbose=config.verbose)
+            task.output_paths.append(output_dir / words_filename)
+
+    stage_defs = [("load", load, config.load_workers)]
+    if preprocess_pool is not None:
+        stage_defs.append(("preprocess", preprocess, config.preprocess_workers))
+    stage_defs.append(("ocr", ocr, config.ocr_workers))
+    stage_defs.append(("write", write, config.write_workers))
+
+    queues = [queue.Queue(maxsize=config.queue_size) for _ in range(len(stage_defs) + 1)]
+    stages = [
+        _Stage(name, fn, workers, queues[i], queues[i + 1], on_error=release)
+        for i, (name, fn, workers) in enumerate(stage_defs)
+    ]
+
+    feed_errors: List[BaseException] = []
+
+    def feed() -> None:
+        try:
+            for index, item in enumerate(image_paths):
+                ref = item if isinstance(item, PageRef) else PageRef(Path(item))
+                task = _PageTask(index=index, path=Path(ref.path), page=ref.page)
+                if collector is not None:
+                    task.started = time.perf_counter()
+                    task.recorder = StageRecorder()
+                queues[0].put(task)
+        except BaseException as e:
+            feed_errors.append(e)
+        finally:
+            queues[0].put(_SENTINEL)
+
+    feeder = threading.Thread(target=feed, name="feeder", daemon=True)
+    feeder.start()
+    for pipeline_stage in stages:
+        pipeline_stage.start()
+
+    def record_metrics(task: _PageTask) -> None:
+        metrics = PageMetrics(
+            index=task.index,
+            name=page_key(task.path.name, task.page),
+            success=task.error is None,
+            wall_total=time.perf_counter() - task.started,
+            stages=task.recorder.stages,
+            values=task.recorder.values,
+        )
+        for process_kind, info in task.worker_infos.items():
+            metrics.add_worker_info(process_kind, info)
+        metrics.peak_rss_mb["main"] = peak_rss_mb()
+        collector.record(metrics)
+
+    # 完了順に届く結果を入力順に並べ替えて報告する
+    results: List[PageResult] = []
+    pending: Dict[int, PageResult] = {}
+    next_index = 0
+    try:
+        while True:
+            task = queues[-1].get()
+            if task is _SENTINEL:
+                break
+            if collector is not None:
+                record_metrics(task)
+            pending[task.index] = PageResult(
+                index=task.index,
+                path=task.path,
+                page=task.page,
+                success=task.error is None,
+                transformed=task.transformed,
+                text_length=len(task.ocr_text or ""),
+                source="text_layer" if task.text_layer is not None else "ocr",
+                output_paths=task.output_paths,
+                error=task.error,
+            )
+            while next_index in pending:
+                result = pending.pop(next_index)
+                if collect_results:
+                    results.append(result)
+                if on_result is not None:
+                    on_result(result)
+                next_index += 1
+    finally:
+        if preprocess_pool is not None:
+            preprocess_pool.shutdown()
+        ocr_pool.shutdown()
+        if slab is not None:
+            slab.close()
+        if collector is not None:
+            print("\n" + collector.close())
+            print(f"計測結果: {collector.jsonl_path}")
+
+    if feed_errors:
+        raise feed_errors[0]
+    return results
@@ -4,6 +4,11 @@ from typing import Protocol, Tuple, Optional, Sequence, runtime_checkable
 import numpy as np
 import cv2
 
+try:
+    from lib.metrics import stage
+except ImportError:  # python lib/preprocess.py として実行した場合
+    from metrics import stage
+
 
 # ----------------------------
 # 型とデータコンテナ
@@ -171,25 +176,32 @@ class Preprocessor:
         self.transform_strategy = transform_strategy or ApproxPolyPerspectiveTransform()
 
     # 公開 API: 1枚処理して最終的に透視変換画像を返す
-    def process_one(self, bgr_img: Image) -> TransformResult:
+    def process_one(self, bgr_img: Image, recorder=None) -> TransformResult:
         """
         入力: BGR image (np.ndarray)
         出力: TransformResult (transformed image + matrix + dst_size)
+
+        recorder: ステップごとの所要時間を記録するレコーダー（lib/metrics.py の StageRecorder）。
+                  None の場合は計測しない
         """
         if bgr_img is None:
             raise ValueError("input image is None")
 
         # 1) グレースケール化
-        gray = self._to_gray(bgr_img)
+        with stage(recorder, "to_gray"):
+            gray = self._to_gray(bgr_img)
 
         # 2) 二値化（閾値算出）
-        thr_res = self.threshold_strategy.compute(gray)
+        with stage(recorder, "threshold"):
+            thr_res = self.threshold_strategy.compute(gray)
 
         # 3) 輪郭抽出・選択
-        cnt_res = self.contour_strategy.find(thr_res.binarized)
+        with stage(recorder, "find_contours"):
+            cnt_res = self.contour_strategy.find(thr_res.binarized)
 
         # 4) 透視変換
-        trans_res = self.transform_strategy.compute(cnt_res.chosen_contour, bgr_img)
+        with stage(recorder, "warp"):
+            trans_res = self.transform_strategy.compute(cnt_res.chosen_contour, bgr_img)
 
         return trans_res
 
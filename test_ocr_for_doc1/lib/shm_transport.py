@@ -0,0 +1,298 @@
+"""
+共有メモリによる画像受け渡しモジュール
+
+パイプラインのプロセス間で画像（ndarray）をpickleせずに受け渡すため、
+multiprocessing.shared_memory 上に固定サイズのスロットを並べたスラブを確保します。
+
+- 親プロセスがスラブを生成し、スロットの割り当て・参照カウントを管理する
+- ページは (slot, shape, dtype) のハンドル（ImageHandle）としてプロセス間を移動する
+- ワーカープロセスはスラブにアタッチし、ハンドルからコピーなしでNumPyビューを得る
+- スロットに収まらない画像は呼び出し側でpickle転送にフォールバックする
+"""
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class ImageHandle:
+    """
+    共有メモリ上の画像を指すハンドル（pickleしても数十バイト）
+
+    Attributes:
+        slot: スロット番号
+        shape: 画像の形状
+        dtype: 画像のdtype名
+    """
+    slot: int
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+class SharedImageSlab:
+    """
+    固定サイズスロットのスラブアロケータ
+
+    create() で生成したインスタンス（所有者）のみがスロットの割り当て・解放を行う。
+    attach() で生成したインスタンス（ワーカー側）はビューの取得と書き込みのみ行う。
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, slot_count: int, slot_bytes: int, owner: bool):
+        self._shm = shm
+        self.slot_count = slot_count
+        self.slot_bytes = slot_bytes
+        self.owner = owner
+        self._refcounts = [0] * slot_count
+        self._free = list(range(slot_count - 1, -1, -1))
+        self._cond = threading.Condition()
+
+    @classmethod
+    def create(cls, slot_count: int, slot_bytes: int) -> "SharedImageSlab":
+        """
+        スラブを新規に確保（親プロセス用）
+
+        Args:
+            slot_count: スロット数（同時に保持できるページ数の上限）
+            slot_bytes: 1スロットのバイト数（1ページの最大サイズ）
+        """
+        if slot_count <= 0 or slot_bytes <= 0:
+            raise ValueError("slot_count と slot_bytes は正の値である必要があります")
+        shm = shared_memory.SharedMemory(create=True, size=slot_count * slot_bytes)
+        return cls(shm, slot_count, slot_bytes, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, slot_count: int, slot_bytes: int) -> "SharedImageSlab":
+        """既存のスラブにアタッチ（ワーカープロセス用）"""
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, slot_count, slot_bytes, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def attach_args(self) -> tuple:
+        """ワーカーの initializer に渡す引数"""
+        return (self.name, self.slot_count, self.slot_bytes)
+
+    # ----------------------------
+    # スロット管理（所有者のみ）
+    # ----------------------------
+    def fits(self, image: np.ndarray) -> bool:
+        return image.nbytes <= self.slot_bytes
+
+    def allocate(self, timeout: Optional[float] = None) -> int:
+        """
+        空きスロットを1つ確保（参照カウント1）
+
+        空きがない場合は解放されるまで待機する（これがメモリ上限のバックプレッシャーになる）。
+        """
+        self._check_owner()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._free:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("共有メモリの空きスロット待ちがタイムアウトしました")
+                self._cond.wait(remaining)
+            slot = self._free.pop()
+            self._refcounts[slot] = 1
+            return slot
+
+    def retain(self, slot: int) -> None:
+        """スロットの参照カウントを増やす"""
+        self._check_owner()
+        with self._cond:
+            if self._refcounts[slot] <= 0:
+                raise ValueError(f"解放済みのスロットです: {slot}")
+            self._refcounts[slot] += 1
+
+    def release(self, slot: int) -> None:
+        """スロットの参照カウントを減らし、0になったら空きに戻す"""
+        self._check_owner()
+        with self._cond:
+            if self._refcounts[slot] <= 0:
+                raise ValueError(f"解放済みのスロットです: {slot}")
+            self._refcounts[slot] -= 1
+            if self._refcounts[slot] == 0:
+                self._free.append(slot)
+                self._cond.notify()
+
+    def put(self, image: np.ndarray, timeout: Optional[float] = None) -> ImageHandle:
+        """スロットを確保して画像をコピーし、ハンドルを返す"""
+        if not self.fits(image):
+            raise ValueError(f"画像がスロットサイズを超えています: {image.nbytes} > {self.slot_bytes}")
+        slot = self.allocate(timeout)
+        return self.write(slot, image)
+
+    # ----------------------------
+    # ビュー・書き込み（全プロセス）
+    # ----------------------------
+    def view(self, handle: ImageHandle) -> np.ndarray:
+        """ハンドルが指す画像のNumPyビュー（コピーなし）"""
+        return np.ndarray(
+            handle.shape, dtype=handle.dtype, buffer=self._shm.buf, offset=handle.slot * self.slot_bytes
+        )
+
+    def write(self, slot: int, image: np.ndarray) -> ImageHandle:
+        """スロットに画像を書き込み、そのハンドルを返す"""
+        if not self.fits(image):
+            raise ValueError(f"画像がスロットサイズを超えています: {image.nbytes} > {self.slot_bytes}")
+        handle = ImageHandle(slot=slot, shape=tuple(image.shape), dtype=image.dtype.str)
+        np.copyto(self.view(handle), image)
+        return handle
+
+    def close(self) -> None:
+        """スラブを閉じる（所有者は共有メモリも破棄する）"""
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+    def _check_owner(self) -> None:
+        if not self.owner:
+            raise RuntimeError("スロット管理はスラブを生成したプロセスでのみ行えます")
+
+
+# ----------------------------
+# ワーカープロセス側のヘルパー
+# ----------------------------
+_worker_slab: Optional[SharedImageSlab] = None
+
+
+def attach_worker_slab(name: str, slot_count: int, slot_bytes: int) -> None:
+    """ワーカープロセスの initializer から呼び、プロセス内で1度だけアタッチする"""
+    global _worker_slab
+    _worker_slab = SharedImageSlab.attach(name, slot_count, slot_bytes)
+
+
+def resolve_image(image_ref) -> np.ndarray:
+    """ImageHandle ならスラブ上のビューを、ndarray ならそのまま返す"""
+    if isinstance(image_ref, ImageHandle):
+        return _worker_slab.view(image_ref)
+    return image_ref
+
+
+def store_result(image_ref, result: np.ndarray):
+    """
+    入力と同じスロットに処理結果を書き戻す
+
+    入力がハンドルで結果がスロットに収まる場合はハンドルを、
+    それ以外（pickle転送中・スロット超過）はndarrayをそのまま返す。
+    """
+    if isinstance(image_ref, ImageHandle) and _worker_slab.fits(result):
+        return _worker_slab.write(image_ref.slot, result)
+    return result
+
+
+# ----------------------------
+# ベンチマーク: pickle転送 vs 共有メモリ転送
+# ----------------------------
+_bench_preprocessor = None
+_bench_ocr = None
+
+
+def _init_bench_worker(slab_args, run_ocr: bool) -> None:
+    global _bench_preprocessor, _bench_ocr
+    import cv2
+    from lib.preprocess import Preprocessor
+    from lib.ocr_recognizer import OCRRecognizer
+
+    cv2.setNumThreads(1)
+    if slab_args is not None:
+        attach_worker_slab(*slab_args)
+    _bench_preprocessor = Preprocessor()
+    _bench_ocr = OCRRecognizer() if run_ocr else None
+
+
+def _bench_preprocess(image_ref):
+    image = resolve_image(image_ref)
+    result = _bench_preprocessor.process_one(image)
+    if result.matrix is None:
+        return image_ref if isinstance(image_ref, ImageHandle) else image
+    return store_result(image_ref, result.transformed)
+
+
+def _bench_ocr_task(image_ref) -> int:
+    image = resolve_image(image_ref)
+    if _bench_ocr is None:
+        # Tesseractなし: 転送コストのみを測るため画素を1回読むだけにする
+        return int(image[::64, ::64].sum())
+    return len(_bench_ocr.recognize_text(image))
+
+
+def benchmark(image_paths, workers: int = 4, run_ocr: bool = False, slot_mb: int = 32) -> dict:
+    """
+    ImageLoader → Preprocessor → OCRRecognizer の経路で、
+    pickle転送と共有メモリ転送の所要時間を比較
+
+    Args:
+        image_paths: ベンチマークに使う画像パス
+        workers: 前処理・OCRそれぞれのプロセス数
+        run_ocr: Trueの場合は実際にTesseractを実行する（Falseでは転送コストのみ計測）
+        slot_mb: 共有メモリの1スロットのサイズ（MB）
+
+    Returns:
+        {"pickle": 秒, "shared_memory": 秒}
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from lib.image_loader import ImageLoader
+
+    loader = ImageLoader()
+    images = [loader.load_image(str(p)) for p in image_paths]
+    timings = {}
+
+    for mode in ("pickle", "shared_memory"):
+        slab = None
+        if mode == "shared_memory":
+            slab = SharedImageSlab.create(slot_count=len(images), slot_bytes=slot_mb * 1024 * 1024)
+        slab_args = slab.attach_args() if slab else None
+        with ProcessPoolExecutor(workers, initializer=_init_bench_worker, initargs=(slab_args, run_ocr)) as pre_pool, \
+                ProcessPoolExecutor(workers, initializer=_init_bench_worker, initargs=(slab_args, run_ocr)) as ocr_pool:
+            # ワーカーの起動コストを計測から除外する
+            list(pre_pool.map(int, range(workers)))
+            list(ocr_pool.map(int, range(workers)))
+
+            start = time.perf_counter()
+            refs = [slab.put(img) if slab and slab.fits(img) else img for img in images]
+            preprocessed = [f.result() for f in [pre_pool.submit(_bench_preprocess, r) for r in refs]]
+            [f.result() for f in [ocr_pool.submit(_bench_ocr_task, r) for r in preprocessed]]
+            timings[mode] = time.perf_counter() - start
+
+            if slab:
+                for ref in refs:
+                    if isinstance(ref, ImageHandle):
+                        slab.release(ref.slot)
+        if slab:
+            slab.close()
+
+    return timings
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+
+    # 使い方: python lib/shm_transport.py [ocr]
+    #   ocr を付けると実際にTesseractを実行する（付けない場合は転送コストのみ計測）
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    run_ocr = len(sys.argv) > 1 and "ocr" in sys.argv[1:]
+
+    current_dir = Path(__file__).parent
+    images_dir = current_dir.parent / "documents" / "images" / "sample"
+    paths = sorted(p for p in images_dir.iterdir() if p.suffix.lower() in {".png", ".jpg", ".jpeg", ".tif", ".tiff"})
+    print(f"画像ディレクトリ: {images_dir} ({len(paths)}枚)")
+    print(f"Tesseract実行: {run_ocr}")
+
+    result = benchmark(paths, run_ocr=run_ocr)
+    for mode, seconds in result.items():
+        print(f"{mode:>14}: {seconds:.3f} 秒 ({len(paths) / seconds:.2f} 枚/秒)")
+    print(f"速度比 (pickle / shared_memory): {result['pickle'] / result['shared_memory']:.2f}x")
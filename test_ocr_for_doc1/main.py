@@ -1,13 +1,17 @@
 import os
-import json
+import sys
 import re
 from pathlib import Path
-from typing import List
-from lib.image_loader import ImageLoader
-from lib.preprocess import Preprocessor
-from lib.ocr_recognizer import OCRRecognizer
-from lib.data_parser import DataParser
-from lib.output_writer import OutputWriter
+from dataclasses import replace
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from lib.image_loader import ImageLoader, page_key
+from lib.pipeline import PipelineConfig, PageRef, PageResult, run_pipeline
+
+# プロジェクトルート（共通モジュール util/）をパスに追加
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from util.manifest import RunManifest
+from util.page_range import PageSpec, parse_page_range
+from util.watch_folder import FolderWatcher, move_to_done
 
 
 def natural_key(path: Path):
@@ -17,91 +21,33 @@ def natural_key(path: Path):
     return [int(s) if s.isdigit() else s.lower() for s in re.split(r"(\d+)", path.name)]
 
 
-def process_single_image(image_path: Path, output_dir: Path, use_preprocessing: bool = True):
-    """
-    単一画像のOCR処理
-    
-    Args:
-        image_path: 画像ファイルのパス
-        output_dir: 出力ディレクトリ
-        use_preprocessing: 前処理（射影変換）を使用するかどうか
-    """
-    try:
-        # 0. 画像の読み込み
-        image_loader = ImageLoader()
-        original_image = image_loader.load_image(str(image_path))
-        print(f"画像を読み込みました: {image_path.name}")
-
-        # 1. OpenCVによる前処理（傾き補正・射影変換）
-        if use_preprocessing:
-            preprocessor = Preprocessor()
-            preprocess_result = preprocessor.process_one(original_image)
-            
-            # 前処理の結果を確認：射影変換が失敗した場合は元画像を使用
-            if preprocess_result.matrix is None:
-                print("射影変換が適用されませんでした。元画像を使用します。")
-                corrected_image = original_image
-            else:
-                print("射影変換を適用しました。")
-                corrected_image = preprocess_result.transformed
-            
-            print("前処理（傾き補正・射影変換）を完了しました。")
-        else:
-            print("前処理をスキップし、元画像を直接使用します。")
-            corrected_image = original_image
-        
-        # 2. TesseractによるOCR文字認識
-        ocr_recognizer = OCRRecognizer()
-        ocr_text = ocr_recognizer.recognize_text(corrected_image)
-        print("OCR文字認識を完了しました。")
-        print("OCR認識結果の一部:")
-        print(ocr_text[:200] + "..." if len(ocr_text) > 200 else ocr_text)
-        
-        # 3. 正規表現でフィールド分割
-        data_parser = DataParser()
-        extracted_data = data_parser.parse_fields(ocr_text)
-        print("正規表現によるフィールド分割を完了しました。")
-        print("フィールド分割結果の一部:")
-        print(json.dumps(extracted_data, ensure_ascii=False, indent=2)[:200] + "..." if len(json.dumps(extracted_data, ensure_ascii=False, indent=2)) > 200 else json.dumps(extracted_data, ensure_ascii=False, indent=2))
-        
-        # 4. 出力ファイル生成
-        output_writer = OutputWriter()
-        base_filename = image_path.stem
-        
-        # 4-1. OCR認識テキストをtxtファイルに保存
-        txt_filename = base_filename + "_ocr_text.txt"
-        txt_filepath = output_dir / txt_filename
-        with open(txt_filepath, 'w', encoding='utf-8') as f:
-            f.write(ocr_text)
-        print(f"OCRテキストファイルを生成しました: {txt_filepath}")
-        
-        # 4-2. 構造化データをJSONファイルに保存
-        json_filename = base_filename + "_structured_data.json"
-        output_writer.write_json(extracted_data, json_filename, str(output_dir))
-        print(f"構造化JSONファイルを生成しました: {output_dir / json_filename}")
-        
-        return True
-        
-    except FileNotFoundError as e:
-        print(f"エラー: {e}")
-        return False
-    except Exception as e:
-        print(f"予期せぬエラーが発生しました: {e}")
-        return False
-
-
-def main(images_dir: Path, output_dir: Path, exts: set = None, use_preprocessing: bool = True):
+def main(
+    images_dir: Path,
+    output_dir: Path,
+    exts: set = None,
+    use_preprocessing: bool = True,
+    pipeline_config: Optional[PipelineConfig] = None,
+    incremental: bool = True,
+    pages: PageSpec = None,
+):
     """
     複数画像のOCR処理を実行
     
+    読み込み・前処理・OCR・出力をステージ並列のパイプラインで実行します（lib/pipeline.py）。
+    処理状況は出力ディレクトリのマニフェスト（util/manifest.py）に記録されます。
+    PDF・複数ページTIFFはPNGに展開せず、ページ単位で直接処理します（出力は "文書名#003_ocr_text.txt"）。
+    
     Args:
         images_dir: 画像ファイルが格納されているディレクトリ
         output_dir: OCR結果を保存するディレクトリ
-        exts: 対象とする画像の拡張子セット（デフォルト: {".png", ".jpg", ".jpeg", ".tif", ".tiff"}）
+        exts: 対象とする画像の拡張子セット（デフォルト: {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}）
         use_preprocessing: 前処理（射影変換）を使用するかどうか
+        pipeline_config: パイプライン設定（ワーカー数・キュー長・タイムアウト）。Noneの場合はデフォルト
+        incremental: Trueの場合、前回から内容・設定が変わらず出力が揃っている画像をスキップする
+        pages: 複数ページ文書で処理するページ（None=全ページ, "1-3,5" など）
     """
     if exts is None:
-        exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+        exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
     
     if not images_dir.exists():
         raise FileNotFoundError(f"images_dir not found: {images_dir}")
@@ -117,21 +63,198 @@ def main(images_dir: Path, output_dir: Path, exts: set = None, use_preprocessing
         print(f"No images found in: {images_dir}")
         return
 
-    ok = 0
-    ng = 0
+    config = replace(pipeline_config or PipelineConfig(), use_preprocessing=use_preprocessing)
+    print_pipeline_config(config)
 
-    for img_path in image_paths:
-        print(f"\n処理中: {img_path.name}")
-        success = process_single_image(img_path, output_dir, use_preprocessing)
-        
+    results, skipped = run_with_manifest(image_paths, output_dir, config, incremental, pages=pages)
+    ok = sum(1 for r in results if r.success)
+    ng = len(results) - ok
+
+    print(f"\n処理完了. 成功={ok}, 失敗={ng}, スキップ={skipped}, 合計={ok + ng + skipped}ページ ({len(image_paths)}ファイル)")
+
+
+def watch(
+    inbox_dir: Path,
+    output_dir: Path,
+    done_dir: Path,
+    exts: set = None,
+    use_preprocessing: bool = True,
+    pipeline_config: Optional[PipelineConfig] = None,
+    stable_seconds: float = 2.0,
+    poll_interval: float = 1.0,
+):
+    """
+    受信フォルダを監視し、到着した画像を常駐パイプラインで処理し続ける（Ctrl+Cで終了）
+    
+    ワーカープロセスは起動したまま待機するため、到着ごとの起動コストはかかりません。
+    処理に成功した画像は完了フォルダへ移動し、失敗した画像は受信フォルダに残します。
+    
+    Args:
+        inbox_dir: 監視する受信フォルダ（サブフォルダも対象）
+        output_dir: OCR結果を保存するディレクトリ
+        done_dir: 処理済み画像の移動先
+        exts: 対象とする画像の拡張子セット
+        use_preprocessing: 前処理（射影変換）を使用するかどうか
+        pipeline_config: パイプライン設定。Noneの場合はデフォルト
+        stable_seconds: サイズ・更新時刻がこの秒数変化しなければ書き込み完了とみなす
+        poll_interval: 監視間隔（秒）
+    """
+    if exts is None:
+        exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
+
+    config = replace(pipeline_config or PipelineConfig(), use_preprocessing=use_preprocessing)
+    print_pipeline_config(config)
+
+    watcher = FolderWatcher(
+        inbox_dir, exts, stable_seconds=stable_seconds, poll_interval=poll_interval, exclude_dirs=[done_dir]
+    )
+
+    def relative_key(path: Path) -> str:
+        return path.resolve().relative_to(inbox_dir.resolve()).as_posix()
+
+    def finished(path: Path, success: bool) -> None:
         if success:
-            print(f"[OK] {img_path.name} -> 処理完了")
-            ok += 1
+            move_to_done(path, inbox_dir, done_dir)
+
+    print(f"受信フォルダを監視しています: {inbox_dir} (Ctrl+Cで終了)")
+    try:
+        run_with_manifest(watcher.watch(), output_dir, config, incremental=True,
+                          key_fn=relative_key, on_finished=finished, collect_results=False)
+    except KeyboardInterrupt:
+        print("\n監視を終了しました。")
+
+
+def print_pipeline_config(config: PipelineConfig) -> None:
+    print(
+        f"パイプライン設定: 読み込み={config.load_workers}, 前処理={config.preprocess_workers}, "
+        f"OCR={config.ocr_workers}, 書き込み={config.write_workers}, タイムアウト={config.page_timeout}秒"
+    )
+
+
+def run_with_manifest(
+    image_paths: Iterable[Path],
+    output_dir: Path,
+    config: PipelineConfig,
+    incremental: bool = True,
+    key_fn: Callable[[Path], str] = lambda p: p.name,
+    on_finished: Optional[Callable[[Path, bool], None]] = None,
+    pages: PageSpec = None,
+    collect_results: bool = True,
+) -> Tuple[List[PageResult], int]:
+    """
+    マニフェストで処理済みの画像を除外しながらパイプラインを実行
+    
+    PDF・複数ページTIFFはページ単位に分けて投入し、マニフェストには "文書名#ページ" のキーで記録する。
+    
+    Args:
+        image_paths: 処理対象の画像パス（ジェネレータ可、遅延評価される）
+        output_dir: OCR結果を保存するディレクトリ
+        config: パイプライン設定
+        incremental: Trueの場合、処理済みの画像をスキップする
+        key_fn: 画像パスからマニフェストのキーを作る関数
+        on_finished: 画像ごとの処理終了時（スキップを含む）に (パス, 成功したか) で呼ばれるコールバック
+                     複数ページ文書は全ページの処理が終わった時点で1回だけ呼ばれる
+        pages: 複数ページ文書で処理するページ（None=全ページ）
+        collect_results: Falseの場合は結果リストを作らない（監視モード用。run_pipeline() を参照）
+        
+    Returns:
+        (処理したページの結果リスト, スキップしたページ数)
+    """
+    manifest = RunManifest(output_dir, engine="tesseract", settings={
+        "use_preprocessing": config.use_preprocessing,
+        "grayscale": config.grayscale,
+        "pdf_dpi": config.pdf_dpi,
+        "use_text_layer": config.use_text_layer,
+        "lang": "jpn",
+    })
+    image_loader = ImageLoader()
+    content_hashes: Dict[Path, str] = {}
+    # 文書ごとの未完了ページ数と、全ページ成功したかどうか
+    remaining: Dict[Path, int] = {}
+    all_success: Dict[Path, bool] = {}
+    skipped = 0
+
+    def pending_paths():
+        # 最新の出力がある画像（ページ）を除外しながら、パイプラインへ遅延供給する
+        nonlocal skipped
+        for img_path in image_paths:
+            doc_key = key_fn(img_path)
+            open_error = None
+            try:
+                if image_loader.is_multipage(img_path):
+                    page_numbers = parse_page_range(pages, image_loader.page_count(img_path))
+                else:
+                    page_numbers = [None]
+            except Exception as e:
+                page_numbers, open_error = [], e
+            try:
+                # 複数ページ文書の行は "文書名#ページ" のため、最初のページの行で記録済みのハッシュを探す
+                digest = manifest.content_hash(img_path, page_key(doc_key, page_numbers[0]) if page_numbers else doc_key)
+            except OSError as e:
+                # 監視中に移動・削除されたファイルなどは、記録せずに読み飛ばす（パイプラインは止めない）
+                print(f"[NG] {doc_key} -> ファイルを読めません: {e}")
+                if on_finished is not None:
+                    on_finished(img_path, False)
+                continue
+            if open_error is not None:
+                # 壊れた文書はページ数も取得できないため、文書単位で失敗として記録する
+                manifest.mark_failed(doc_key, digest, f"{type(open_error).__name__}: {open_error}", img_path)
+                print(f"[NG] {doc_key} -> 文書を開けません: {open_error}")
+                if on_finished is not None:
+                    on_finished(img_path, False)
+                continue
+
+            todo = []
+            for page in page_numbers:
+                key = page_key(doc_key, page)
+                if incremental and manifest.is_up_to_date(key, digest):
+                    if config.verbose:
+                        print(f"[SKIP] {key} -> 処理済み")
+                    skipped += 1
+                else:
+                    todo.append(page)
+
+            if not todo:
+                if on_finished is not None:
+                    on_finished(img_path, True)
+                continue
+            content_hashes[img_path] = digest
+            remaining[img_path] = len(todo)
+            all_success[img_path] = True
+            for page in todo:
+                manifest.mark_running(page_key(doc_key, page), digest, img_path)
+                yield PageRef(img_path, page)
+
+    def report(result: PageResult) -> None:
+        key = page_key(key_fn(result.path), result.page)
+        digest = content_hashes[result.path]
+        if result.success:
+            manifest.mark_done(key, digest, result.output_paths, result.path)
+            if config.verbose:
+                if result.source == "text_layer":
+                    transform = "テキストレイヤー使用、OCRなし"
+                else:
+                    transform = "射影変換あり" if result.transformed else "射影変換なし"
+                print(f"[OK] {key} -> 処理完了 ({transform}, {result.text_length} 文字)")
         else:
-            print(f"[NG] {img_path.name} -> 処理失敗")
-            ng += 1
+            manifest.mark_failed(key, digest, result.error, result.path)
+            print(f"[NG] {key} -> 処理失敗: {result.error}")
+            all_success[result.path] = False
 
-    print(f"\n処理完了. 成功={ok}, 失敗={ng}, 合計={len(image_paths)}")
+        remaining[result.path] -= 1
+        if remaining[result.path] == 0:
+            # 文書の全ページが終わった
+            del remaining[result.path], content_hashes[result.path]
+            success = all_success.pop(result.path)
+            if on_finished is not None:
+                on_finished(result.path, success)
+
+    try:
+        results = run_pipeline(pending_paths(), output_dir, config, on_result=report,
+                               collect_results=collect_results)
+    finally:
+        manifest.close()
+    return results, skipped
 
 
 if __name__ == "__main__":
@@ -142,15 +265,47 @@ if __name__ == "__main__":
     
     # 対象とする拡張子
     # このスクリプトは指定したディレクトリ以下にある指定拡張子のファイルをすべて処理します
-    exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+    exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
+    
+    # 複数ページ文書（PDF・複数ページTIFF）で処理するページ（None=全ページ, 例: "1-3,5"）
+    pages = None
     
     # ===== OCR処理設定 =====
     use_preprocessing = False  # 前処理（射影変換）を使用するかどうか（False=元画像を直接使用）
+    incremental = True         # 処理済みの画像をスキップするかどうか（False=全画像を再処理）
+    
+    # ===== パイプライン設定 =====
+    pipeline_config = PipelineConfig(
+        pdf_dpi=300,             # PDFをページ画像にレンダリングする解像度
+        use_text_layer=True,     # テキストレイヤーを持つPDFページ（電子的に作成されたPDF）はOCRせずにそのテキストを使う
+        grayscale=False,         # グレースケールでデコードする（カラー情報を使わない帳票向け、処理量が約1/3）
+        load_workers=2,          # 画像読み込みスレッド数
+        preprocess_workers=2,    # 前処理プロセス数
+        ocr_workers=os.cpu_count() or 1,  # OCRプロセス数（CPUコア数が目安）
+        write_workers=2,         # 出力書き込みスレッド数
+        queue_size=4,            # ステージ間キューの最大長
+        page_timeout=300,        # 1ページあたりのタイムアウト（秒）
+        use_shared_memory=True,  # プロセス間の画像受け渡しに共有メモリを使う
+        shm_slot_mb=32,          # 共有メモリ1スロットのサイズ（MB）。A4/300dpiのカラー画像で約26MB
+        metrics_dir=None,        # 計測結果の出力先（例: current_dir / "documents" / "metrics"）。None=計測しない
+        profile_slowest=0,       # 最も遅いNページの cProfile / tracemalloc を保存（metrics_dir 指定時のみ）
+        verbose=True,            # False=ページごとのメッセージを表示しない（失敗と集計のみ表示）
+    )
+    
+    # ===== 常駐（受信フォルダ監視）モード設定 =====
+    # python main.py watch で起動すると、inbox_dir に置かれた画像を到着順に処理し続けます
+    inbox_dir = current_dir / "documents" / "inbox"
+    done_dir = current_dir / "documents" / "done"
     # ===== 設定ここまで =====
     
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        inbox_dir.mkdir(parents=True, exist_ok=True)
+        watch(inbox_dir, output_dir, done_dir, exts, use_preprocessing, pipeline_config)
+        sys.exit(0)
+    
     print(f"画像ディレクトリ: {images_dir}")
     print(f"出力ディレクトリ: {output_dir}")
     print(f"前処理使用: {use_preprocessing}")
     print(f"画像ディレクトリ存在確認: {images_dir.exists()}")
     
-    main(images_dir, output_dir, exts, use_preprocessing)
\ No newline at end of file
+    main(images_dir, output_dir, exts, use_preprocessing, pipeline_config, incremental, pages)
\ No newline at end of file
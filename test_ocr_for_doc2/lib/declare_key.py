@@ -1,8 +1,17 @@
-from google.cloud import vision
+import sys
+from pathlib import Path
 
 # このキーパスを入力した場合，githubに上げてはいけません
+SERVICE_ACCOUNT_KEY_PATH = r"C:\path\to\your\service-account-key.json"
+
+
 def call_for_client():
-    client = vision.ImageAnnotatorClient.from_service_account_file(
-        "C:\path\to\your\service-account-key.json"
-    )
-    return client
\ No newline at end of file
+    # 認証情報・gRPCチャネル・クライアントはプロセス内で共有する（util/cloud_clients.py）
+    # 2回目以降の呼び出しはキーファイルを読み直さず、作成済みのクライアントを返す
+    # lib/sample.py から直接使う場合も util/ を読み込めるよう、リポジトリのルートをパスに追加
+    root = str(Path(__file__).resolve().parent.parent.parent)
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    from util.cloud_clients import get_vision_client
+
+    return get_vision_client(SERVICE_ACCOUNT_KEY_PATH)
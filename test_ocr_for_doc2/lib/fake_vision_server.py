@@ -0,0 +1,204 @@
+"""
+ローカルのフェイクVision API gRPCサーバー
+
+ネットワーク・認証情報・課金なしで、Vision APIの呼び出し部分（バッチ送信、並列数、画像ごとのエラー、
+出力の書き込み）のスループットを確認するためのサーバーです。
+本物と同じ gRPC サービス（google.cloud.vision.v1.ImageAnnotator/BatchAnnotateImages）を実装し、
+指定した遅延のあとに、送られた画像のサイズ・ハッシュ・言語ヒントを書いたテキストを画像ごとに返します。
+document_text_detection() も内部では1枚の BatchAnnotateImages なので、1枚ずつの送信もそのまま確認できます。
+
+本物と同じく、1リクエストの画像数が max_images を超える場合はリクエスト全体を INVALID_ARGUMENT にし、
+画像として読めないデータ・image_fail_rate で選ばれた画像は、その画像のレスポンスの error だけに
+エラーを入れます（同じバッチの他の画像は成功する）。
+words_per_image を指定すると、本物に近い構造（ページ・ブロック・段落・単語・文字と座標・信頼度）の
+full_text_annotation を返します（util/word_boxes.py の確認用）。
+
+使い方:
+    with FakeVisionServer(latency=0.5) as server:
+        client = get_vision_client(endpoint=server.address)   # util/cloud_clients.py
+        # 以降は通常のクライアントと同じように document_text_detection() / batch_annotate_images() を呼べる
+
+    # 単体で起動する場合（main.py の endpoint に表示されたアドレスを設定する）
+    python lib/fake_vision_server.py serve [遅延秒]
+
+    # 1枚ずつの逐次実行と、バッチ・並列実行のスループットを比較する
+    python lib/fake_vision_server.py [遅延秒] [画像数]
+"""
+from __future__ import annotations
+
+import hashlib
+import random
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from google.cloud import vision
+from google.rpc import code_pb2
+
+SERVICE_NAME = "google.cloud.vision.v1.ImageAnnotator"
+_MESSAGE_OPTIONS = [("grpc.max_send_message_length", -1), ("grpc.max_receive_message_length", -1)]
+
+# 画像として受け付けるデータの先頭（PNG, JPEG, TIFF, GIF, BMP, WebP）
+_IMAGE_SIGNATURES = (b"\x89PNG", b"\xff\xd8", b"II*\x00", b"MM\x00*", b"GIF8", b"BM", b"RIFF")
+
+
+class FakeVisionServer:
+    """
+    BatchAnnotateImages だけを実装したフェイクサーバー
+
+    Attributes:
+        address: 接続先（"localhost:ポート"）
+        request_count: 受け付けたリクエスト数
+        image_count: 受け付けた画像数
+        max_concurrency: 同時に処理していたリクエスト数の最大値
+        language_hints: 最後に受け付けた画像の言語ヒント
+    """
+
+    def __init__(self, latency: float = 0.5, per_image: float = 0.05, jitter: float = 0.0, port: int = 0,
+                 max_workers: int = 64, image_fail_rate: float = 0.0, max_images: int = 16,
+                 words_per_image: int = 0):
+        """
+        Args:
+            latency: 1リクエストあたりの応答遅延（秒）
+            per_image: 画像1枚あたりに加える遅延（秒）。バッチの応答は latency + per_image × 画像数 になる
+            jitter: 遅延のばらつき（秒）。± jitter の一様乱数を加える
+            port: 待ち受けポート（0の場合は空いているポートを使う）
+            max_workers: サーバー側で同時に処理するリクエスト数の上限
+            image_fail_rate: 画像ごとに UNAVAILABLE エラーを返す割合（0.0-1.0。同じバッチの他の画像は成功する）
+            max_images: 1リクエストで受け付ける画像数の上限（超えた場合はリクエスト全体を INVALID_ARGUMENT）
+            words_per_image: 0より大きい場合は、1画像この単語数の階層・座標・信頼度を持つ full_text_annotation を返す
+        """
+        self.latency = latency
+        self.per_image = per_image
+        self.jitter = jitter
+        self.image_fail_rate = image_fail_rate
+        self.max_images = max_images
+        self._rich_annotation = None
+        if words_per_image > 0:
+            from util.word_boxes import sample_annotation
+
+            self._rich_annotation = sample_annotation(words_per_image)
+        self.request_count = 0
+        self.image_count = 0
+        self.max_concurrency = 0
+        self.language_hints: list = []
+        self._active = 0
+        self._lock = threading.Lock()
+        # 本物と同じく、数MBの画像を複数まとめたリクエストを受け付ける（gRPCの既定の上限は4MB）
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), options=_MESSAGE_OPTIONS)
+        handler = grpc.method_handlers_generic_handler(SERVICE_NAME, {
+            "BatchAnnotateImages": grpc.unary_unary_rpc_method_handler(
+                self._batch_annotate_images,
+                request_deserializer=vision.BatchAnnotateImagesRequest.deserialize,
+                response_serializer=vision.BatchAnnotateImagesResponse.serialize,
+            ),
+        })
+        self._server.add_generic_rpc_handlers((handler,))
+        self.port = self._server.add_insecure_port(f"localhost:{port}")
+        self.address = f"localhost:{self.port}"
+
+    def _batch_annotate_images(self, request, context):
+        with self._lock:
+            self.request_count += 1
+            self.image_count += len(request.requests)
+            self._active += 1
+            self.max_concurrency = max(self.max_concurrency, self._active)
+        try:
+            if len(request.requests) > self.max_images:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                              f"fake server: {len(request.requests)} images exceed the limit of {self.max_images}")
+            delay = self.latency + self.per_image * len(request.requests) + random.uniform(-self.jitter, self.jitter)
+            # クライアントの期限を過ぎたら待たずに終了する（クライアント側は DEADLINE_EXCEEDED になる）
+            remaining = context.time_remaining()
+            delay = max(0.0, delay)
+            time.sleep(min(delay, remaining) if remaining is not None else delay)
+            if not context.is_active():
+                return vision.BatchAnnotateImagesResponse()
+            return vision.BatchAnnotateImagesResponse(responses=[self._annotate(r) for r in request.requests])
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _annotate(self, request) -> vision.AnnotateImageResponse:
+        content = request.image.content
+        hints = list(request.image_context.language_hints)
+        with self._lock:
+            self.language_hints = hints
+        if not content.startswith(_IMAGE_SIGNATURES):
+            return vision.AnnotateImageResponse(error={"code": code_pb2.INVALID_ARGUMENT, "message": "Bad image data."})
+        if self.image_fail_rate and random.random() < self.image_fail_rate:
+            return vision.AnnotateImageResponse(error={"code": code_pb2.UNAVAILABLE,
+                                                       "message": "fake server: image unavailable"})
+        if self._rich_annotation is not None:
+            return vision.AnnotateImageResponse(full_text_annotation=self._rich_annotation)
+        digest = hashlib.sha1(content).hexdigest()[:12]
+        text = (f"フェイクOCR\nsize: {len(content)}\nsha1: {digest}\n"
+                f"language_hints: {','.join(hints) or '-'}\n")
+        return vision.AnnotateImageResponse(full_text_annotation={"text": text})
+
+    def start(self) -> "FakeVisionServer":
+        self._server.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.stop(grace=None)
+
+    def __enter__(self) -> "FakeVisionServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    import sys
+    from pathlib import Path
+
+    # util/ を読み込めるようにする
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+    from util.cloud_clients import get_vision_client
+    from util.prefetch import Prefetcher
+
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+        server = FakeVisionServer(latency=latency, port=50052).start()
+        print(f"フェイクVision APIサーバーを起動しました: {server.address} (遅延 {latency} 秒, Ctrl+Cで終了)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+        sys.exit(0)
+
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    contents = [b"\x89PNG" + i.to_bytes(4, "big") + bytes(64 * 1024) for i in range(count)]
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    image_context = vision.ImageContext(language_hints=["ja"])
+
+    with FakeVisionServer(latency=latency, per_image=latency * 0.1, jitter=latency * 0.2) as server:
+        client = get_vision_client(endpoint=server.address)
+
+        start = time.perf_counter()
+        for content in contents:
+            client.document_text_detection(image=vision.Image(content=content), image_context=image_context)
+        sequential = time.perf_counter() - start
+        print(f"1枚ずつ逐次実行: {count} 枚 {sequential:.2f} 秒 ({count / sequential:.1f} 枚/秒)")
+
+        def send(batch: list):
+            requests = [vision.AnnotateImageRequest(image=vision.Image(content=c), features=[feature],
+                                                    image_context=image_context) for c in batch]
+            return client.batch_annotate_images(requests=requests).responses
+
+        for batch_size, max_in_flight in ((16, 1), (16, 4), (8, 8)):
+            batches = [contents[i:i + batch_size] for i in range(0, count, batch_size)]
+            server.max_concurrency = 0
+            requests_before = server.request_count
+            start = time.perf_counter()
+            with Prefetcher(batches, send, depth=max_in_flight, workers=max_in_flight) as dispatcher:
+                images = sum(len(dispatched.result()) for dispatched in dispatcher)
+            elapsed = time.perf_counter() - start
+            print(f"バッチ {batch_size:2} 枚 x 並列 {max_in_flight}: {images} 枚 {elapsed:.2f} 秒 "
+                  f"({images / elapsed:.1f} 枚/秒, {sequential / elapsed:.1f}x, "
+                  f"リクエスト {server.request_count - requests_before} 件, 最大同時処理数 {server.max_concurrency})")
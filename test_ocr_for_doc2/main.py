@@ -1,13 +1,29 @@
 from __future__ import annotations
 
 import re
+import sys
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional
 
+import grpc
+from google.api_core import exceptions as core_exceptions
 from google.cloud import vision
 
 from lib.declare_key import call_for_client
 
+# プロジェクトルート（共通モジュール util/）をパスに追加
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from util.cloud_clients import get_vision_client
+from util.manifest import RunManifest
+from util.page_source import PagePayload, load_payload, page_numbers
+from util.payload_optimizer import (
+    TARGET_FORMATS, PayloadProfile, ProfileStore, format_results, optimize_payload, resolve_profile, tune_profile,
+)
+from util.prefetch import Prefetcher
+from util.resilience import ResilientCaller, create_caller, status_name
+from util.watch_folder import FolderWatcher, move_to_done
+from util.word_boxes import SUFFIX as WORD_BOXES_SUFFIX, save_word_boxes
+
 
 def natural_key(path: Path):
     """
@@ -16,34 +32,289 @@ def natural_key(path: Path):
     return [int(s) if s.isdigit() else s.lower() for s in re.split(r"(\d+)", path.name)]
 
 
-def ocr_image_to_text(client: vision.ImageAnnotatorClient, image_path: Path) -> str:
+# google.rpc.Code の数値 -> grpc.StatusCode
+_STATUS_CODES = {code.value[0]: code for code in grpc.StatusCode}
+
+# batch_annotate_images の1リクエストに入れられる画像数の上限
+MAX_BATCH_IMAGES = 16
+# 1リクエストにまとめる画像データの合計の上限（Vision APIのリクエストサイズの上限に収める）
+MAX_BATCH_BYTES = 10 * 1024 * 1024
+
+
+def image_error(error) -> Exception:
     """
-    Google Vision OCR (DOCUMENT_TEXT_DETECTION) で画像から全文テキストを取得
+    画像ごとのエラー（AnnotateImageResponse.error）を例外にする
+    
+    ステータスを持つ例外にし、一時的なもの（UNAVAILABLEなど）は再試行できるようにする
+    """
+    code = _STATUS_CODES.get(error.code)
+    if code is None or code is grpc.StatusCode.OK:
+        return RuntimeError(f"Vision API error: {error.message}")
+    return core_exceptions.from_grpc_status(code, f"Vision API error: {error.message}")
+
+
+def ocr_image(
+    client: vision.ImageAnnotatorClient,
+    image_path: Path,
+    content: Optional[bytes] = None,
+    caller: Optional[ResilientCaller] = None,
+    key: Optional[str] = None,
+    image_context: Optional[vision.ImageContext] = None,
+) -> vision.TextAnnotation:
     """
-    content = image_path.read_bytes()
+    Google Vision OCR (DOCUMENT_TEXT_DETECTION) で画像をOCRし、full_text_annotation（全文テキストと
+    ページ・ブロック・段落・単語・文字の階層、座標・信頼度）を取得
+    
+    content が渡された場合（先読み済み）はファイルを読み込まずにそれを送信する
+    caller が渡された場合はレート制限・再試行を行う（util/resilience.py）
+    image_context が渡された場合は言語ヒントなどを一緒に送信する
+    """
+    if content is None:
+        content = image_path.read_bytes()
     image = vision.Image(content=content)
 
-    # 文書向け（帳票など）では DOCUMENT_TEXT_DETECTION が基本
-    response = client.document_text_detection(image=image)
+    def attempt(timeout: Optional[float]):
+        # 文書向け（帳票など）では DOCUMENT_TEXT_DETECTION が基本
+        response = client.document_text_detection(image=image, image_context=image_context, timeout=timeout)
+        if response.error.message:
+            raise image_error(response.error)
+        return response
 
-    if response.error.message:
-        raise RuntimeError(f"Vision API error: {response.error.message}")
+    if caller is not None:
+        response = caller.call(attempt, name=key or image_path.name)
+    else:
+        response = attempt(None)
+    return response.full_text_annotation
 
-    ann = response.full_text_annotation
+
+def ocr_image_to_text(
+    client: vision.ImageAnnotatorClient,
+    image_path: Path,
+    content: Optional[bytes] = None,
+    caller: Optional[ResilientCaller] = None,
+    key: Optional[str] = None,
+    image_context: Optional[vision.ImageContext] = None,
+) -> str:
+    """
+    Google Vision OCR (DOCUMENT_TEXT_DETECTION) で画像から全文テキストを取得（引数は ocr_image() と同じ）
+    """
+    ann = ocr_image(client, image_path, content, caller, key, image_context)
     return ann.text if ann and ann.text else ""
 
 
-def main(images_dir: Path, output_txt_dir: Path, exts: set = None):
+def annotate_batch(
+    client: vision.ImageAnnotatorClient,
+    contents: List[bytes],
+    caller: Optional[ResilientCaller] = None,
+    image_context: Optional[vision.ImageContext] = None,
+    name: str = "batch",
+) -> List[Any]:
+    """
+    batch_annotate_images で複数の画像（最大 MAX_BATCH_IMAGES 枚）を1リクエストでOCRする
+    
+    画像ごとのエラーはバッチ全体を失敗にせず、その画像の結果を例外にして返す。
+    リクエスト全体のエラー（スロットリング・通信エラーなど）は caller で再試行し、最後の試行でも失敗した場合は送出する。
+    
+    Args:
+        contents: 画像データ（送信する順）
+        caller: レート制限・再試行を行う ResilientCaller（ページ数のレート制限には画像数を使う）
+        image_context: 全画像に付ける ImageContext（言語ヒントなど）
+        name: ログ表示用の名前
+    
+    Returns:
+        contents と同じ順の、画像ごとの full_text_annotation（vision.TextAnnotation）またはエラー（Exception）
+    """
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    requests = [
+        vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature], image_context=image_context)
+        for content in contents
+    ]
+
+    def attempt(timeout: Optional[float]):
+        return client.batch_annotate_images(requests=requests, timeout=timeout)
+
+    if caller is not None:
+        response = caller.call(attempt, pages=len(contents), name=name)
+    else:
+        response = attempt(None)
+    if len(response.responses) != len(contents):
+        raise RuntimeError(f"Vision API returned {len(response.responses)} responses for {len(contents)} images")
+
+    results: List[Any] = []
+    for res in response.responses:
+        if res.error.message:
+            results.append(image_error(res.error))
+        else:
+            results.append(res.full_text_annotation)
+    return results
+
+
+# PDF・複数ページTIFFのページを送信データにする設定（util.page_source.load_payload の引数）
+DEFAULT_PAGE_OPTIONS: Dict[str, Any] = {
+    "fmt": "png",            # ページをエンコードする形式（"png" / "jpeg"）
+    "dpi": 300,              # PDFのレンダリング解像度
+    "color": "rgb",          # "rgb" / "gray"
+    "use_text_layer": True,  # テキストレイヤーを持つPDFページはAPIを呼ばずにそのテキストを使う
+    "archive_dir": None,     # 送信したページ画像の保存先（None=保存しない）
+}
+
+
+def page_key(name: str, page: Optional[int]) -> str:
+    """マニフェストのキー（複数ページ文書は "文書名#ページ"）"""
+    return name if page is None else f"{name}#{page}"
+
+
+def open_manifest(output_txt_dir: Path, page_options: Optional[Dict[str, Any]] = None,
+                  payload_profile: Optional[PayloadProfile] = None,
+                  language_hints: Optional[List[str]] = None,
+                  output_word_boxes: bool = False) -> RunManifest:
+    """出力ディレクトリのマニフェストを開く（エンジン・設定はこのスクリプト共通）"""
+    page_options = page_options or DEFAULT_PAGE_OPTIONS
+    settings = {
+        "feature": "DOCUMENT_TEXT_DETECTION",
+        # 出力に影響するページ設定（保存先は影響しないので含めない）
+        "pages": {k: v for k, v in page_options.items() if k != "archive_dir"},
+    }
+    if payload_profile is not None:
+        # 送信データの最適化はOCRの結果に影響するため、設定が変わったら再処理する
+        settings["payload"] = payload_profile.to_dict()
+    if language_hints:
+        # 言語ヒントもOCRの結果に影響する（1枚ずつ・バッチの送信方法は影響しないので含めない）
+        settings["language_hints"] = list(language_hints)
+    if output_word_boxes:
+        # 単語ボックスを保存するようにした場合は、保存していない画像を再処理する
+        settings["word_boxes"] = True
+    return RunManifest(output_txt_dir, engine="google-vision", settings=settings)
+
+
+def load_page(entry, page_options: Dict[str, Any], payload_profile: Optional[PayloadProfile] = None) -> PagePayload:
+    """
+    先読みスレッドで1ページの送信データを作る（payload_profile が指定された場合は送信前に軽くする）
+    
+    テキストレイヤーを使うPDFページはAPIに送信しないため、最適化しない
+    """
+    payload = load_payload(entry[0], entry[1], **page_options)
+    if payload_profile is None or payload.text is not None:
+        return payload
+    optimized = optimize_payload(payload.content, payload_profile, payload.mime_type)
+    payload.content = optimized.content
+    payload.mime_type = optimized.mime_type
+    return payload
+
+
+def process_image(
+    client: vision.ImageAnnotatorClient,
+    manifest: RunManifest,
+    img_path: Path,
+    output_txt_dir: Path,
+    key: str,
+    digest: str,
+    content: Optional[bytes] = None,
+    out_stem: Optional[str] = None,
+    text: Optional[str] = None,
+    caller: Optional[ResilientCaller] = None,
+    image_context: Optional[vision.ImageContext] = None,
+    ocr_result: Any = None,
+    output_word_boxes: bool = False,
+) -> bool:
+    """
+    1画像をOCRしてテキストファイルに保存し、結果をマニフェストに記録
+    
+    Args:
+        content: 先読み済みの画像データ（Noneの場合はファイルから読み込む）
+        out_stem: 出力ファイル名の基部（デフォルト: 画像のファイル名。PDFのページは "文書名#003"）
+        text: PDFのテキストレイヤー（指定された場合はAPIを呼ばずにこれを出力する）
+        caller: レート制限・再試行を行う ResilientCaller（Noneの場合は1回だけ呼び出す）
+        image_context: APIに送信する ImageContext（言語ヒントなど）
+        ocr_result: バッチで取得済みの結果（annotate_batch() の full_text_annotation またはエラー。指定された場合はAPIを呼ばない）
+        output_word_boxes: Trueの場合、単語の座標・信頼度・ブロック/行の番号も保存する（util/word_boxes.py。テキストレイヤーのページは除く）
+    
+    Returns:
+        成功した場合True
+    """
+    try:
+        manifest.mark_running(key, digest, img_path)
+        note = ", text layer" if text is not None else ""
+        if isinstance(ocr_result, Exception):
+            raise ocr_result
+        annotation = None
+        if text is None:
+            annotation = ocr_result if ocr_result is not None else ocr_image(
+                client, img_path, content, caller, key, image_context)
+            text = annotation.text or ""
+
+        stem = out_stem or img_path.stem
+        out_txt = output_txt_dir / f"{stem}.txt"
+        out_txt.write_text(text, encoding="utf-8")
+        outputs = [out_txt]
+        if output_word_boxes and annotation is not None:
+            # レイアウトを使う項目抽出で、APIを呼び直さずに単語の座標・信頼度を使えるようにする
+            outputs.append(save_word_boxes(annotation, output_txt_dir / f"{stem}{WORD_BOXES_SUFFIX}",
+                                           meta={"source": key, "engine": "google-vision"}))
+        manifest.mark_done(key, digest, outputs, img_path)
+
+        print(f"[OK] {key} -> {out_txt.name} ({len(text)} chars{note})")
+        return True
+    except Exception as e:
+        manifest.mark_failed(key, digest, str(e), img_path)
+        print(f"[NG] {key} -> {e}")
+        return False
+
+
+def main(
+    images_dir: Path,
+    output_txt_dir: Path,
+    exts: set = None,
+    incremental: bool = True,
+    prefetch_depth: int = 4,
+    prefetch_max_mb: int = 256,
+    pages: Optional[str] = None,
+    page_options: Optional[Dict[str, Any]] = None,
+    rate_limits: Optional[Dict[str, Any]] = None,
+    payload_profile: Optional[PayloadProfile] = None,
+    batch_size: int = 1,
+    max_in_flight: int = 4,
+    language_hints: Optional[List[str]] = None,
+    endpoint: Optional[str] = None,
+    output_word_boxes: bool = False,
+):
     """
     Google Vision APIを使用してOCR処理を実行
     
+    処理状況は出力ディレクトリのマニフェスト（util/manifest.py）に記録されます。
+    API呼び出し中に次の画像をバックグラウンドで先読みします（util/prefetch.py）。
+    PDF・複数ページTIFFは、PNGファイルに変換せずにページごとにメモリ上で画像化して送信します（util/page_source.py）。
+    送信はクォータに合わせて間隔を調整し、スロットリング・一時的な障害は再試行します（util/resilience.py）。
+    batch_size が2以上の場合は、画像をまとめて batch_annotate_images で送信し、
+    最大 max_in_flight 件のバッチを並列に処理します（process_batches()）。
+    
     Args:
         images_dir: 画像ファイルが格納されているディレクトリ
         output_txt_dir: OCR結果のテキストファイルを保存するディレクトリ
-        exts: 対象とする画像の拡張子セット（デフォルト: {".png", ".jpg", ".jpeg", ".tif", ".tiff"}）
+        exts: 対象とする画像の拡張子セット（デフォルト: {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}）
+        incremental: Trueの場合、前回から内容が変わらず出力が揃っている画像をスキップする（再課金を防ぐ）
+        prefetch_depth: 先読みする画像数
+        prefetch_max_mb: 先読みで保持するデータ量の上限（MB）
+        pages: 複数ページ文書で処理するページ（例: "1-3,5"。None=全ページ）
+        page_options: ページの送信データの設定（デフォルト: DEFAULT_PAGE_OPTIONS）
+        rate_limits: レート制限・再試行の設定（util.resilience.create_caller() の引数。None=再試行のみ）
+        payload_profile: 送信データの最適化の設定（util/payload_optimizer.py。None=元のファイルのまま送信する）
+        batch_size: 1リクエストにまとめる画像数（1=1枚ずつ逐次に送信する。最大 MAX_BATCH_IMAGES）
+        max_in_flight: 同時に送信するバッチ数の上限（batch_size が2以上の場合のみ）
+        language_hints: OCRの言語ヒント（例: ["ja"]。None=自動判定）
+        endpoint: ローカルのフェイクサーバーのアドレス（lib/fake_vision_server.py。Noneの場合は本物のVision APIに接続）
+        output_word_boxes: Trueの場合、テキストと一緒に単語ボックス（{stem}_words.bin。util/word_boxes.py）を保存する
     """
     if exts is None:
-        exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+        exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
+    page_options = page_options or DEFAULT_PAGE_OPTIONS
+    batch_size = max(1, min(batch_size, MAX_BATCH_IMAGES))
+    rate_limits = dict(rate_limits or {})
+    if batch_size > 1:
+        # 複数のバッチを並列に送信するため、スロットリングされたら同時送信数を減らす（AIMD）
+        rate_limits.setdefault("max_concurrency", max(1, max_in_flight))
+    caller = create_caller(**rate_limits)
+    image_context = vision.ImageContext(language_hints=language_hints) if language_hints else None
     
     if not images_dir.exists():
         raise FileNotFoundError(f"images_dir not found: {images_dir}")
@@ -59,26 +330,352 @@ def main(images_dir: Path, output_txt_dir: Path, exts: set = None):
         print(f"No images found in: {images_dir}")
         return
 
-    #client = vision.ImageAnnotatorClient()
-    client = call_for_client()  # Use the imported function to get the client, this way the key file path is centralized
+    manifest = open_manifest(output_txt_dir, page_options, payload_profile, language_hints, output_word_boxes)
+    if payload_profile is not None:
+        print(f"Payload profile: {payload_profile.describe()}")
+    if batch_size > 1:
+        print(f"Batch mode: {batch_size} images per request, up to {max_in_flight} requests in flight")
 
     ok = 0
     ng = 0
 
+    # 処理済みの画像（ページ）を除外（クライアントの初期化より先に行い、全件処理済みなら認証も省略する）
+    pending = []
+    skipped = 0
     for img_path in image_paths:
         try:
-            text = ocr_image_to_text(client, img_path)
+            page_list = page_numbers(img_path, pages)
+        except Exception as e:
+            # 壊れた文書はページ数も取得できないため、文書単位で失敗として記録する
+            digest = manifest.content_hash(img_path)
+            manifest.mark_failed(img_path.name, digest, f"{type(e).__name__}: {e}", img_path)
+            print(f"[NG] {img_path.name} -> cannot open document: {e}")
+            ng += 1
+            continue
+        # 複数ページ文書の行は "文書名#ページ" のため、最初のページの行で記録済みのハッシュを探す
+        digest = manifest.content_hash(img_path, page_key(img_path.name, page_list[0]) if page_list else None)
+        for page in page_list:
+            key = page_key(img_path.name, page)
+            if incremental and manifest.is_up_to_date(key, digest):
+                print(f"[SKIP] {key} -> up to date")
+                skipped += 1
+            else:
+                pending.append((img_path, page, key, digest))
+
+    if not pending:
+        manifest.close()
+        print(f"Done. OK={ok}, NG={ng}, SKIP={skipped}, total={ok + ng + skipped}")
+        return
+
+    if endpoint:
+        client = get_vision_client(endpoint=endpoint)
+    else:
+        #client = vision.ImageAnnotatorClient()
+        client = call_for_client()  # Use the imported function to get the client, this way the key file path is centralized
+
+    # ページの画像化・エンコードも先読みスレッドで行い、API呼び出しと重ねる
+    prefetch_max_bytes = prefetch_max_mb * 1024 * 1024
+    if batch_size > 1:
+        # バッチ送信では、先読みしたページと送信待ち・送信中のバッチで上限を半分ずつ使う
+        prefetch_max_bytes //= 2
+    prefetcher = Prefetcher(pending, lambda entry: load_page(entry, page_options, payload_profile),
+                            depth=prefetch_depth, max_bytes=prefetch_max_bytes)
+    with prefetcher:
+        if batch_size > 1:
+            batch_ok, batch_ng = process_batches(client, manifest, prefetcher, output_txt_dir, caller,
+                                                 batch_size, max_in_flight, image_context, output_word_boxes,
+                                                 max_bytes=prefetch_max_bytes)
+            ok += batch_ok
+            ng += batch_ng
+        else:
+            for prefetched in prefetcher:
+                img_path, page, key, digest = prefetched.item
+                if process_prefetched(client, manifest, prefetched, output_txt_dir, key, digest, caller, image_context,
+                                      output_word_boxes):
+                    ok += 1
+                else:
+                    ng += 1
+
+    manifest.close()
+    print(f"Done. OK={ok}, NG={ng}, SKIP={skipped}, total={ok + ng + skipped}")
+    print(f"Retries/throttling: {caller.stats.summary()}")
+
+
+def process_prefetched(client, manifest: RunManifest, prefetched, output_txt_dir: Path, key: str, digest: str,
+                       caller: Optional[ResilientCaller] = None,
+                       image_context: Optional[vision.ImageContext] = None,
+                       output_word_boxes: bool = False) -> bool:
+    """先読みしたページ（util.page_source.PagePayload）をOCRする。読み込みに失敗していた場合は失敗として記録する"""
+    img_path = prefetched.item[0]
+    if prefetched.error is not None:
+        manifest.mark_failed(key, digest, f"{type(prefetched.error).__name__}: {prefetched.error}", img_path)
+        print(f"[NG] {key} -> {prefetched.error}")
+        return False
+    payload = prefetched.value
+    return process_image(client, manifest, img_path, output_txt_dir, key, digest,
+                         payload.content, out_stem=payload.stem, text=payload.text, caller=caller,
+                         image_context=image_context, output_word_boxes=output_word_boxes)
+
+
+def needs_ocr(prefetched) -> bool:
+    """APIに送信するページか（読み込みに失敗したページ・テキストレイヤーを使うページは送信しない）"""
+    return prefetched.error is None and prefetched.value.text is None
+
+
+def iter_batches(prefetched_pages, batch_size: int = MAX_BATCH_IMAGES, max_bytes: int = MAX_BATCH_BYTES):
+    """
+    先読みしたページを、1リクエストで送信するバッチ（Prefetched のリスト）にまとめる
+    
+    入力の順序は変えない。送信しないページ（needs_ocr() がFalse）はそれだけで1つのバッチにし、
+    画像データの合計が max_bytes を超える場合はその前でバッチを区切る。
+    """
+    batch: list = []
+    size = 0
+    for prefetched in prefetched_pages:
+        if not needs_ocr(prefetched):
+            if batch:
+                yield batch
+                batch, size = [], 0
+            yield [prefetched]
+            continue
+        length = len(prefetched.value.content)
+        if batch and (len(batch) >= batch_size or size + length > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(prefetched)
+        size += length
+    if batch:
+        yield batch
 
-            out_txt = output_txt_dir / f"{img_path.stem}.txt"
-            out_txt.write_text(text, encoding="utf-8")
 
-            print(f"[OK] {img_path.name} -> {out_txt.name} ({len(text)} chars)")
-            ok += 1
+def process_batches(
+    client: vision.ImageAnnotatorClient,
+    manifest: RunManifest,
+    prefetched_pages,
+    output_txt_dir: Path,
+    caller: ResilientCaller,
+    batch_size: int = MAX_BATCH_IMAGES,
+    max_in_flight: int = 4,
+    image_context: Optional[vision.ImageContext] = None,
+    output_word_boxes: bool = False,
+    max_bytes: Optional[int] = None,
+) -> tuple:
+    """
+    先読みしたページを batch_annotate_images でまとめてOCRし、最大 max_in_flight 件のバッチを並列に送信する
+    
+    バッチの結果は画像ごとに分け、入力順に1ページずつテキストファイルとマニフェストに書き込みます。
+    バッチ内の1枚のエラーはその画像だけの失敗とし、一時的なエラー（UNAVAILABLEなど）の画像は1枚ずつ送り直します。
+    リクエスト全体が失敗した場合（再試行しても失敗した場合）は、そのバッチの全画像を失敗として記録します。
+    
+    Args:
+        prefetched_pages: util.prefetch.Prefetcher が返す先読み済みのページ（item は (画像のパス, ページ, キー, ハッシュ)）
+        caller: レート制限・再試行を行う ResilientCaller
+        batch_size: 1リクエストにまとめる画像数
+        max_in_flight: 同時に送信するバッチ数の上限
+        image_context: 全画像に付ける ImageContext（言語ヒントなど）
+        output_word_boxes: Trueの場合、単語ボックスも保存する（process_image()）
+        max_bytes: 送信待ち・送信中のバッチの画像データの合計の上限（None=無制限）。
+            先読み側の上限（Prefetcher の max_bytes）は取り出したページを数えないため、こちらで別に数える
+    
+    Returns:
+        (成功したページ数, 失敗したページ数)
+    """
+    def send(batch: list):
+        # 画像データの合計も返し、バッチを取り出すまで dispatcher の上限に数える
+        sendable = [prefetched for prefetched in batch if needs_ocr(prefetched)]
+        size = sum(len(prefetched.value.content) for prefetched in sendable)
+        if not sendable:
+            return [], size
+        name = sendable[0].item[2] if len(sendable) == 1 else f"{sendable[0].item[2]} (+{len(sendable) - 1})"
+        try:
+            return annotate_batch(client, [prefetched.value.content for prefetched in sendable], caller,
+                                  image_context, name), size
         except Exception as e:
-            print(f"[NG] {img_path.name} -> {e}")
-            ng += 1
+            # リクエスト全体の失敗も結果として返す（失敗したバッチのデータ量も上限に数えるため）
+            return e, size
+
+    ok = 0
+    ng = 0
+    dispatcher = Prefetcher(iter_batches(prefetched_pages, batch_size), send,
+                            depth=max(1, max_in_flight), workers=max(1, max_in_flight),
+                            max_bytes=max_bytes, size_fn=lambda value: value[1])
+    with dispatcher:
+        for dispatched in dispatcher:
+            outcome = dispatched.error if dispatched.error is not None else dispatched.value[0]
+            batch_error = outcome if isinstance(outcome, Exception) else None
+            results = iter([] if batch_error is not None else outcome)
+            for prefetched in dispatched.item:
+                img_path, page, key, digest = prefetched.item
+                if not needs_ocr(prefetched):
+                    done = process_prefetched(client, manifest, prefetched, output_txt_dir, key, digest, caller,
+                                              output_word_boxes=output_word_boxes)
+                else:
+                    result = batch_error if batch_error is not None else next(results)
+                    if (batch_error is None and isinstance(result, Exception)
+                            and status_name(result) in caller.policy.retryable):
+                        # バッチ内の1枚だけの一時的なエラーは、その画像だけを1枚ずつの呼び出しで再試行する
+                        result = None
+                    done = process_image(client, manifest, img_path, output_txt_dir, key, digest,
+                                         prefetched.value.content, out_stem=prefetched.value.stem, caller=caller,
+                                         image_context=image_context, ocr_result=result,
+                                         output_word_boxes=output_word_boxes)
+                if done:
+                    ok += 1
+                else:
+                    ng += 1
+    return ok, ng
+
+
+def watch(
+    inbox_dir: Path,
+    output_txt_dir: Path,
+    done_dir: Path,
+    exts: set = None,
+    stable_seconds: float = 2.0,
+    poll_interval: float = 1.0,
+    prefetch_depth: int = 4,
+    prefetch_max_mb: int = 256,
+    pages: Optional[str] = None,
+    page_options: Optional[Dict[str, Any]] = None,
+    rate_limits: Optional[Dict[str, Any]] = None,
+    payload_profile: Optional[PayloadProfile] = None,
+    language_hints: Optional[List[str]] = None,
+    output_word_boxes: bool = False,
+):
+    """
+    受信フォルダを監視し、到着した画像をOCRし続ける（Ctrl+Cで終了）
+    
+    クライアントは起動時に1度だけ作成し、到着ごとの認証・接続コストを省きます。
+    処理に成功した画像は完了フォルダへ移動し、失敗した画像は受信フォルダに残します。
+    PDF・複数ページTIFFは全ページに成功した場合に移動します。
+    
+    Args:
+        inbox_dir: 監視する受信フォルダ（サブフォルダも対象）
+        output_txt_dir: OCR結果のテキストファイルを保存するディレクトリ
+        done_dir: 処理済み画像の移動先
+        exts: 対象とする画像の拡張子セット
+        stable_seconds: サイズ・更新時刻がこの秒数変化しなければ書き込み完了とみなす
+        poll_interval: 監視間隔（秒）
+        prefetch_depth: 先読みする画像数
+        prefetch_max_mb: 先読みで保持するデータ量の上限（MB）
+        pages: 複数ページ文書で処理するページ（例: "1-3,5"。None=全ページ）
+        page_options: ページの送信データの設定（デフォルト: DEFAULT_PAGE_OPTIONS）
+        rate_limits: レート制限・再試行の設定（util.resilience.create_caller() の引数。None=再試行のみ）
+        payload_profile: 送信データの最適化の設定（util/payload_optimizer.py。None=元のファイルのまま送信する）
+        language_hints: OCRの言語ヒント（例: ["ja"]。None=自動判定）
+        output_word_boxes: Trueの場合、テキストと一緒に単語ボックス（util/word_boxes.py）を保存する
+    """
+    if exts is None:
+        exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
+    page_options = page_options or DEFAULT_PAGE_OPTIONS
+    caller = create_caller(**(rate_limits or {}))
+    image_context = vision.ImageContext(language_hints=language_hints) if language_hints else None
+
+    output_txt_dir.mkdir(parents=True, exist_ok=True)
+    client = call_for_client()
+    manifest = open_manifest(output_txt_dir, page_options, payload_profile, language_hints, output_word_boxes)
+    watcher = FolderWatcher(
+        inbox_dir, exts, stable_seconds=stable_seconds, poll_interval=poll_interval, exclude_dirs=[done_dir]
+    )
+
+    def arrivals():
+        # 到着したファイルをページ単位に展開する（文書の最後のページには last=True を付ける）
+        for img_path in watcher.watch():
+            doc_key = img_path.resolve().relative_to(inbox_dir.resolve()).as_posix()
+            try:
+                page_list = page_numbers(img_path, pages)
+            except Exception:
+                page_list = [None]  # 開けない文書はファイルのまま送信し、APIのエラーとして記録する
+            # 1ページの画像は先読みした内容からハッシュを計算する（ファイルを2回読まない）
+            digest = manifest.content_hash(img_path, page_key(doc_key, page_list[0])) if page_list != [None] else None
+            for i, page in enumerate(page_list):
+                yield img_path, page, page_key(doc_key, page), digest, i == len(page_list) - 1
+
+    prefetcher = Prefetcher(arrivals(), lambda entry: load_page(entry, page_options, payload_profile),
+                            depth=prefetch_depth, max_bytes=prefetch_max_mb * 1024 * 1024)
 
-    print(f"Done. OK={ok}, NG={ng}, total={len(image_paths)}")
+    print(f"Watching inbox: {inbox_dir} (Ctrl+C to stop)")
+    try:
+        document_ok = True
+        for prefetched in prefetcher:
+            img_path, page, key, digest, last = prefetched.item
+            if digest is None:
+                # 最適化した送信データは元のファイルと内容が異なるため、その場合はファイルからハッシュを計算する
+                content = prefetched.value.content if prefetched.error is None and payload_profile is None else None
+                digest = manifest.content_hash(img_path, key, content)
+            if manifest.is_up_to_date(key, digest):
+                print(f"[SKIP] {key} -> up to date")
+            elif not process_prefetched(client, manifest, prefetched, output_txt_dir, key, digest, caller,
+                                        image_context, output_word_boxes):
+                document_ok = False
+            if last:
+                if document_ok:
+                    move_to_done(img_path, inbox_dir, done_dir)
+                document_ok = True
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        prefetcher.close()
+        manifest.close()
+        print(f"Retries/throttling: {caller.stats.summary()}")
+
+
+def tune(
+    images_dir: Path,
+    store_path: Path,
+    document_type: str,
+    n_samples: int = 3,
+    min_accuracy: float = 0.99,
+    exts: set = None,
+    page_options: Optional[Dict[str, Any]] = None,
+    rate_limits: Optional[Dict[str, Any]] = None,
+    language_hints: Optional[List[str]] = None,
+) -> Optional[PayloadProfile]:
+    """
+    文書の種類ごとの送信データの最適化の設定を選び、store_path に保存する（util.payload_optimizer.tune_profile）
+    
+    先頭の n_samples ファイル（複数ページ文書は最初のページ）を、元のファイルと候補の設定それぞれでOCRし、
+    送信量・応答時間・精度（元のファイルの結果との文字の一致率）を測ります。
+    候補の数 + 1 回ずつAPIを呼ぶため、その分の料金がかかります。
+    
+    Args:
+        images_dir: 代表的な画像のディレクトリ
+        store_path: 設定の保存先（JSON）
+        document_type: 文書の種類（保存のキー。main() では payload_profile="auto" のときにこのキーの設定を使う）
+        n_samples: OCRするサンプルの数
+        min_accuracy: 精度の下限（0-1）
+    
+    Returns:
+        選ばれた設定（どの候補も精度の下限を満たさない場合はNone=元のファイルのまま）
+    """
+    if exts is None:
+        exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
+    page_options = page_options or DEFAULT_PAGE_OPTIONS
+    caller = create_caller(**(rate_limits or {}))
+    client = call_for_client()
+    image_context = vision.ImageContext(language_hints=language_hints) if language_hints else None
+
+    samples = []
+    for img_path in sorted([p for p in images_dir.iterdir() if p.is_file() and p.suffix.lower() in exts], key=natural_key):
+        payload = load_payload(img_path, page_numbers(img_path)[0], **page_options)
+        if payload.text is None:
+            samples.append((payload.content, payload.mime_type))
+        if len(samples) >= n_samples:
+            break
+    if not samples:
+        print(f"No images found in: {images_dir}")
+        return None
+
+    def ocr(content: bytes, mime_type: str) -> str:
+        return ocr_image_to_text(client, images_dir, content, caller, key="tune", image_context=image_context)
+
+    print(f"Tuning payload profile for '{document_type}' with {len(samples)} samples (min accuracy {min_accuracy:.2%})")
+    profile, results = tune_profile(samples, ocr, min_accuracy=min_accuracy, formats=TARGET_FORMATS["vision"])
+    for line in format_results(results):
+        print(f"  {line}")
+    ProfileStore(store_path).put(document_type, profile, results)
+    print(f"Selected: {profile.describe() if profile else 'original files'} -> {store_path}")
+    return profile
 
 
 if __name__ == "__main__":
@@ -93,11 +690,99 @@ if __name__ == "__main__":
     
     # 対象とする拡張子
     # このスクリプトは指定したディレクトリ以下にある指定拡張子のファイルをすべて処理します
-    exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+    exts = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".pdf"}
+    
+    # PDF・複数ページTIFFの設定（PNGへの事前変換は不要。ページごとにメモリ上で画像化して送信する）
+    pages = None            # 処理するページ（例: "1-3,5"。None=全ページ）
+    page_options = dict(
+        fmt="png",              # 送信する画像形式（"png" / "jpeg"）
+        dpi=300,                # PDFのレンダリング解像度
+        color="rgb",            # "rgb" / "gray"（グレースケールは送信量が小さい）
+        use_text_layer=True,    # テキストレイヤーを持つPDFページはAPIを呼ばずにそのテキストを使う
+        archive_dir=None,       # 送信したページ画像の保存先（例: current_dir / "documents" / "images" / "pdf_pages"）
+    )
+    
+    # 処理済みの画像をスキップするかどうか（False=全画像を再処理）
+    incremental = True
+    
+    # 先読み設定（API呼び出し中に次の画像を読み込んでおく）
+    prefetch_depth = 4      # 先読みする画像数
+    prefetch_max_mb = 256   # 先読みで保持するデータ量の上限（MB）
+    
+    # クォータに合わせたレート制限と再試行（util/resilience.py）
+    rate_limits = dict(
+        requests_per_minute=1800,   # 1分あたりのリクエスト数（プロジェクトのクォータ。None=制限なし）
+        pages_per_minute=None,      # 1分あたりの画像数（バッチ送信では1リクエストに複数の画像が入る。None=制限なし）
+        max_attempts=5,             # 最大試行回数（1=再試行しない）
+    )
+    
+    # バッチ・並列送信（batch_annotate_images で複数の画像を1リクエストにまとめ、複数のバッチを並列に送信する）
+    batch_size = 16             # 1リクエストにまとめる画像数（最大16。1=1枚ずつ逐次に送信する）
+    max_in_flight = 4           # 同時に送信するバッチ数の上限（スロットリングされると自動的に減らす）
+    language_hints = ["ja"]     # OCRの言語ヒント（ImageContext.language_hints。None=自動判定）
+    
+    # 単語ボックスの保存（単語の座標・信頼度・ブロック/行の番号を {画像名}_words.bin に保存する。util/word_boxes.py）
+    # レイアウトを使う項目抽出（test_ocr_for_doc1/lib/data_parser.py の DataParser.parse_word_boxes）でAPIを呼び直さずに使える
+    output_word_boxes = True
+    
+    # ローカルのフェイクサーバーに接続する場合のアドレス（例: "localhost:50052"。None=本物のVision API）
+    # python main.py fake で、フェイクサーバーを起動してスループットを確認できる（課金・ネットワーク不要）
+    endpoint = None
+    fake_latency = 0.5          # フェイクサーバーの応答遅延（秒）
+    
+    # 送信データの最適化（util/payload_optimizer.py。グレースケール・2値化・解像度の上限・形式の選択）
+    # None=元のファイルのまま, "auto"=python main.py tune で選んだ設定, 辞書=指定した設定（例: dict(color="gray", max_dpi=200)）
+    payload_profile = None
+    profile_store_path = current_dir / "documents" / "payload_profiles.json"
+    document_type = images_dir.name     # 設定を保存・選択する文書の種類
+    tune_min_accuracy = 0.99            # tune で許容する精度の下限（元のファイルの結果との文字の一致率）
+    
+    # 常駐（受信フォルダ監視）モード: python main.py watch で起動
+    inbox_dir = current_dir / "documents" / "inbox"
+    done_dir = current_dir / "documents" / "done"
     # ===== 設定ここまで =====
     
+    # 最適化の設定を選ぶ: python main.py tune [サンプル数]
+    if len(sys.argv) > 1 and sys.argv[1] == "tune":
+        n_samples = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+        tune(images_dir, profile_store_path, document_type, n_samples, tune_min_accuracy, exts, page_options,
+             rate_limits, language_hints)
+        sys.exit(0)
+    
+    payload_profile = resolve_profile(payload_profile, profile_store_path, document_type, target="vision")
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        inbox_dir.mkdir(parents=True, exist_ok=True)
+        watch(inbox_dir, output_txt_dir, done_dir, exts,
+              prefetch_depth=prefetch_depth, prefetch_max_mb=prefetch_max_mb,
+              pages=pages, page_options=page_options, rate_limits=rate_limits, payload_profile=payload_profile,
+              language_hints=language_hints, output_word_boxes=output_word_boxes)
+        sys.exit(0)
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "fake":
+        # フェイクサーバーを起動し、出力先を分けて全画像を処理する
+        import time
+        from lib.fake_vision_server import FakeVisionServer
+        
+        # 単語ボックスを保存する場合は、本物に近い構造（1画像300単語）の結果を返させる
+        with FakeVisionServer(latency=fake_latency, per_image=fake_latency * 0.1, jitter=fake_latency * 0.3,
+                              words_per_image=300 if output_word_boxes else 0) as server:
+            print(f"フェイクVision APIサーバー: {server.address} (遅延 {fake_latency} 秒, "
+                  f"batch_size={batch_size}, max_in_flight={max_in_flight})")
+            start = time.perf_counter()
+            main(images_dir, output_txt_dir.parent / (output_txt_dir.name + "_fake"), exts, False,
+                 prefetch_depth, prefetch_max_mb, pages, page_options, rate_limits, payload_profile,
+                 batch_size=batch_size, max_in_flight=max_in_flight, language_hints=language_hints,
+                 endpoint=server.address, output_word_boxes=output_word_boxes)
+            elapsed = time.perf_counter() - start
+            print(f"所要時間: {elapsed:.2f} 秒 (リクエスト {server.request_count} 件, 画像 {server.image_count} 枚, "
+                  f"最大同時処理数 {server.max_concurrency})")
+        sys.exit(0)
+    
     print(f"画像ディレクトリ: {images_dir}")
     print(f"出力ディレクトリ: {output_txt_dir}")
     print(f"画像ディレクトリ存在確認: {images_dir.exists()}")
     
-    main(images_dir, output_txt_dir, exts)
+    main(images_dir, output_txt_dir, exts, incremental, prefetch_depth, prefetch_max_mb, pages, page_options,
+         rate_limits, payload_profile, batch_size=batch_size, max_in_flight=max_in_flight,
+         language_hints=language_hints, endpoint=endpoint, output_word_boxes=output_word_boxes)
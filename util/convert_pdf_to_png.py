@@ -1,35 +1,306 @@
-from pdf2image import convert_from_path
-from pathlib import Path
+"""
+PDF → 画像変換モジュール（ストリーミング・並列）
+
+PDFをページ単位の画像ファイル（page_001.png, ...）に変換します。
+
+- ページを数ページずつのチャンク（first_page/last_page）に分け、プロセスプールで並列にレンダリングする
+- 各ワーカーはチャンクをレンダリングしたらすぐにページごとに保存して解放するため、
+  ピークメモリは「ワーカー数 × チャンクのページ数」で決まり、総ページ数には依存しない
+- ページ範囲指定、グレースケール・2値（1bit）出力、圧縮形式（PNG圧縮レベル、TIFF Group 4）に対応
+- レンダリングエンジンは PyMuPDF（デフォルト、プロセス内で描画し外部コマンド・一時ファイル不要）と
+  poppler（pdf2image 経由で pdftoppm を実行）から選べる
+
+モジュールとして使う場合:
+    from util.convert_pdf_to_png import convert_pdf
+    convert_pdf(pdf_path, output_dir, dpi=300, pages="1-10", color="mono", fmt="tiff")
+
+コマンドラインから使う場合:
+    python util/convert_pdf_to_png.py 入力.pdf 出力ディレクトリ --dpi 300 --pages 1-10 --color mono --format tiff
+    （引数を省略すると下の設定ブロックのパスを使用）
+"""
+from __future__ import annotations
+
+import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+try:
+    from util.page_range import PageSpec, parse_page_range
+except ImportError:  # python util/convert_pdf_to_png.py として実行した場合（util/ が sys.path の先頭になる）
+    from page_range import PageSpec, parse_page_range
+
+
+def _default_poppler_bin() -> Optional[str]:
+    # 環境変数 POPPLER_BIN、なければ PATH 上の pdftoppm の場所（見つからない場合は None = PATH を使う）
+    env = os.environ.get("POPPLER_BIN")
+    if env:
+        return env
+    pdftoppm_path = shutil.which("pdftoppm")
+    return str(Path(pdftoppm_path).parent) if pdftoppm_path else None
+
+
+# popplerのbinディレクトリ
+# Mac/Linux版: PATH上の pdftoppm を自動検出
+# Windows版: 環境変数 POPPLER_BIN を設定するか、以下のように直接指定
+# POPPLER_BIN = r"C:\Users\-----\Downloads\Release-25.12.0-0\poppler-25.12.0\Library\bin"
+POPPLER_BIN = _default_poppler_bin()
+
+COLOR_MODES = ("rgb", "gray", "mono")
+BACKENDS = ("pymupdf", "poppler")
+FORMATS = {"png": ".png", "tiff": ".tif"}
+
+
+def make_chunks(pages: List[int], chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    ページ番号のリストを、連続したページの (first_page, last_page) のチャンクに分割
+    """
+    chunks: List[Tuple[int, int]] = []
+    for page in sorted(set(pages)):
+        if chunks and page == chunks[-1][1] + 1 and page - chunks[-1][0] < chunk_size:
+            chunks[-1] = (chunks[-1][0], page)
+        else:
+            chunks.append((page, page))
+    return chunks
+
+
+def _import_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        import fitz as pymupdf  # 古いPyMuPDF
+    return pymupdf
+
+
+def page_count(pdf_path: Path, poppler_path: Optional[str] = POPPLER_BIN, backend: str = "pymupdf") -> int:
+    """PDFのページ数（PyMuPDF または pdfinfo）"""
+    if backend == "pymupdf":
+        with _import_pymupdf().open(str(pdf_path)) as doc:
+            return doc.page_count
+    from pdf2image import pdfinfo_from_path
+
+    return int(pdfinfo_from_path(str(pdf_path), poppler_path=poppler_path)["Pages"])
+
+
+def save_page(img, out_path: Path, color: str = "rgb", fmt: str = "png",
+              png_compress_level: int = 6, tiff_compression: Optional[str] = "group4",
+              mono_threshold: int = 128, dpi: Optional[int] = None) -> Path:
+    """
+    PIL画像を指定の色・形式で保存
+
+    Args:
+        img: PIL画像
+        out_path: 出力パス
+        color: "rgb", "gray", "mono"（1bit）
+        fmt: "png" または "tiff"
+        png_compress_level: PNGの圧縮レベル（0-9）
+        tiff_compression: TIFFの圧縮方式（"group4" は mono のみ。それ以外では "tiff_lzw" に切り替える）
+        mono_threshold: 2値化の閾値（mono のみ）
+        dpi: 画像に記録する解像度
+    """
+    if color == "gray" and img.mode != "L":
+        img = img.convert("L")
+    elif color == "mono":
+        gray = img if img.mode == "L" else img.convert("L")
+        img = gray.point(lambda v: 255 if v >= mono_threshold else 0, mode="1")
+
+    params = {}
+    if dpi:
+        params["dpi"] = (dpi, dpi)
+    if fmt == "png":
+        img.save(out_path, "PNG", compress_level=png_compress_level, **params)
+    else:
+        compression = tiff_compression
+        if compression == "group4" and img.mode != "1":
+            compression = "tiff_lzw"  # Group 4 は1bit画像専用
+        if compression:
+            params["compression"] = compression
+        img.save(out_path, "TIFF", **params)
+    return out_path
+
+
+def _render_chunk(pdf_path: str, first_page: int, last_page: int, wanted: List[int], output_dir: str,
+                  name_format: str, dpi: int, color: str, fmt: str, png_compress_level: int,
+                  tiff_compression: Optional[str], mono_threshold: int,
+                  poppler_path: Optional[str]) -> List[Tuple[int, str]]:
+    """ワーカープロセス: 1チャンクをレンダリングし、ページごとにすぐ保存して解放する"""
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(
+        pdf_path,
+        dpi=dpi,
+        first_page=first_page,
+        last_page=last_page,
+        grayscale=color in ("gray", "mono"),  # pdftoppm 側でグレースケール描画（メモリ1/3）
+        poppler_path=poppler_path,
+    )
+    written = []
+    wanted_set = set(wanted)
+    for offset in range(len(images)):
+        img = images[offset]
+        images[offset] = None  # 保存したページから解放する
+        page = first_page + offset
+        if page not in wanted_set:
+            img.close()
+            continue
+        out_path = Path(output_dir) / (name_format.format(page=page) + FORMATS[fmt])
+        save_page(img, out_path, color, fmt, png_compress_level, tiff_compression, mono_threshold, dpi)
+        img.close()
+        written.append((page, str(out_path)))
+    return written
+
+
+def _render_pages_pymupdf(pdf_path: str, wanted: List[int], output_dir: str, name_format: str, dpi: int,
+                          color: str, fmt: str, png_compress_level: int, tiff_compression: Optional[str],
+                          mono_threshold: int) -> List[Tuple[int, str]]:
+    """ワーカープロセス: PyMuPDFで1ページずつレンダリングして保存する（メモリ上に置くのは常に1ページ）"""
+    from PIL import Image
+
+    pymupdf = _import_pymupdf()
+    gray = color in ("gray", "mono")
+    written = []
+    with pymupdf.open(pdf_path) as doc:
+        for page in wanted:
+            pix = doc.load_page(page - 1).get_pixmap(
+                dpi=dpi, colorspace=pymupdf.csGRAY if gray else pymupdf.csRGB, alpha=False
+            )
+            img = Image.frombytes("L" if gray else "RGB", (pix.width, pix.height), pix.samples)
+            out_path = Path(output_dir) / (name_format.format(page=page) + FORMATS[fmt])
+            save_page(img, out_path, color, fmt, png_compress_level, tiff_compression, mono_threshold, dpi)
+            img.close()
+            del pix
+            written.append((page, str(out_path)))
+    return written
+
+
+def convert_pdf(
+    pdf_path: Path,
+    output_dir: Path,
+    dpi: int = 300,
+    pages: PageSpec = None,
+    color: str = "rgb",
+    fmt: str = "png",
+    png_compress_level: int = 6,
+    tiff_compression: Optional[str] = "group4",
+    mono_threshold: int = 128,
+    workers: Optional[int] = None,
+    chunk_size: int = 4,
+    name_format: str = "page_{page:03}",
+    poppler_path: Optional[str] = POPPLER_BIN,
+    on_page: Optional[Callable[[int, Path], None]] = None,
+    backend: str = "pymupdf",
+) -> List[Path]:
+    """
+    PDFをページごとの画像ファイルに変換
+
+    Args:
+        pdf_path: 変換するPDFファイルのパス
+        output_dir: 出力ディレクトリ
+        dpi: レンダリング解像度
+        pages: 変換するページ（None=全ページ, "1-3,5", ページ番号の並び）
+        color: "rgb", "gray", "mono"（1bit）
+        fmt: "png" または "tiff"
+        png_compress_level: PNGの圧縮レベル（0=無圧縮・最速, 9=最小サイズ）
+        tiff_compression: TIFFの圧縮方式（"group4"=CCITT G4（mono用）, "tiff_lzw", "tiff_deflate", None）
+        mono_threshold: 2値化の閾値（mono のみ）
+        workers: レンダリングするプロセス数（デフォルト: CPUコア数、最大4）
+        chunk_size: 1回のレンダリングで扱うページ数（ワーカーごとのメモリ上限になる）
+        name_format: 出力ファイル名（拡張子なし）。{page} にページ番号が入る
+        poppler_path: popplerのbinディレクトリ（Noneの場合はPATHから探す）
+        on_page: ページを書き出すたびに (ページ番号, 出力パス) で呼ばれるコールバック
+        backend: レンダリングエンジン（"pymupdf"=プロセス内で描画, "poppler"=pdf2image/pdftoppm）
+
+    Returns:
+        書き出したファイルのパス（ページ順）
+    """
+    if color not in COLOR_MODES:
+        raise ValueError(f"color は {COLOR_MODES} のいずれかを指定してください: {color}")
+    if fmt not in FORMATS:
+        raise ValueError(f"fmt は {tuple(FORMATS)} のいずれかを指定してください: {fmt}")
+    if backend not in BACKENDS:
+        raise ValueError(f"backend は {BACKENDS} のいずれかを指定してください: {backend}")
+    pdf_path = Path(pdf_path)
+    if not pdf_path.exists():
+        raise FileNotFoundError(f"PDFファイルが見つかりません: {pdf_path}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    wanted = parse_page_range(pages, page_count(pdf_path, poppler_path, backend))
+    chunks = make_chunks(wanted, max(1, chunk_size))
+    workers = workers or min(4, os.cpu_count() or 1)
+
+    written: List[Tuple[int, Path]] = []
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(chunks) or 1))) as pool:
+        futures = []
+        for first, last in chunks:
+            chunk_pages = [p for p in wanted if first <= p <= last]
+            if backend == "pymupdf":
+                futures.append(pool.submit(
+                    _render_pages_pymupdf, str(pdf_path), chunk_pages, str(output_dir), name_format,
+                    dpi, color, fmt, png_compress_level, tiff_compression, mono_threshold,
+                ))
+            else:
+                futures.append(pool.submit(
+                    _render_chunk, str(pdf_path), first, last, chunk_pages, str(output_dir), name_format,
+                    dpi, color, fmt, png_compress_level, tiff_compression, mono_threshold, poppler_path,
+                ))
+        for future in as_completed(futures):
+            for page, out_path in future.result():
+                written.append((page, Path(out_path)))
+                if on_page is not None:
+                    on_page(page, Path(out_path))
+
+    return [path for _, path in sorted(written)]
+
+
+def _build_arg_parser(default_pdf: Optional[Path], default_output: Optional[Path]):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PDFをページごとの画像ファイルに変換します")
+    parser.add_argument("pdf_path", nargs="?", type=Path, default=default_pdf, help="変換するPDFファイル")
+    parser.add_argument("output_dir", nargs="?", type=Path, default=default_output, help="出力ディレクトリ")
+    parser.add_argument("--dpi", type=int, default=300, help="レンダリング解像度（デフォルト: 300）")
+    parser.add_argument("--pages", default=None, help='変換するページ（例: "1-3,5"。省略時は全ページ）')
+    parser.add_argument("--color", choices=COLOR_MODES, default="rgb", help="色（rgb / gray / mono=1bit）")
+    parser.add_argument("--format", dest="fmt", choices=tuple(FORMATS), default="png", help="出力形式")
+    parser.add_argument("--png-compress-level", type=int, default=6, help="PNG圧縮レベル（0-9）")
+    parser.add_argument("--tiff-compression", default="group4",
+                        help="TIFF圧縮方式（group4 / tiff_lzw / tiff_deflate / none）")
+    parser.add_argument("--workers", type=int, default=None, help="レンダリングするプロセス数")
+    parser.add_argument("--chunk-size", type=int, default=4, help="1回のレンダリングで扱うページ数")
+    parser.add_argument("--backend", choices=BACKENDS, default="pymupdf",
+                        help="レンダリングエンジン（pymupdf=プロセス内で描画 / poppler=pdftoppm）")
+    parser.add_argument("--poppler-path", default=POPPLER_BIN, help="popplerのbinディレクトリ（--backend poppler のみ）")
+    return parser
+
+
+if __name__ == "__main__":
+    # ===== 設定ここから（コマンドライン引数を省略した場合に使用）=====
+    ## 変換するPDFのファイルパス
+    pdf_path = Path(r"/Users/arcra/dev-arcra/ocr_project/test_ocr_for_doc2/documents/pdf/材料表３.pdf")
+    ## 変更先の画像フォルダ
+    output_dir = Path(r"/Users/arcra/dev-arcra/ocr_project/test_ocr_for_doc2/documents/images/test")
+    # ===== 設定ここまで =====
+
+    args = _build_arg_parser(pdf_path, output_dir).parse_args()
+
+    def report(page: int, out_path: Path) -> None:
+        print(f"Saved page {page}: {out_path.name}")
 
-# 画像変換
-## 変換するPDFのファイルパス
-pdf_path = Path(r"/Users/arcra/dev-arcra/ocr_project/test_ocr_for_doc2/documents/pdf/材料表３.pdf")
-## 変更先の画像フォルダ
-output_dir = Path(r"/Users/arcra/dev-arcra/ocr_project/test_ocr_for_doc2/documents/images/test")
-output_dir.mkdir(parents=True, exist_ok=True)
-# output_dir2 = Path(r"/Users/arcra/dev-arcra/ocr_project/test_ocr_for_doc2/documents/images/test")
-# output_dir2.mkdir(parents=True, exist_ok=True)
-
-
-# Mac版
-# pdftoppm_path = shutil.which("pdftoppm")
-# POPPLER_BIN = str(Path(pdftoppm_path).parent) if pdftoppm_path else None
-# Windows版
-POPPLER_BIN = r"C:\Users\-----\Downloads\Release-25.12.0-0\poppler-25.12.0\Library\bin" 
-
-images = convert_from_path(
-    pdf_path,
-    dpi=300,
-    fmt="png",
-    poppler_path=POPPLER_BIN
-)
-
-for i, img in enumerate(images, start=1):
-    print(f"Saving page {i}...")    
-    out_path = output_dir / f"page_{i:03}.png"
-    # out_path2 = output_dir2 / f"page_{i:03}.png"
-    img.save(out_path, "PNG")
-    # img.save(out_path2, "PNG")  
-
-print(f"{len(images)} pages converted.")
+    converted = convert_pdf(
+        args.pdf_path,
+        args.output_dir,
+        dpi=args.dpi,
+        pages=args.pages,
+        color=args.color,
+        fmt=args.fmt,
+        png_compress_level=args.png_compress_level,
+        tiff_compression=None if args.tiff_compression == "none" else args.tiff_compression,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        poppler_path=args.poppler_path,
+        on_page=report,
+        backend=args.backend,
+    )
+    print(f"{len(converted)} pages converted.")
@@ -0,0 +1,258 @@
+"""
+処理済みマニフェストモジュール
+
+出力ディレクトリごとにSQLiteファイル（.ocr_manifest.sqlite3）を置き、
+入力ファイルごとに以下を記録します。
+
+- 入力の内容ハッシュ（SHA-256）
+- エンジン名と設定のフィンガープリント
+- 出力ファイルのパス
+- 状態（running / done / failed）
+
+再実行時は「内容・エンジン・設定が同じで、出力ファイルが揃っている」入力をスキップし、
+失敗・中断・未処理の入力だけを処理します。各レコードの更新は1トランザクションで行うため、
+処理途中でクラッシュしても中途半端な状態が「完了」として残ることはありません。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+MANIFEST_FILENAME = ".ocr_manifest.sqlite3"
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    file_size INTEGER,
+    file_mtime_ns INTEGER,
+    engine TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    outputs TEXT NOT NULL DEFAULT '[]',
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """ファイル内容のSHA-256（16進文字列）"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def settings_fingerprint(settings: Dict[str, Any]) -> str:
+    """設定辞書のフィンガープリント（キー順に依存しない）"""
+    payload = json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class ManifestEntry:
+    """
+    マニフェストの1レコード
+
+    Attributes:
+        key: 入力の識別子（ファイル名、複数ページ文書は "文書名#ページ"）
+        content_hash: 入力内容のSHA-256
+        engine: OCRエンジン名
+        fingerprint: 設定のフィンガープリント
+        outputs: 出力ファイルのパス（出力ディレクトリからの相対パス）
+        status: 状態（running / done / failed）
+        error: 失敗時のエラーメッセージ
+        updated_at: 更新時刻（UNIX時間）
+    """
+    key: str
+    content_hash: str
+    engine: str
+    fingerprint: str
+    outputs: List[str] = field(default_factory=list)
+    status: str = STATUS_RUNNING
+    error: Optional[str] = None
+    updated_at: float = 0.0
+
+
+class RunManifest:
+    """
+    出力ディレクトリ単位の処理済みマニフェスト
+
+    1回の実行（エンジンと設定が固定）ごとに生成して使う。
+    複数スレッドから呼び出してよい。
+
+    使用例:
+        with RunManifest(output_dir, "tesseract", {"lang": "jpn"}) as manifest:
+            digest = manifest.content_hash(path)
+            if manifest.is_up_to_date(path.name, digest):
+                ...  # スキップ
+            manifest.mark_running(path.name, digest, path)
+            ...  # OCR処理と出力
+            manifest.mark_done(path.name, digest, [out_path])
+    """
+
+    def __init__(self, output_dir: Path, engine: str, settings: Dict[str, Any],
+                 filename: str = MANIFEST_FILENAME):
+        """
+        Args:
+            output_dir: 出力ディレクトリ（マニフェストはこの直下に作成される）
+            engine: OCRエンジン名
+            settings: 出力結果に影響する設定（変わると再処理される）
+            filename: マニフェストのファイル名
+        """
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.engine = engine
+        self.fingerprint = settings_fingerprint(settings)
+        self.path = self.output_dir / filename
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "RunManifest":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ----------------------------
+    # 参照
+    # ----------------------------
+    def get(self, key: str) -> Optional[ManifestEntry]:
+        """レコードを取得（存在しない場合はNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, content_hash, engine, fingerprint, outputs, status, error, updated_at "
+                "FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return ManifestEntry(
+            key=row[0], content_hash=row[1], engine=row[2], fingerprint=row[3],
+            outputs=json.loads(row[4]), status=row[5], error=row[6], updated_at=row[7],
+        )
+
+    def content_hash(self, path: Path, key: Optional[str] = None, content: Optional[bytes] = None) -> str:
+        """
+        入力ファイルの内容ハッシュを取得
+
+        前回記録時とサイズ・更新時刻が同じ場合は記録済みのハッシュを再利用し、
+        ファイル全体の読み込みを省略する。content（読み込み済みの内容）が渡された場合は
+        ファイルを読み直さずにそれをハッシュする。
+        """
+        path = Path(path)
+        stat = path.stat()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, file_size, file_mtime_ns FROM entries WHERE key = ?",
+                (key or path.name,),
+            ).fetchone()
+        if row is not None and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+            return row[0]
+        if content is not None:
+            return hashlib.sha256(content).hexdigest()
+        return file_sha256(path)
+
+    def is_up_to_date(self, key: str, content_hash: str) -> bool:
+        """内容・エンジン・設定が一致し、出力ファイルがすべて存在する完了済みレコードがあるか"""
+        entry = self.get(key)
+        if entry is None or entry.status != STATUS_DONE:
+            return False
+        if (entry.content_hash, entry.engine, entry.fingerprint) != (content_hash, self.engine, self.fingerprint):
+            return False
+        return all((self.output_dir / p).exists() for p in entry.outputs)
+
+    def summary(self) -> Dict[str, int]:
+        """状態ごとの件数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM entries GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    # ----------------------------
+    # 更新
+    # ----------------------------
+    def mark_running(self, key: str, content_hash: str, source_path: Optional[Path] = None) -> None:
+        """処理開始を記録（この状態のまま残ったレコードは次回再処理される）"""
+        self._upsert(key, content_hash, STATUS_RUNNING, [], None, source_path)
+
+    def mark_done(self, key: str, content_hash: str, outputs: Iterable[Path],
+                  source_path: Optional[Path] = None) -> None:
+        """処理完了と出力ファイルを記録（出力ファイルを書き終えてから呼ぶこと）"""
+        self._upsert(key, content_hash, STATUS_DONE, [self._relative(p) for p in outputs], None, source_path)
+
+    def mark_failed(self, key: str, content_hash: str, error: str,
+                    source_path: Optional[Path] = None) -> None:
+        """処理失敗を記録"""
+        self._upsert(key, content_hash, STATUS_FAILED, [], error, source_path)
+
+    def _relative(self, path: Path) -> str:
+        path = Path(path)
+        try:
+            return path.resolve().relative_to(self.output_dir.resolve()).as_posix()
+        except ValueError:
+            return str(path)
+
+    def _upsert(self, key: str, content_hash: str, status: str, outputs: List[str],
+                error: Optional[str], source_path: Optional[Path]) -> None:
+        size = mtime_ns = None
+        if source_path is not None:
+            stat = Path(source_path).stat()
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO entries "
+                "(key, content_hash, file_size, file_mtime_ns, engine, fingerprint, outputs, status, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "content_hash = excluded.content_hash, "
+                "file_size = COALESCE(excluded.file_size, entries.file_size), "
+                "file_mtime_ns = COALESCE(excluded.file_mtime_ns, entries.file_mtime_ns), "
+                "engine = excluded.engine, fingerprint = excluded.fingerprint, "
+                "outputs = excluded.outputs, status = excluded.status, "
+                "error = excluded.error, updated_at = excluded.updated_at",
+                (key, content_hash, size, mtime_ns, self.engine, self.fingerprint,
+                 json.dumps(outputs, ensure_ascii=False), status, error, time.time()),
+            )
+
+
+if __name__ == "__main__":
+    # マニフェストの内容を表示する
+    # 使い方: python util/manifest.py <出力ディレクトリ>
+    import sys
+
+    if len(sys.argv) < 2:
+        print("使い方: python util/manifest.py <出力ディレクトリ>")
+        sys.exit(1)
+
+    manifest_path = Path(sys.argv[1]) / MANIFEST_FILENAME
+    if not manifest_path.exists():
+        print(f"マニフェストが見つかりません: {manifest_path}")
+        sys.exit(1)
+
+    conn = sqlite3.connect(str(manifest_path))
+    for key, status, engine, outputs, error in conn.execute(
+        "SELECT key, status, engine, outputs, error FROM entries ORDER BY key"
+    ):
+        print(f"[{status}] {key} ({engine}) -> {', '.join(json.loads(outputs)) or '-'}"
+              + (f" エラー: {error}" if error else ""))
+    conn.close()
@@ -0,0 +1,44 @@
+"""
+ページ指定と複数ページ形式の定義（依存ライブラリなし）
+
+PDF・複数ページTIFFを扱うモジュール（util/pdf_rasterizer.py, util/page_source.py, 各 main.py）で共通に使います。
+PyMuPDF・OpenCV を読み込まないため、レンダリングしない処理（Document AI の offline モードなど）からも
+起動時間を増やさずに使えます。
+"""
+from __future__ import annotations
+
+from typing import Iterable, List, Union
+
+# ページ指定: None（全ページ）, "1-3,5" 形式の文字列, またはページ番号（1始まり）の並び
+PageSpec = Union[None, str, Iterable[int]]
+
+# 複数ページを持ちうる形式（TIFFは1ページのみの場合は通常の画像として扱う）
+MULTIPAGE_EXTS = {".pdf", ".tif", ".tiff"}
+
+
+def parse_page_range(spec: PageSpec, page_count: int) -> List[int]:
+    """
+    ページ指定を、存在するページ番号（1始まり）のリストに変換
+
+    Args:
+        spec: None（全ページ）, "1-3,5,8-" 形式の文字列, またはページ番号の並び
+        page_count: 文書のページ数
+
+    Returns:
+        ページ番号のリスト（指定順、範囲外は除外）
+    """
+    if spec is None:
+        return list(range(1, page_count + 1))
+    if isinstance(spec, str):
+        pages: List[int] = []
+        for part in spec.replace(" ", "").split(","):
+            if not part:
+                continue
+            if "-" in part:
+                start, end = part.split("-", 1)
+                pages.extend(range(int(start) if start else 1, (int(end) if end else page_count) + 1))
+            else:
+                pages.append(int(part))
+    else:
+        pages = [int(p) for p in spec]
+    return [p for p in pages if 1 <= p <= page_count]
@@ -0,0 +1,237 @@
+"""
+ページ単位のメモリ上の入力（ページペイロード）モジュール
+
+PDF・複数ページTIFFを中間のPNGファイルに書き出さずに、ページごとの送信データ（バイト列）を
+メモリ上で作成します。
+
+- PDFのページはプロセス内でレンダリングし（util/pdf_rasterizer.py）、送信先が必要とする形式に1回だけエンコードする
+- 通常の画像ファイル（1ページ）は、再エンコードせずにファイルのバイト列をそのまま使う
+- archive_dir を指定すると、送信したバイト列と同じものを保存する（再エンコードなし）
+- テキストレイヤーを持つPDFページは、そのテキストを一緒に返す（呼び出し側でAPI呼び出しを省略できる）
+
+これまでの「PDF → PNGファイル書き出し → 読み込み → 送信」に比べ、ページごとの
+エンコード・デコード・ディスク書き込みと読み込みが1回ずつ減ります。
+
+使用例:
+    for page in iter_page_payloads(paths, fmt="png", dpi=300):
+        response = client.document_text_detection(image=vision.Image(content=page.content))
+"""
+from __future__ import annotations
+
+import mimetypes
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+
+import cv2
+import numpy as np
+
+from util.page_range import PageSpec, parse_page_range
+from util.pdf_rasterizer import PdfRasterizer
+
+PAGE_FORMATS = {"png": (".png", "image/png"), "jpeg": (".jpg", "image/jpeg")}
+COLOR_MODES = ("rgb", "gray")
+
+
+@dataclass
+class PagePayload:
+    """
+    送信用の1ページ分のデータ
+
+    Attributes:
+        source: 元のファイルのパス
+        page: ページ番号（1始まり）。ファイル全体が1ページの画像の場合はNone
+        content: 送信するバイト列
+        mime_type: content のMIMEタイプ
+        text: PDFのテキストレイヤー（ない場合、または検出しない場合はNone）
+        archived: アーカイブしたファイルのパス（アーカイブしない場合はNone）
+    """
+    source: Path
+    page: Optional[int]
+    content: bytes
+    mime_type: str
+    text: Optional[str] = None
+    archived: Optional[Path] = None
+
+    @property
+    def key(self) -> str:
+        """表示・マニフェスト用の名前（複数ページ文書は "文書名#ページ"）"""
+        return self.source.name if self.page is None else f"{self.source.name}#{self.page}"
+
+    @property
+    def stem(self) -> str:
+        """出力ファイル名の基部（複数ページ文書は "文書名#003"）"""
+        return self.source.stem if self.page is None else f"{self.source.stem}#{self.page:03d}"
+
+    @property
+    def nbytes(self) -> int:
+        """content のバイト数（util.prefetch の先読み量の計算に使われる）"""
+        return len(self.content)
+
+
+def guess_mime_type(path: Path) -> str:
+    """ファイル名からMIMEタイプを推定"""
+    mime_type, _ = mimetypes.guess_type(str(path))
+    return mime_type or "application/octet-stream"
+
+
+def encode_image(image: np.ndarray, fmt: str = "png", jpeg_quality: int = 90,
+                 png_compress_level: int = 3) -> bytes:
+    """
+    画像（BGR または グレースケール）を送信形式にエンコード
+
+    Args:
+        image: 画像
+        fmt: "png" または "jpeg"
+        jpeg_quality: JPEGの品質（0-100）
+        png_compress_level: PNGの圧縮レベル（0-9）。送信用途では速度優先で低めにする
+
+    Returns:
+        エンコードしたバイト列
+    """
+    if fmt == "png":
+        ok, buf = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, png_compress_level])
+    elif fmt == "jpeg":
+        ok, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    else:
+        raise ValueError(f"fmt は {tuple(PAGE_FORMATS)} のいずれかを指定してください: {fmt}")
+    if not ok:
+        raise RuntimeError(f"画像のエンコードに失敗しました (fmt={fmt})")
+    return buf.tobytes()
+
+
+def page_numbers(path: Path, pages: PageSpec = None) -> List[Optional[int]]:
+    """
+    ファイルを処理単位に分けたときのページ番号のリスト（画素はデコードしない）
+
+    PDF・2ページ以上のTIFFは指定されたページ番号のリスト、それ以外は [None]（ファイル全体で1単位）
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".pdf":
+        with PdfRasterizer(path) as pdf:
+            return parse_page_range(pages, pdf.page_count)
+    if suffix in (".tif", ".tiff"):
+        from PIL import Image
+
+        with Image.open(path) as img:
+            n_frames = getattr(img, "n_frames", 1)
+        if n_frames > 1:
+            return parse_page_range(pages, n_frames)
+    return [None]
+
+
+def _tiff_page(path: Path, page: int, color: str) -> np.ndarray:
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.seek(page - 1)
+        if color == "gray":
+            return np.asarray(img.convert("L"))
+        return cv2.cvtColor(np.asarray(img.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+
+def load_payload(
+    path: Path,
+    page: Optional[int] = None,
+    fmt: str = "png",
+    dpi: int = 300,
+    color: str = "rgb",
+    jpeg_quality: int = 90,
+    archive_dir: Optional[Path] = None,
+    use_text_layer: bool = False,
+    min_text_chars: int = 20,
+) -> PagePayload:
+    """
+    1ページ分の送信データを作成
+
+    Args:
+        path: ファイルのパス
+        page: ページ番号（page_numbers() の要素）。Noneの場合はファイルのバイト列をそのまま使う
+        fmt: ページをエンコードする形式（"png" または "jpeg"）
+        dpi: PDFのレンダリング解像度
+        color: "rgb" または "gray"（グレースケールは送信量が小さくなる）
+        jpeg_quality: JPEGの品質
+        archive_dir: 送信データの保存先（Noneの場合は保存しない）
+        use_text_layer: Trueの場合、テキストレイヤーを持つPDFページはレンダリングせずにテキストだけを返す
+        min_text_chars: テキストレイヤーとみなす最小文字数
+
+    Returns:
+        PagePayload
+    """
+    path = Path(path)
+    if color not in COLOR_MODES:
+        raise ValueError(f"color は {COLOR_MODES} のいずれかを指定してください: {color}")
+
+    if page is None:
+        # 通常の画像はすでに送信可能な形式なので、デコード・再エンコードしない
+        payload = PagePayload(path, None, path.read_bytes(), guess_mime_type(path))
+    elif path.suffix.lower() == ".pdf":
+        with PdfRasterizer(path) as pdf:
+            text_layer = pdf.text_layer(page, min_text_chars) if use_text_layer else None
+            if text_layer is not None:
+                return PagePayload(path, page, b"", "text/plain", text=text_layer.text)
+            image = pdf.render(page, dpi=dpi, color=color)
+        payload = PagePayload(path, page, encode_image(image, fmt, jpeg_quality), PAGE_FORMATS[fmt][1])
+    else:
+        image = _tiff_page(path, page, color)
+        payload = PagePayload(path, page, encode_image(image, fmt, jpeg_quality), PAGE_FORMATS[fmt][1])
+
+    if archive_dir is not None:
+        archive_dir = Path(archive_dir)
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        suffix = path.suffix if page is None else PAGE_FORMATS[fmt][0]
+        payload.archived = archive_dir / (payload.stem + suffix)
+        payload.archived.write_bytes(payload.content)
+    return payload
+
+
+def iter_page_payloads(
+    paths: Iterable[Union[str, Path]],
+    pages: PageSpec = None,
+    **kwargs,
+) -> Iterator[PagePayload]:
+    """
+    ファイル群をページごとの送信データとして順に返す（1ページずつ作成し、全体は展開しない）
+
+    Args:
+        paths: ファイルのパス
+        pages: 複数ページ文書で処理するページ（None=全ページ）
+        **kwargs: load_payload() の引数（fmt, dpi, color, archive_dir, use_text_layer など）
+    """
+    for path in paths:
+        for page in page_numbers(Path(path), pages):
+            yield load_payload(Path(path), page, **kwargs)
+
+
+if __name__ == "__main__":
+    # PNGファイル経由（従来）とメモリ上（このモジュール）の所要時間を比較する
+    # 使い方（プロジェクトルートで実行）: python -m util.page_source <PDFファイル> [dpi]
+    import sys
+    import tempfile
+    import time
+
+    if len(sys.argv) < 2:
+        print("使い方: python -m util.page_source <PDFファイル> [dpi]")
+        sys.exit(1)
+
+    pdf_path = Path(sys.argv[1])
+    dpi = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    # 従来: PNGファイルに書き出し（convert_pdf_to_png のデフォルトの圧縮レベル6）→ 送信時に読み込む
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp, PdfRasterizer(pdf_path) as pdf:
+        for number in range(1, pdf.page_count + 1):
+            png_path = Path(tmp) / f"page_{number:03}.png"
+            cv2.imwrite(str(png_path), pdf.render(number, dpi=dpi), [cv2.IMWRITE_PNG_COMPRESSION, 6])
+            content = png_path.read_bytes()
+    via_files = time.perf_counter() - start
+
+    start = time.perf_counter()
+    total_bytes = 0
+    for payload in iter_page_payloads([pdf_path], dpi=dpi):
+        total_bytes += payload.nbytes
+    in_memory = time.perf_counter() - start
+
+    print(f"PNGファイル経由: {via_files:.2f} 秒")
+    print(f"メモリ上:        {in_memory:.2f} 秒 ({via_files / in_memory:.2f}x), 送信量 {total_bytes / 1024 / 1024:.1f} MB")
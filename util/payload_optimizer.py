@@ -0,0 +1,413 @@
+"""
+送信データ（アップロードする画像）の最適化モジュール
+
+Vision API・Document AI には、これまで元のファイル（300dpiのフルカラーPNG、1ページ約2MB）をそのまま送信していました。
+帳票のOCRには色も300dpiも必要ない場合が多いため、送信前に画像を軽くします。
+
+- 色: "keep"（そのまま）, "gray"（グレースケール）, "bilevel"（2値。大津の方法でしきい値を決める）
+- 大きさ: 長辺の上限（max_long_edge ピクセル）または解像度の上限（max_dpi。元の解像度は画像の情報、ない場合は300dpi）
+- エンコード: 送信先が受け付ける形式（TARGET_FORMATS）の候補をすべて作り、最も小さいものを選ぶ
+  PNG（圧縮レベルを指定。2値は1bit）、高品質JPEG（2値以外）、TIFF G4（2値のみ。Document AIのみ）
+- 文書の種類ごとに選んだ設定を JSON に保存する（ProfileStore）
+  tune_profile() は候補の設定ごとに送信量・応答時間・OCRの精度（元の画像の結果との文字の一致率）を測り、
+  精度の下限を満たす最も小さい設定を選ぶ
+
+同梱の 3510x2481 のPNG（平均 2.0 MB）では、グレースケールのJPEG（品質92）で約 650 KB、2値の1bit PNG で約 48 KB、
+2値のTIFF G4 で約 26 KB になります。
+
+使用例:
+    profile = PayloadProfile(color="gray", max_dpi=200, formats=TARGET_FORMATS["vision"])
+    optimized = optimize_payload(path.read_bytes(), profile)
+    client.document_text_detection(image=vision.Image(content=optimized.content))
+
+    # 文書の種類ごとに選んだ設定を保存・読み込む
+    store = ProfileStore(project_dir / "documents" / "payload_profiles.json")
+    best, results = tune_profile(samples, ocr, formats=TARGET_FORMATS["vision"])
+    store.put("test", best, results)
+    profile = store.get("test")
+
+    # 候補の設定ごとの送信量・エンコード時間を比較する（OCRの精度は各プロジェクトの main.py tune で測る）
+    python -m util.payload_optimizer <画像ディレクトリ> [vision|documentai]
+"""
+from __future__ import annotations
+
+import difflib
+import io
+import json
+import time
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+
+COLOR_MODES = ("keep", "gray", "bilevel")
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "tiff_g4": "image/tiff"}
+# 送信先が受け付ける形式（Vision の images:annotate はTIFFを受け付けない）
+TARGET_FORMATS = {
+    "vision": ("png", "jpeg"),
+    "documentai": ("png", "jpeg", "tiff_g4"),
+}
+# 画像に解像度の情報がない場合の解像度（同梱の画像は300dpiのA4）
+DEFAULT_DPI = 300
+
+
+@dataclass(frozen=True)
+class PayloadProfile:
+    """
+    送信データの最適化の設定
+
+    Attributes:
+        color: "keep", "gray", "bilevel"
+        max_long_edge: 長辺の上限（ピクセル。Noneの場合は制限しない）
+        max_dpi: 解像度の上限（Noneの場合は制限しない）
+        formats: エンコードの候補（MIME_TYPES のキー。最も小さいものを使う）
+        jpeg_quality: JPEGの品質（0-100）
+        png_compress_level: PNGの圧縮レベル（0-9）
+    """
+    color: str = "keep"
+    max_long_edge: Optional[int] = None
+    max_dpi: Optional[int] = None
+    formats: Tuple[str, ...] = ("png", "jpeg")
+    jpeg_quality: int = 92
+    png_compress_level: int = 6
+
+    def __post_init__(self):
+        if self.color not in COLOR_MODES:
+            raise ValueError(f"color は {COLOR_MODES} のいずれかを指定してください: {self.color}")
+        unknown = set(self.formats) - set(MIME_TYPES)
+        if unknown or not self.formats:
+            raise ValueError(f"formats は {tuple(MIME_TYPES)} から指定してください: {self.formats}")
+        object.__setattr__(self, "formats", tuple(self.formats))
+
+    @property
+    def is_noop(self) -> bool:
+        """元のファイルをそのまま送信する設定かどうか"""
+        return self.color == "keep" and self.max_long_edge is None and self.max_dpi is None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["formats"] = list(self.formats)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PayloadProfile":
+        return cls(**{**data, "formats": tuple(data.get("formats", cls.formats))})
+
+    def describe(self) -> str:
+        """表示・キャッシュのキー用の短い文字列"""
+        parts = [self.color]
+        if self.max_long_edge:
+            parts.append(f"edge{self.max_long_edge}")
+        if self.max_dpi:
+            parts.append(f"{self.max_dpi}dpi")
+        parts.append("/".join(self.formats))
+        if "jpeg" in self.formats and self.color != "bilevel":
+            parts.append(f"q{self.jpeg_quality}")
+        return ",".join(parts)
+
+
+# tune_profile() の既定の候補（送信量の大きい順）
+CANDIDATE_PROFILES = (
+    PayloadProfile("gray"),
+    PayloadProfile("gray", max_dpi=200),
+    PayloadProfile("bilevel"),
+    PayloadProfile("bilevel", max_dpi=200),
+)
+
+
+@dataclass
+class OptimizedPayload:
+    """
+    最適化した送信データ
+
+    Attributes:
+        content: 送信するバイト列
+        mime_type: content のMIMEタイプ
+        fmt: 選ばれた形式（"original" は元のファイルのまま）
+        original_bytes: 元のファイルのバイト数
+        width, height: 送信する画像の大きさ
+        seconds: 最適化にかかった時間（秒）
+    """
+    content: bytes
+    mime_type: str
+    fmt: str
+    original_bytes: int
+    width: int = 0
+    height: int = 0
+    seconds: float = 0.0
+
+    @property
+    def ratio(self) -> float:
+        """元のファイルに対するサイズの比"""
+        return len(self.content) / self.original_bytes if self.original_bytes else 1.0
+
+
+def _source_dpi(content: bytes) -> float:
+    """画像の解像度（ない場合は DEFAULT_DPI）。画素はデコードしない"""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            dpi = img.info.get("dpi")
+    except Exception:
+        dpi = None
+    return float(dpi[0]) if dpi and dpi[0] > 1 else float(DEFAULT_DPI)
+
+
+def _decode(content: bytes, gray: bool) -> np.ndarray:
+    flags = cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), flags)
+    if image is None:
+        raise ValueError("画像をデコードできません")
+    return image
+
+
+def _encode(image: np.ndarray, fmt: str, profile: PayloadProfile, bilevel: bool) -> bytes:
+    if fmt == "png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, profile.png_compress_level]
+        if bilevel:
+            params += [cv2.IMWRITE_PNG_BILEVEL, 1]
+        ok, buf = cv2.imencode(".png", image, params)
+    elif fmt == "jpeg":
+        ok, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, profile.jpeg_quality])
+    else:
+        from PIL import Image
+
+        out = io.BytesIO()
+        Image.fromarray(image).convert("1").save(out, "TIFF", compression="group4")
+        return out.getvalue()
+    if not ok:
+        raise RuntimeError(f"画像のエンコードに失敗しました (fmt={fmt})")
+    return buf.tobytes()
+
+
+def optimize_payload(content: bytes, profile: PayloadProfile, mime_type: Optional[str] = None) -> OptimizedPayload:
+    """
+    画像を設定に従って軽くする
+
+    Args:
+        content: 元の画像のバイト列（1ページの画像。PDF・複数ページTIFFは渡さない）
+        profile: 最適化の設定
+        mime_type: 元の画像のMIMEタイプ（元のファイルのまま送信する場合に返す）
+
+    Returns:
+        OptimizedPayload（profile.is_noop の場合、または再エンコードしても小さくならない場合は元のファイルのまま）
+    """
+    start = time.perf_counter()
+    original = OptimizedPayload(content, mime_type or "application/octet-stream", "original", len(content))
+    if profile.is_noop:
+        return original
+
+    image = _decode(content, gray=profile.color != "keep")
+    height, width = image.shape[:2]
+    scale = 1.0
+    if profile.max_long_edge:
+        scale = min(scale, profile.max_long_edge / max(height, width))
+    if profile.max_dpi:
+        scale = min(scale, profile.max_dpi / _source_dpi(content))
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    bilevel = profile.color == "bilevel"
+    if bilevel:
+        _, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # 2値にはJPEG（にじみが出る）、2値以外にはG4（2値専用）を使わない
+    formats = [fmt for fmt in profile.formats
+               if not (bilevel and fmt == "jpeg") and not (not bilevel and fmt == "tiff_g4")]
+    if not formats:
+        raise ValueError(f"color={profile.color} に使える形式がありません: {profile.formats}")
+    candidates = [(_encode(image, fmt, profile, bilevel), fmt) for fmt in formats]
+    data, fmt = min(candidates, key=lambda candidate: len(candidate[0]))
+    seconds = time.perf_counter() - start
+    if len(data) >= len(content) and profile.color == "keep" and scale == 1.0:
+        original.seconds = seconds
+        return original  # 何も変えずに再エンコードしただけで大きくなった
+    return OptimizedPayload(data, MIME_TYPES[fmt], fmt, len(content), image.shape[1], image.shape[0], seconds)
+
+
+def text_accuracy(reference: str, text: str) -> float:
+    """OCRの精度（基準のテキストとの文字の一致率 0-1。空白・改行は無視する）"""
+    reference = "".join(reference.split())
+    text = "".join(text.split())
+    if not reference and not text:
+        return 1.0
+    return difflib.SequenceMatcher(None, reference, text, autojunk=False).ratio()
+
+
+@dataclass
+class ProfileResult:
+    """
+    tune_profile() の候補ごとの計測結果
+
+    Attributes:
+        profile: 最適化の設定（Noneは元のファイルのまま）
+        bytes_sent: 送信量の合計（バイト）
+        latency: OCRの応答時間の平均（秒）
+        accuracy: 元のファイルの結果に対する精度の最小値（0-1）
+        encode_seconds: 最適化の時間の平均（秒）
+    """
+    profile: Optional[PayloadProfile]
+    bytes_sent: int
+    latency: float
+    accuracy: float
+    encode_seconds: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "profile": self.profile.to_dict() if self.profile else None,
+            "bytes_sent": self.bytes_sent,
+            "latency": round(self.latency, 4),
+            "accuracy": round(self.accuracy, 4),
+            "encode_seconds": round(self.encode_seconds, 4),
+        }
+
+
+def tune_profile(
+    samples: Sequence[Tuple[bytes, str]],
+    ocr: Callable[[bytes, str], str],
+    candidates: Sequence[PayloadProfile] = CANDIDATE_PROFILES,
+    min_accuracy: float = 0.99,
+    formats: Optional[Sequence[str]] = None,
+) -> Tuple[Optional[PayloadProfile], List[ProfileResult]]:
+    """
+    候補の設定ごとに送信量・応答時間・OCRの精度を測り、精度の下限を満たす最も送信量の小さい設定を選ぶ
+
+    精度は、元のファイルを送信した結果（基準）との文字の一致率の、サンプルの中での最小値です。
+
+    Args:
+        samples: (画像のバイト列, MIMEタイプ) のリスト（文書の種類の代表的なページ）
+        ocr: (バイト列, MIMEタイプ) -> 全文テキスト（実際にAPIを呼ぶ）
+        candidates: 候補の設定
+        min_accuracy: 精度の下限
+        formats: 送信先が受け付ける形式（指定した場合は候補の formats をこれにする）
+
+    Returns:
+        tuple: (選ばれた設定（どの候補も下限を満たさない場合はNone=元のファイルのまま）, 計測結果のリスト（先頭は基準）)
+    """
+    if formats is not None:
+        candidates = [replace(profile, formats=tuple(formats)) for profile in candidates]
+
+    def measure(payloads: List[Tuple[bytes, str]]) -> Tuple[List[str], float]:
+        texts = []
+        start = time.perf_counter()
+        for content, mime_type in payloads:
+            texts.append(ocr(content, mime_type))
+        return texts, (time.perf_counter() - start) / max(1, len(payloads))
+
+    references, latency = measure(list(samples))
+    results = [ProfileResult(None, sum(len(content) for content, _ in samples), latency, 1.0)]
+    for profile in candidates:
+        optimized = [optimize_payload(content, profile, mime_type) for content, mime_type in samples]
+        texts, latency = measure([(payload.content, payload.mime_type) for payload in optimized])
+        accuracy = min((text_accuracy(reference, text) for reference, text in zip(references, texts)), default=1.0)
+        results.append(ProfileResult(profile, sum(len(payload.content) for payload in optimized), latency, accuracy,
+                                     sum(payload.seconds for payload in optimized) / max(1, len(optimized))))
+
+    accepted = [result for result in results[1:] if result.accuracy >= min_accuracy]
+    best = min(accepted, key=lambda result: result.bytes_sent, default=None)
+    if best is None or best.bytes_sent >= results[0].bytes_sent:
+        return None, results
+    return best.profile, results
+
+
+class ProfileStore:
+    """
+    文書の種類ごとに選んだ最適化の設定（JSONファイル）
+
+    {"文書の種類": {"profile": {...}, "results": [...], "updated": "..."}} の形式で保存します。
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._data: Dict[str, Any] = {}
+        if self.path.exists():
+            self._data = json.loads(self.path.read_text(encoding="utf-8"))
+
+    def get(self, document_type: str) -> Optional[PayloadProfile]:
+        """保存された設定（ない場合、または元のファイルのままが選ばれた場合はNone）"""
+        entry = self._data.get(document_type)
+        if not entry or not entry.get("profile"):
+            return None
+        return PayloadProfile.from_dict(entry["profile"])
+
+    def put(self, document_type: str, profile: Optional[PayloadProfile],
+            results: Sequence[ProfileResult] = ()) -> None:
+        """設定と計測結果を保存"""
+        self._data[document_type] = {
+            "profile": profile.to_dict() if profile else None,
+            "results": [result.to_dict() for result in results],
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self._data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def document_types(self) -> List[str]:
+        return sorted(self._data)
+
+
+def resolve_profile(
+    setting: Union[None, str, Dict[str, Any], PayloadProfile],
+    store_path: Optional[Path] = None,
+    document_type: str = "",
+    target: str = "vision",
+) -> Optional[PayloadProfile]:
+    """
+    main.py の設定から最適化の設定を求める
+
+    Args:
+        setting: None（元のファイルのまま）、"auto"（store_path に保存された document_type の設定）、
+                 PayloadProfile の引数の辞書、または PayloadProfile
+        target: 送信先（"vision" / "documentai"）。辞書で formats を指定しない場合は TARGET_FORMATS[target] を使う
+    """
+    if setting is None:
+        return None
+    if setting == "auto":
+        return ProfileStore(store_path).get(document_type) if store_path else None
+    if isinstance(setting, dict):
+        setting = PayloadProfile.from_dict({"formats": TARGET_FORMATS[target], **setting})
+    if not isinstance(setting, PayloadProfile):
+        raise ValueError(f"payload_profile は None, \"auto\", 辞書のいずれかを指定してください: {setting}")
+    return None if setting.is_noop else setting
+
+
+def format_results(results: Sequence[ProfileResult]) -> List[str]:
+    """tune_profile() の結果の表（表示用）"""
+    base = results[0].bytes_sent if results else 0
+    lines = []
+    for result in results:
+        label = result.profile.describe() if result.profile else "元のファイル"
+        lines.append(f"{label:32} {result.bytes_sent / 1024:9.0f} KB ({result.bytes_sent / base * 100 if base else 0:5.1f}%), "
+                     f"応答 {result.latency * 1000:7.0f} ms, 精度 {result.accuracy * 100:6.2f}%, "
+                     f"最適化 {result.encode_seconds * 1000:5.0f} ms")
+    return lines
+
+
+if __name__ == "__main__":
+    # 候補の設定ごとの送信量・エンコード時間（OCRは呼ばない）
+    # 使い方（プロジェクトルートで実行）: python -m util.payload_optimizer <画像ディレクトリ> [vision|documentai]
+    import mimetypes
+    import sys
+
+    if len(sys.argv) < 2:
+        print("使い方: python -m util.payload_optimizer <画像ディレクトリ> [vision|documentai]")
+        sys.exit(1)
+
+    target = sys.argv[2] if len(sys.argv) > 2 else "vision"
+    paths = sorted(path for path in Path(sys.argv[1]).iterdir() if path.suffix.lower() in (".png", ".jpg", ".jpeg"))
+    if not paths:
+        print(f"画像が見つかりません: {sys.argv[1]}")
+        sys.exit(1)
+    samples = [(path.read_bytes(), mimetypes.guess_type(str(path))[0]) for path in paths]
+    original_bytes = sum(len(content) for content, _ in samples)
+    print(f"{len(paths)} ファイル, 元のファイル {original_bytes / 1024 / 1024:.1f} MB (送信先: {target})")
+    for profile in CANDIDATE_PROFILES:
+        profile = replace(profile, formats=TARGET_FORMATS[target])
+        optimized = [optimize_payload(content, profile, mime_type) for content, mime_type in samples]
+        total = sum(len(payload.content) for payload in optimized)
+        chosen = sorted({payload.fmt for payload in optimized})
+        print(f"{profile.describe():32} {total / 1024 / 1024:7.2f} MB ({total / original_bytes * 100:5.1f}%), "
+              f"{sum(payload.seconds for payload in optimized) / len(optimized) * 1000:5.0f} ms/ページ, "
+              f"形式 {'/'.join(chosen)}")
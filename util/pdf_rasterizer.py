@@ -0,0 +1,273 @@
+"""
+PyMuPDFによるPDFラスタライズモジュール
+
+popplerなどの外部コマンドや一時ファイルを使わず、プロセス内でPDFのページを
+NumPy配列（OpenCVと同じBGR / グレースケール）に直接レンダリングします。
+
+また、テキストレイヤーを持つページ（Word・CADなどから出力された電子PDFや、OCR済みPDF）を検出し、
+そのテキストと単語の座標をそのまま返します。これらのページはOCRを省略できます。
+
+使用例:
+    with PdfRasterizer(pdf_path) as pdf:
+        for page in pdf.iter_pages(pages="1-3", dpi=300):
+            if page.text_layer is not None:
+                text = page.text_layer.text      # OCR不要
+            else:
+                image = page.render()            # OCRへ
+"""
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+
+try:
+    import pymupdf
+except ImportError:
+    import fitz as pymupdf  # 古いPyMuPDF
+
+try:
+    from util.page_range import PageSpec, parse_page_range
+except ImportError:  # python util/pdf_rasterizer.py として実行した場合（util/ が sys.path の先頭になる）
+    from page_range import PageSpec, parse_page_range
+
+# テキストレイヤーとみなす最小文字数（空白を除く）
+DEFAULT_MIN_TEXT_CHARS = 20
+# ToUnicodeを持たないフォントなどで化けた文字（置換文字・私用領域）の許容割合
+DEFAULT_MAX_GARBLED_RATIO = 0.1
+
+# MuPDFはスレッドセーフではない（別々の文書でも同時に呼べない）ため、呼び出しをこのロックで直列化する
+# 描画後の色変換・エンコードはロックの外で行うので、複数スレッドから使っても並列性は残る
+_MUPDF_LOCK = threading.RLock()
+
+
+@dataclass(frozen=True)
+class WordBox:
+    """
+    テキストレイヤーの1単語
+
+    Attributes:
+        x0, y0, x1, y1: 単語の外接矩形（PDF座標、単位はポイント = 1/72インチ）
+        text: 単語の文字列
+        block: ブロック番号
+        line: ブロック内の行番号
+        word: 行内の単語番号
+    """
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    text: str
+    block: int
+    line: int
+    word: int
+
+    def to_pixels(self, dpi: int) -> tuple:
+        """指定解像度でレンダリングした画像上の座標 (x0, y0, x1, y1)"""
+        scale = dpi / 72.0
+        return (self.x0 * scale, self.y0 * scale, self.x1 * scale, self.y1 * scale)
+
+
+@dataclass
+class TextLayer:
+    """
+    ページのテキストレイヤー
+
+    Attributes:
+        text: 読み順に並べたページ全体のテキスト
+        words: 単語と座標
+        width: ページ幅（ポイント）
+        height: ページ高さ（ポイント）
+    """
+    text: str
+    words: List[WordBox] = field(default_factory=list)
+    width: float = 0.0
+    height: float = 0.0
+
+    def to_dict(self, dpi: Optional[int] = None) -> dict:
+        """JSON出力用の辞書（dpi を指定すると座標をピクセルに換算する）"""
+        scale = dpi / 72.0 if dpi else 1.0
+        return {
+            "source": "pdf_text_layer",
+            "unit": "pixel" if dpi else "point",
+            "dpi": dpi,
+            "width": round(self.width * scale, 2),
+            "height": round(self.height * scale, 2),
+            "words": [
+                {
+                    "text": w.text,
+                    "box": [round(w.x0 * scale, 2), round(w.y0 * scale, 2),
+                            round(w.x1 * scale, 2), round(w.y1 * scale, 2)],
+                    "block": w.block, "line": w.line, "word": w.word,
+                }
+                for w in self.words
+            ],
+        }
+
+
+def _is_garbled(ch: str) -> bool:
+    code = ord(ch)
+    return ch == "�" or 0xE000 <= code <= 0xF8FF
+
+
+def render_page(page, dpi: int = 300, color: str = "rgb") -> np.ndarray:
+    """
+    PyMuPDFのページをndarrayにレンダリング
+
+    Args:
+        page: pymupdf.Page
+        dpi: 解像度
+        color: "rgb"（BGR 3チャンネルで返す）または "gray"
+
+    Returns:
+        画像（BGR または グレースケール）
+    """
+    gray = color == "gray"
+    with _MUPDF_LOCK:
+        pix = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY if gray else pymupdf.csRGB, alpha=False)
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if gray:
+        return arr[:, :, 0].copy()
+    # RGB -> BGR（OpenCVの並び）。スライスのコピーでPixmapのバッファから切り離す
+    return np.ascontiguousarray(arr[:, :, ::-1])
+
+
+def extract_text_layer(page, min_chars: int = DEFAULT_MIN_TEXT_CHARS,
+                       max_garbled_ratio: float = DEFAULT_MAX_GARBLED_RATIO) -> Optional[TextLayer]:
+    """
+    ページのテキストレイヤーを取得（OCRに使えるテキストがない場合はNone）
+
+    Args:
+        page: pymupdf.Page
+        min_chars: テキストレイヤーとみなす最小文字数（空白を除く）
+        max_garbled_ratio: 化けた文字の割合がこれを超える場合は使わない
+    """
+    with _MUPDF_LOCK:
+        words = page.get_text("words", sort=True)
+    chars = [ch for w in words for ch in w[4] if not ch.isspace()]
+    if len(chars) < min_chars:
+        return None
+    if sum(1 for ch in chars if _is_garbled(ch)) / len(chars) > max_garbled_ratio:
+        return None
+    with _MUPDF_LOCK:
+        text = page.get_text("text", sort=True)
+    return TextLayer(
+        text=text,
+        words=[WordBox(w[0], w[1], w[2], w[3], w[4], int(w[5]), int(w[6]), int(w[7])) for w in words],
+        width=page.rect.width,
+        height=page.rect.height,
+    )
+
+
+@dataclass
+class PdfPage:
+    """
+    iter_pages が返す1ページ
+
+    Attributes:
+        number: ページ番号（1始まり）
+        text_layer: テキストレイヤー（ない場合、または検出しない場合はNone）
+    """
+    number: int
+    text_layer: Optional[TextLayer]
+    _page: object = None
+    _dpi: int = 300
+    _color: str = "rgb"
+
+    def render(self, dpi: Optional[int] = None, color: Optional[str] = None) -> np.ndarray:
+        """このページをndarrayにレンダリング（呼ばれるまで描画しない）"""
+        return render_page(self._page, dpi or self._dpi, color or self._color)
+
+
+class PdfRasterizer:
+    """
+    PDF文書を開き、ページのレンダリングとテキストレイヤーの取得を行う
+
+    PyMuPDFの文書オブジェクトはスレッド間で共有できないため、スレッド・プロセスごとに生成すること。
+    """
+
+    def __init__(self, pdf_path: Union[str, Path, None] = None, data: Optional[bytes] = None):
+        """
+        Args:
+            pdf_path: PDFファイルのパス
+            data: PDFのバイト列（pdf_path の代わりにメモリ上のPDFを開く場合）
+        """
+        if data is None and not Path(pdf_path).exists():
+            raise FileNotFoundError(f"PDFファイルが見つかりません: {pdf_path}")
+        with _MUPDF_LOCK:
+            if data is not None:
+                self._doc = pymupdf.open(stream=data, filetype="pdf")
+            else:
+                self._doc = pymupdf.open(str(pdf_path))
+
+    @property
+    def page_count(self) -> int:
+        return self._doc.page_count
+
+    def close(self) -> None:
+        with _MUPDF_LOCK:
+            self._doc.close()
+
+    def __enter__(self) -> "PdfRasterizer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _load_page(self, page: int):
+        with _MUPDF_LOCK:
+            return self._doc.load_page(page - 1)
+
+    def render(self, page: int, dpi: int = 300, color: str = "rgb") -> np.ndarray:
+        """指定ページ（1始まり）をndarrayにレンダリング"""
+        return render_page(self._load_page(page), dpi, color)
+
+    def text_layer(self, page: int, min_chars: int = DEFAULT_MIN_TEXT_CHARS) -> Optional[TextLayer]:
+        """指定ページ（1始まり）のテキストレイヤー（ない場合はNone）"""
+        return extract_text_layer(self._load_page(page), min_chars)
+
+    def iter_pages(self, pages: PageSpec = None, dpi: int = 300, color: str = "rgb",
+                   detect_text: bool = True,
+                   min_chars: int = DEFAULT_MIN_TEXT_CHARS) -> Iterator[PdfPage]:
+        """
+        ページを順に返す（レンダリングは PdfPage.render() が呼ばれたときだけ行う）
+
+        Args:
+            pages: ページ指定（None=全ページ, "1-3,5"）
+            dpi: レンダリング解像度
+            color: "rgb" または "gray"
+            detect_text: テキストレイヤーを検出するかどうか
+            min_chars: テキストレイヤーとみなす最小文字数
+        """
+        for number in parse_page_range(pages, self.page_count):
+            page = self._load_page(number)
+            text_layer = extract_text_layer(page, min_chars) if detect_text else None
+            yield PdfPage(number=number, text_layer=text_layer, _page=page, _dpi=dpi, _color=color)
+
+
+if __name__ == "__main__":
+    # PDFのページごとにテキストレイヤーの有無とレンダリング時間を表示する
+    # 使い方: python util/pdf_rasterizer.py <PDFファイル> [dpi]
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print("使い方: python util/pdf_rasterizer.py <PDFファイル> [dpi]")
+        sys.exit(1)
+
+    dpi = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    with PdfRasterizer(sys.argv[1]) as pdf:
+        text_pages = 0
+        for page in pdf.iter_pages(dpi=dpi):
+            if page.text_layer is not None:
+                text_pages += 1
+                print(f"page {page.number}: テキストレイヤーあり（{len(page.text_layer.words)} 単語）-> OCR不要")
+            else:
+                start = time.perf_counter()
+                image = page.render()
+                print(f"page {page.number}: 画像のみ -> {image.shape} "
+                      f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+        print(f"テキストレイヤーあり: {text_pages}/{pdf.page_count} ページ")
@@ -0,0 +1,275 @@
+"""
+先読み（プリフェッチ）モジュール
+
+現在のページをOCR・送信している間に、次のK件の読み込み（とデコード）を
+バックグラウンドのスレッドプールで行います。
+
+- 結果は入力順に返す（読み込みは並列に行う）
+- 先読み件数（depth）と、読み込み済みで未消費のデータ量（max_bytes）の両方で上限をかける
+- 読み込み関数は自由に指定できる: 生バイト列（クラウドへの送信用）でもデコード済み画像でもよい
+- ファイル読み込み・OpenCV/Pillowのデコードは GIL を解放するため、スレッドで十分に並列化できる
+- 入力はジェネレータでもよい（受信フォルダ監視のように次の要素を待つ場合も、
+  読み込み済みの要素は待たずに返される）
+
+使用例:
+    with Prefetcher(paths, read_bytes, depth=4, max_bytes=256 * 1024 * 1024) as prefetcher:
+        for item in prefetcher:
+            content = item.result()  # 読み込みに失敗した場合はここで例外になる
+            ...
+"""
+from __future__ import annotations
+
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Generic, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_SENTINEL = object()
+
+
+def read_bytes(path) -> bytes:
+    """ファイル全体をバイト列として読み込む（クラウド送信用の標準の読み込み関数）"""
+    return Path(path).read_bytes()
+
+
+def default_size(value: Any) -> int:
+    """読み込み結果のバイト数（bytes・ndarray・それらのタプルに対応）"""
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return int(nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(default_size(v) for v in value)
+    return 0
+
+
+@dataclass
+class Prefetched(Generic[T]):
+    """
+    先読みした1件
+
+    Attributes:
+        item: 入力の要素
+        value: 読み込み結果（失敗時はNone）
+        error: 読み込み時の例外（成功時はNone）
+    """
+    item: T
+    value: Any = None
+    error: Optional[BaseException] = None
+
+    def result(self) -> Any:
+        """読み込み結果を返す（失敗していた場合はその例外を送出）"""
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class Prefetcher(Generic[T]):
+    """
+    入力順を保ったまま、読み込みをバックグラウンドで先行させるイテレータ
+    """
+
+    def __init__(
+        self,
+        items: Iterable[T],
+        load_fn: Callable[[T], Any],
+        depth: int = 4,
+        workers: int = 2,
+        max_bytes: Optional[int] = None,
+        size_fn: Callable[[Any], int] = default_size,
+    ):
+        """
+        Args:
+            items: 入力の要素（パスなど）。ジェネレータ可
+            load_fn: 1件を読み込む関数（例: read_bytes, ImageLoader().load_image）
+            depth: 先読みする最大件数
+            workers: 読み込みスレッド数
+            max_bytes: 読み込み済みで未消費のデータ量の上限（バイト）。Noneの場合は無制限
+                       （上限を超えていても、先頭の1件は必ず読み込む）
+            size_fn: 読み込み結果のバイト数を返す関数
+        """
+        if depth <= 0:
+            raise ValueError("depth は1以上である必要があります")
+        self.items = items
+        self.load_fn = load_fn
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prefetch")
+        self._queue: "queue.Queue" = queue.Queue(maxsize=depth)
+        self._cond = threading.Condition()
+        self._buffered_bytes = 0
+        self._in_flight = 0   # 投入済みで未消費の件数
+        self._loading = 0     # 読み込み中の件数
+        self._loaded_count = 0
+        self._loaded_bytes = 0
+        self._stop = threading.Event()
+        self._feed_error: Optional[BaseException] = None
+        self._feeder: Optional[threading.Thread] = None
+
+    # ----------------------------
+    # 読み込み側（バックグラウンド）
+    # ----------------------------
+    def _load(self, item: T) -> Any:
+        try:
+            value = self.load_fn(item)
+        except BaseException:
+            with self._cond:
+                self._loading -= 1
+                self._cond.notify_all()
+            raise
+        size = self.size_fn(value)
+        with self._cond:
+            self._loading -= 1
+            self._buffered_bytes += size
+            self._loaded_count += 1
+            self._loaded_bytes += size
+            self._cond.notify_all()
+        return value
+
+    def _over_budget(self) -> bool:
+        if self.max_bytes is None or self._in_flight == 0:
+            return False  # 未消費が0件なら上限に関わらず進める
+        if self._loaded_count == 0:
+            return self._loading > 0  # サイズの見積もりができるまでは1件ずつ読む
+        # 読み込み中の分は、これまでの平均サイズで見積もって予約する
+        estimate = self._loaded_bytes / self._loaded_count
+        return self._buffered_bytes + (self._loading + 1) * estimate > self.max_bytes
+
+    def _wait_for_budget(self) -> bool:
+        # 未消費のデータ量（読み込み中の見積もりを含む）が上限に収まるまで待機
+        with self._cond:
+            while not self._stop.is_set() and self._over_budget():
+                self._cond.wait(0.5)
+            if self._stop.is_set():
+                return False
+            self._in_flight += 1
+            self._loading += 1
+            return True
+
+    def _feed(self) -> None:
+        try:
+            for item in self.items:
+                if not self._wait_for_budget():
+                    return
+                future = self._executor.submit(self._load, item)
+                if not self._put((item, future)):
+                    return
+        except BaseException as e:
+            self._feed_error = e
+        finally:
+            self._put(_SENTINEL)
+
+    def _put(self, entry) -> bool:
+        # 停止されるまでキューへの投入を試みる（停止後に消費側を待ち続けないため）
+        while not self._stop.is_set():
+            try:
+                self._queue.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # ----------------------------
+    # 消費側
+    # ----------------------------
+    def __iter__(self) -> Iterator[Prefetched[T]]:
+        if self._feeder is None:
+            self._feeder = threading.Thread(target=self._feed, name="prefetch-feeder", daemon=True)
+            self._feeder.start()
+        try:
+            while True:
+                entry = self._queue.get()
+                if entry is _SENTINEL:
+                    break
+                item, future = entry
+                yield self._take(item, future)
+        finally:
+            self.close()
+        if self._feed_error is not None:
+            raise self._feed_error
+
+    def _take(self, item: T, future: Future) -> Prefetched[T]:
+        try:
+            value = future.result()
+            error = None
+        except Exception as e:
+            value, error = None, e
+        # 消費した分を上限の計算から外す
+        with self._cond:
+            self._in_flight -= 1
+            if error is None:
+                self._buffered_bytes -= self.size_fn(value)
+            self._cond.notify_all()
+        return Prefetched(item=item, value=value, error=error)
+
+    @property
+    def buffered_bytes(self) -> int:
+        """読み込み済みで未消費のデータ量（バイト）"""
+        return self._buffered_bytes
+
+    def close(self) -> None:
+        """先読みを停止し、未消費のデータを破棄する"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        # 先読み済みのキューを空にして、待機中のフィーダーを解放する
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _SENTINEL:
+                entry[1].cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self) -> "Prefetcher[T]":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    # 先読みの効果を確認するベンチマーク
+    # 使い方: python util/prefetch.py <画像ディレクトリ> [遅延ミリ秒]
+    #   遅延ミリ秒: ネットワーク共有を模した1ファイルあたりの読み込み遅延（デフォルト: 50）
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print("使い方: python util/prefetch.py <画像ディレクトリ> [遅延ミリ秒]")
+        sys.exit(1)
+
+    images_dir = Path(sys.argv[1])
+    delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 50.0) / 1000
+    paths = sorted(p for p in images_dir.iterdir() if p.is_file())
+    work_seconds = 0.05  # 1ページあたりのOCR処理を模した待ち時間
+
+    def slow_read(path: Path) -> bytes:
+        time.sleep(delay)
+        return path.read_bytes()
+
+    start = time.perf_counter()
+    for p in paths:
+        slow_read(p)
+        time.sleep(work_seconds)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with Prefetcher(paths, slow_read, depth=4, workers=4, max_bytes=256 * 1024 * 1024) as prefetcher:
+        for entry in prefetcher:
+            entry.result()
+            time.sleep(work_seconds)
+    prefetched = time.perf_counter() - start
+
+    print(f"ファイル数: {len(paths)}, 読み込み遅延: {delay * 1000:.0f} ms, 処理時間: {work_seconds * 1000:.0f} ms/件")
+    print(f"逐次読み込み: {sequential:.2f} 秒")
+    print(f"先読みあり:   {prefetched:.2f} 秒 ({sequential / prefetched:.2f}x)")
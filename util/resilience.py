@@ -0,0 +1,424 @@
+"""
+クラウドOCR呼び出しの再試行・レート制限モジュール
+
+Vision API・Document AI の呼び出しを包み、クォータ超過や一時的な障害で
+ページが即座に失敗（[NG]）にならないようにします。
+
+- TokenBucket: プロジェクトのクォータ（リクエスト数/分、ページ数/分）に合わせて送信ペースを制限する
+- RetryPolicy: 再試行可能なエラー（RESOURCE_EXHAUSTED, UNAVAILABLE など）を、ジッター付きの指数バックオフで再試行する
+  （サーバーが RetryInfo / Retry-After で待ち時間を指定した場合はそれ以上待つ）
+- AimdController: スロットリングされたら同時実行数を半分にし（乗算的減少）、
+  応答時間が健全な間は少しずつ戻す（加算的増加）
+- ResilienceStats: 再試行回数、スロットリング回数、待機時間（レート制限・同時実行数・バックオフ）を集計する
+
+使用例:
+    caller = ResilientCaller(
+        requests=TokenBucket(120),                 # 120リクエスト/分
+        aimd=AimdController(initial=4, maximum=4),
+    )
+    response = caller.call(lambda timeout: client.process_document(request=request, timeout=timeout),
+                           deadline=120.0, name=path.name)
+    print(caller.stats.summary())
+"""
+from __future__ import annotations
+
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, Optional
+
+# 再試行するgRPCステータス
+RETRYABLE_CODES: FrozenSet[str] = frozenset({
+    "RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "ABORTED", "INTERNAL",
+})
+# スロットリング（サーバー側の過負荷・クォータ超過）とみなし、同時実行数を減らすステータス
+THROTTLE_CODES: FrozenSet[str] = frozenset({"RESOURCE_EXHAUSTED", "UNAVAILABLE"})
+
+# HTTP（REST）のステータスコード -> gRPCステータス
+_HTTP_TO_GRPC = {
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+    504: "DEADLINE_EXCEEDED",
+}
+
+
+def status_name(exc: BaseException) -> Optional[str]:
+    """
+    例外のgRPCステータス名（"UNAVAILABLE" など）を取得
+
+    google.api_core.exceptions.GoogleAPICallError, grpc.RpcError, HTTPのステータスコードを持つ例外に対応する。
+    ステータスが分からない場合はNone
+    """
+    code = getattr(exc, "grpc_status_code", None)
+    if code is not None:
+        return code.name
+    code_attr = getattr(exc, "code", None)
+    if callable(code_attr):
+        try:
+            return code_attr().name  # grpc.RpcError
+        except Exception:
+            return None
+    if isinstance(code_attr, int):
+        return _HTTP_TO_GRPC.get(code_attr)
+    return None
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """
+    サーバーが指定した再試行までの待ち時間（秒）
+
+    gRPCのエラー詳細（google.rpc.RetryInfo）、またはHTTPの Retry-After ヘッダから取得する。指定がない場合はNone
+    """
+    for detail in getattr(exc, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and hasattr(delay, "seconds"):
+            return delay.seconds + delay.nanos / 1e9
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("Retry-After")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return None  # HTTP日付形式は扱わない（バックオフに任せる）
+    return None
+
+
+class TokenBucket:
+    """
+    トークンバケットによるレート制限（スレッドセーフ）
+
+    トークンは先取り（予約）方式で、足りない分は呼び出し側がその分だけ待つ。
+    一度に容量を超える量（多ページのPDFなど）を要求しても、その分長く待つだけでデッドロックしない。
+    """
+
+    def __init__(self, rate_per_minute: float, burst: Optional[float] = None):
+        """
+        Args:
+            rate_per_minute: 1分あたりの上限（リクエスト数、ページ数など）
+            burst: 一度に使える最大量（デフォルト: 1秒分、最低1）
+        """
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute は正の値である必要があります")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """
+        amount 分のトークンを取得（足りない場合は待機）
+
+        Returns:
+            待機した秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = max(0.0, -self._tokens / self.rate)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class AimdController:
+    """
+    AIMD（加算的増加・乗算的減少）による同時実行数の制御
+
+    スロットリングされると同時実行数の上限を decrease_factor 倍に減らし（cooldown 秒に1回まで）、
+    応答時間が latency_target 以下の成功が続くと、上限1つ分の成功ごとに1ずつ増やす。
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: Optional[int] = None,
+                 latency_target: Optional[float] = None, decrease_factor: float = 0.5,
+                 cooldown: Optional[float] = None):
+        """
+        Args:
+            initial: 同時実行数の初期値
+            minimum: 同時実行数の下限
+            maximum: 同時実行数の上限（デフォルト: initial）
+            latency_target: 健全とみなす応答時間（秒）。Noneの場合は成功すれば健全とみなす
+            decrease_factor: スロットリング時に上限に掛ける係数
+            cooldown: 連続して減らさない間隔（秒）。同時に投げていたリクエストがまとめて失敗しても1回だけ減らす
+                      （Noneの場合は応答時間の移動平均 = 1往復に1回）
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum if maximum is not None else initial)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.active = 0
+        self._latency: Optional[float] = None
+        self._last_decrease = float("-inf")
+        self._cond = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        実行枠を1つ取得（上限に達している場合は空くまで待機）
+
+        Returns:
+            待機した秒数
+        """
+        start = time.monotonic()
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+        return time.monotonic() - start
+
+    def release(self, latency: float, throttled: bool = False) -> None:
+        """実行枠を返し、結果に応じて上限を調整"""
+        with self._cond:
+            self.active -= 1
+            now = time.monotonic()
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            cooldown = self.cooldown if self.cooldown is not None else self._latency
+            if throttled:
+                if now - self._last_decrease >= cooldown:
+                    self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            elif self.latency_target is None or latency <= self.latency_target:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+@dataclass
+class RetryPolicy:
+    """
+    再試行の方針
+
+    Attributes:
+        max_attempts: 最大試行回数（初回を含む）
+        initial: 最初の再試行までの待ち時間の上限（秒）
+        maximum: 待ち時間の上限（秒）
+        multiplier: 試行ごとに待ち時間の上限に掛ける係数
+        retryable: 再試行するgRPCステータス
+    """
+    max_attempts: int = 5
+    initial: float = 1.0
+    maximum: float = 60.0
+    multiplier: float = 2.0
+    retryable: FrozenSet[str] = RETRYABLE_CODES
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        attempt 回目の試行が失敗したあとの待ち時間（秒）
+
+        上限までの一様乱数（フルジッター）にし、同時に失敗したリクエストの再試行が重ならないようにする。
+        サーバーの指定（retry_after）がある場合は、それより短くしない。
+        """
+        cap = min(self.maximum, self.initial * self.multiplier ** (attempt - 1))
+        delay = random.uniform(0, cap)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+@dataclass
+class ResilienceStats:
+    """
+    呼び出しの集計（スレッドセーフ）
+
+    Attributes:
+        calls: 呼び出し数
+        attempts: 試行数（再試行を含む）
+        retries: 再試行数
+        throttled: スロットリングされた回数（RESOURCE_EXHAUSTED, UNAVAILABLE）
+        failures: 再試行しても失敗した呼び出し数
+        rate_limit_wait: レート制限（トークンバケット）で待った合計秒数
+        concurrency_wait: 同時実行数の上限で待った合計秒数
+        throttle_backoff_wait: スロットリング後のバックオフで待った合計秒数
+        error_backoff_wait: それ以外のエラー後のバックオフで待った合計秒数
+        min_concurrency: 同時実行数の上限の最小値（AIMD使用時）
+        codes: ステータスごとのエラー回数
+    """
+    calls: int = 0
+    attempts: int = 0
+    retries: int = 0
+    throttled: int = 0
+    failures: int = 0
+    rate_limit_wait: float = 0.0
+    concurrency_wait: float = 0.0
+    throttle_backoff_wait: float = 0.0
+    error_backoff_wait: float = 0.0
+    min_concurrency: Optional[int] = None
+    codes: Dict[str, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, **values: Any) -> None:
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def count_error(self, code: Optional[str]) -> None:
+        with self._lock:
+            key = code or "UNKNOWN"
+            self.codes[key] = self.codes.get(key, 0) + 1
+
+    def observe_limit(self, limit: int) -> None:
+        with self._lock:
+            if self.min_concurrency is None or limit < self.min_concurrency:
+                self.min_concurrency = limit
+
+    @property
+    def throttle_wait(self) -> float:
+        """スロットリングによる待ち時間の合計（レート制限 + 同時実行数 + スロットリング後のバックオフ）"""
+        return self.rate_limit_wait + self.concurrency_wait + self.throttle_backoff_wait
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "failures": self.failures,
+                "rate_limit_wait_s": round(self.rate_limit_wait, 3),
+                "concurrency_wait_s": round(self.concurrency_wait, 3),
+                "throttle_backoff_wait_s": round(self.throttle_backoff_wait, 3),
+                "error_backoff_wait_s": round(self.error_backoff_wait, 3),
+                "throttle_wait_s": round(self.throttle_wait, 3),
+                "min_concurrency": self.min_concurrency,
+                "codes": dict(self.codes),
+            }
+
+    def summary(self) -> str:
+        """1行の集計"""
+        text = (f"calls={self.calls}, retries={self.retries}, throttled={self.throttled}, "
+                f"failures={self.failures}, throttle wait={self.throttle_wait:.1f}s "
+                f"(rate limit {self.rate_limit_wait:.1f}s, concurrency {self.concurrency_wait:.1f}s, "
+                f"backoff {self.throttle_backoff_wait:.1f}s), error backoff={self.error_backoff_wait:.1f}s")
+        if self.min_concurrency is not None:
+            text += f", min concurrency={self.min_concurrency}"
+        return text
+
+
+class ResilientCaller:
+    """
+    レート制限・同時実行数制御・再試行をまとめて行う呼び出しラッパー（複数スレッドから共有して使う）
+    """
+
+    def __init__(
+        self,
+        policy: Optional[RetryPolicy] = None,
+        requests: Optional[TokenBucket] = None,
+        pages: Optional[TokenBucket] = None,
+        aimd: Optional[AimdController] = None,
+        on_retry: Optional[Callable[[str, int, BaseException, float], None]] = None,
+    ):
+        """
+        Args:
+            policy: 再試行の方針（デフォルト: RetryPolicy()）
+            requests: リクエスト数のレート制限（Noneの場合は制限しない）
+            pages: ページ数のレート制限（Noneの場合は制限しない）
+            aimd: 同時実行数の制御（Noneの場合は制御しない）
+            on_retry: 再試行のたびに (名前, 試行回数, 例外, 待ち時間) で呼ばれるコールバック（Noneの場合はログを表示する）
+        """
+        self.policy = policy or RetryPolicy()
+        self.requests = requests
+        self.pages = pages
+        self.aimd = aimd
+        self.on_retry = on_retry or self._print_retry
+        self.stats = ResilienceStats()
+
+    def _print_retry(self, name: str, attempt: int, exc: BaseException, delay: float) -> None:
+        print(f"[RETRY] {name} -> {status_name(exc) or type(exc).__name__}: "
+              f"{delay:.1f}秒後に再試行 ({attempt}/{self.policy.max_attempts - 1})")
+
+    def call(self, fn: Callable[[Optional[float]], Any], pages: int = 1,
+             deadline: Optional[float] = None, name: str = "") -> Any:
+        """
+        fn を呼び出し、再試行可能なエラーの場合は再試行する
+
+        Args:
+            fn: 1回の試行を行う関数。引数にこの試行の期限（残り秒数、期限なしの場合はNone）を受け取る
+            pages: このリクエストのページ数（ページ数のレート制限に使う）
+            deadline: 再試行を含む全体の期限（秒）。Noneの場合は試行回数のみで打ち切る
+            name: ログ表示用の名前
+
+        Returns:
+            fn の戻り値（最後の試行でも失敗した場合はその例外を送出）
+        """
+        self.stats.add(calls=1)
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            waited = 0.0
+            if self.requests is not None:
+                waited += self.requests.acquire(1)
+            if self.pages is not None:
+                waited += self.pages.acquire(pages)
+            self.stats.add(rate_limit_wait=waited)
+
+            remaining = None if deadline is None else deadline - (time.monotonic() - start)
+            if remaining is not None and remaining <= 0:
+                self.stats.add(failures=1)
+                raise TimeoutError(f"期限（{deadline} 秒）までに送信できませんでした: {name}")
+
+            if self.aimd is not None:
+                self.stats.add(concurrency_wait=self.aimd.acquire())
+                self.stats.observe_limit(int(self.aimd.limit))
+            self.stats.add(attempts=1)
+            sent = time.monotonic()
+            try:
+                result = fn(remaining)
+            except Exception as e:
+                code = status_name(e)
+                throttled = code in THROTTLE_CODES
+                if self.aimd is not None:
+                    self.aimd.release(time.monotonic() - sent, throttled)
+                self.stats.count_error(code)
+                if throttled:
+                    self.stats.add(throttled=1)
+
+                if code not in self.policy.retryable or attempt >= self.policy.max_attempts:
+                    self.stats.add(failures=1)
+                    raise
+                delay = self.policy.backoff(attempt, retry_after_seconds(e))
+                if deadline is not None and time.monotonic() - start + delay >= deadline:
+                    self.stats.add(failures=1)
+                    raise
+                if throttled:
+                    self.stats.add(retries=1, throttle_backoff_wait=delay)
+                else:
+                    self.stats.add(retries=1, error_backoff_wait=delay)
+                self.on_retry(name, attempt, e, delay)
+                time.sleep(delay)
+                continue
+
+            if self.aimd is not None:
+                self.aimd.release(time.monotonic() - sent, False)
+            return result
+
+
+def create_caller(
+    requests_per_minute: Optional[float] = None,
+    pages_per_minute: Optional[float] = None,
+    max_concurrency: Optional[int] = None,
+    max_attempts: int = 5,
+    latency_target: Optional[float] = None,
+) -> ResilientCaller:
+    """
+    設定値から ResilientCaller を作成（各 main.py の設定ブロックから使う）
+
+    Args:
+        requests_per_minute: 1分あたりのリクエスト数の上限（プロジェクトのクォータ。None=制限なし）
+        pages_per_minute: 1分あたりのページ数の上限（None=制限なし）
+        max_concurrency: 同時実行数の上限。指定した場合はAIMDで調整する（None=制御しない）
+        max_attempts: 最大試行回数（1=再試行しない）
+        latency_target: AIMDで健全とみなす応答時間（秒）
+    """
+    return ResilientCaller(
+        policy=RetryPolicy(max_attempts=max(1, max_attempts)),
+        requests=TokenBucket(requests_per_minute) if requests_per_minute else None,
+        pages=TokenBucket(pages_per_minute) if pages_per_minute else None,
+        aimd=AimdController(max_concurrency, latency_target=latency_target) if max_concurrency else None,
+    )
@@ -0,0 +1,224 @@
+"""
+受信フォルダ監視モジュール（常駐モード用）
+
+受信フォルダ（サブフォルダを含む）を監視し、書き込みが完了したファイルを
+到着順にストリーミングで返します。
+
+- 変更通知: watchdog がインストールされていれば OS のファイル通知
+  （Linux: inotify / Windows: ReadDirectoryChangesW / macOS: FSEvents）を使用し、
+  ない場合は os.scandir による定期ポーリングにフォールバックする
+- 書き込み完了判定: サイズと更新時刻が stable_seconds の間変化しないこと
+- 一覧取得はソートせずに逐次処理するため、大量のファイルがあっても最初の1件をすぐ返せる
+"""
+from __future__ import annotations
+
+import os
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+
+def iter_files(root: Path, exts: Set[str], recursive: bool = True,
+               exclude_dirs: Iterable[Path] = ()) -> Iterator[Path]:
+    """
+    ディレクトリ以下の対象ファイルを逐次列挙（ソートしない）
+
+    Args:
+        root: 列挙するディレクトリ
+        exts: 対象拡張子（小文字、ドット付き）
+        recursive: サブディレクトリも列挙するかどうか
+        exclude_dirs: 列挙しないディレクトリ（完了フォルダなど）
+    """
+    excluded = {os.path.normcase(str(Path(d).resolve())) for d in exclude_dirs}
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and os.path.normcase(os.path.realpath(entry.path)) not in excluded:
+                            stack.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in exts:
+                        yield Path(entry.path)
+        except FileNotFoundError:
+            continue  # 列挙中に削除されたディレクトリ
+
+
+def move_to_done(path: Path, inbox_dir: Path, done_dir: Path) -> Path:
+    """
+    処理済みファイルを完了フォルダへ移動（受信フォルダからの相対パスを維持）
+
+    同名ファイルが既にある場合は末尾に時刻を付けて上書きを避ける。
+
+    Returns:
+        移動先のパス
+    """
+    try:
+        relative = Path(path).resolve().relative_to(Path(inbox_dir).resolve())
+    except ValueError:
+        relative = Path(Path(path).name)
+    dest = Path(done_dir) / relative
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.exists():
+        dest = dest.with_name(f"{dest.stem}_{time.strftime('%Y%m%d%H%M%S')}{dest.suffix}")
+    shutil.move(str(path), str(dest))
+    return dest
+
+
+class FolderWatcher:
+    """
+    受信フォルダを監視し、書き込み完了したファイルを返すウォッチャー
+
+    使用例:
+        watcher = FolderWatcher(inbox_dir, {".png"}, exclude_dirs=[done_dir])
+        for path in watcher.watch():
+            ...  # 処理して move_to_done(path, inbox_dir, done_dir)
+    """
+
+    def __init__(
+        self,
+        inbox_dir: Path,
+        exts: Set[str],
+        recursive: bool = True,
+        stable_seconds: float = 2.0,
+        poll_interval: float = 1.0,
+        exclude_dirs: Iterable[Path] = (),
+        use_native_events: bool = True,
+    ):
+        """
+        Args:
+            inbox_dir: 監視する受信フォルダ
+            exts: 対象拡張子
+            recursive: サブフォルダも監視するかどうか
+            stable_seconds: サイズ・更新時刻がこの秒数変化しなければ書き込み完了とみなす
+            poll_interval: 書き込み完了判定（およびポーリング時の再走査）の間隔（秒）
+            exclude_dirs: 監視しないディレクトリ（受信フォルダ内に完了フォルダを置く場合など）
+            use_native_events: OSのファイル通知を使うかどうか（Falseでは常にポーリング）
+        """
+        self.inbox_dir = Path(inbox_dir)
+        self.exts = {e.lower() for e in exts}
+        self.recursive = recursive
+        self.stable_seconds = stable_seconds
+        self.poll_interval = poll_interval
+        self.exclude_dirs = [Path(d) for d in exclude_dirs]
+        self.use_native_events = use_native_events
+        self._events: "queue.Queue[Path]" = queue.Queue()
+        self._observer = None
+        # path -> (size, mtime_ns, 最後に変化を観測した時刻)
+        self._candidates: Dict[Path, Tuple[int, int, float]] = {}
+        # 返却済みのファイル（同じ内容のまま残っている間は再度返さない）
+        self._emitted: Dict[Path, Tuple[int, int]] = {}
+
+    @property
+    def backend(self) -> str:
+        return "native" if self._observer is not None else "polling"
+
+    def _is_target(self, path: Path) -> bool:
+        if path.suffix.lower() not in self.exts:
+            return False
+        resolved = os.path.normcase(str(path.resolve()))
+        for d in self.exclude_dirs:
+            if resolved.startswith(os.path.normcase(str(d.resolve())) + os.sep):
+                return False
+        if not self.recursive and path.parent.resolve() != self.inbox_dir.resolve():
+            return False
+        return True
+
+    def _start_native(self) -> bool:
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+
+        events = self._events
+
+        class _Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    events.put(Path(event.src_path))
+
+            def on_modified(self, event):
+                if not event.is_directory:
+                    events.put(Path(event.src_path))
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    events.put(Path(event.dest_path))
+
+        observer = Observer()
+        observer.schedule(_Handler(), str(self.inbox_dir), recursive=self.recursive)
+        observer.daemon = True
+        observer.start()
+        self._observer = observer
+        return True
+
+    def _scan(self) -> None:
+        for path in iter_files(self.inbox_dir, self.exts, self.recursive, self.exclude_dirs):
+            self._events.put(path)
+
+    def _drain_events(self) -> None:
+        now = time.monotonic()
+        while True:
+            try:
+                path = self._events.get_nowait()
+            except queue.Empty:
+                return
+            if path in self._candidates or not self._is_target(path):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if self._emitted.get(path) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            self._candidates[path] = (stat.st_size, stat.st_mtime_ns, now)
+
+    def _pop_stable(self) -> Iterator[Path]:
+        now = time.monotonic()
+        for path, (size, mtime_ns, changed_at) in list(self._candidates.items()):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                del self._candidates[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != (size, mtime_ns):
+                self._candidates[path] = (*current, now)
+            elif now - changed_at >= self.stable_seconds:
+                del self._candidates[path]
+                self._emitted[path] = current
+                yield path
+
+    def watch(self, stop_event: Optional[threading.Event] = None) -> Iterator[Path]:
+        """
+        書き込みが完了したファイルを到着順に返し続ける
+
+        起動時点で受信フォルダにあるファイルも対象になる。
+        stop_event がセットされると終了する。
+        """
+        if not self.inbox_dir.exists():
+            raise FileNotFoundError(f"inbox_dir not found: {self.inbox_dir}")
+
+        native = self.use_native_events and self._start_native()
+        # 起動前から置かれているファイルを取り込む（ネイティブ通知では届かないため）
+        self._scan()
+        try:
+            while stop_event is None or not stop_event.is_set():
+                self._drain_events()
+                yield from self._pop_stable()
+                # 返却済みのファイルが移動・削除されたら記録を捨てる
+                for path in [p for p in self._emitted if not p.exists()]:
+                    del self._emitted[path]
+                time.sleep(self.poll_interval)
+                if not native:
+                    self._scan()
+        finally:
+            if self._observer is not None:
+                self._observer.stop()
+                self._observer.join()
+                self._observer = None
@@ -0,0 +1,502 @@
+"""
+Vision API の単語ボックス（座標・信頼度・ブロック/行の番号）を配列形式で保存するモジュール
+
+document_text_detection のレスポンス（full_text_annotation）は、ページ → ブロック → 段落 → 単語 → 文字の
+階層と、それぞれの座標・信頼度を持っています。全文テキストだけを保存すると、レイアウトを使う項目抽出の
+たびにAPIを呼び直す（再課金される）ことになるため、単語単位の情報を1ファイルに保存します（*_words.bin）。
+
+- 単語・行・ブロック・ページごとに、列ごとの配列（構造体の配列ではなく配列の構造体）として保存する
+  （座標は float32 の (x0, y0, x1, y1)、番号は uint32。テキストを除いて単語あたり約45バイト）
+- テキストは全体で1つのUTF-8バッファにし、単語は [開始, 終了) のバイト位置で参照する
+  （バッファは単語と文字の区切りから作る。通常は full_text_annotation.text と同じになる）
+- 行はVision APIにない階層のため、文字の区切り（改行・行末のスペース・ハイフン）と段落の境界から作る
+- 読み込みはファイルをメモリマップし、配列はコピーせずにビューとして使う（数千単語でも1ミリ秒未満）
+- 文字単位の座標は保存しない（単語の座標で十分なため。3000単語のページで、レスポンスのJSONの約1/100の大きさになる）
+
+ファイル形式（すべてリトルエンディアン）:
+    MAGIC（8バイト） | ヘッダー長（uint32） | 予約（uint32） | ヘッダー（JSON） | 配列 ... | テキスト
+    ヘッダーには各配列の dtype・形状・先頭からの位置と、テキストの位置・長さ、meta（出典など）を書く。
+    配列・テキストの先頭は ALIGN バイト境界に揃える。
+
+使い方:
+    save_word_boxes(response.full_text_annotation, output_dir / "page_001_words.bin", meta={"source": "page_001.png"})
+
+    with load_word_boxes(output_dir / "page_001_words.bin") as boxes:
+        result = DataParser().parse_word_boxes(boxes)      # test_ocr_for_doc1/lib/data_parser.py
+        print(boxes.region_text((0, 0, 1200, 400)))        # 領域内の単語を行ごとに並べたテキスト
+
+    # 内容を表示する
+    python -m util.word_boxes show 出力/page_001_words.bin
+    # 元のレスポンス（JSON）と、サイズ・読み込み時間を比較する
+    python -m util.word_boxes bench [単語数]
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+MAGIC = b"VWBOXES1"
+SUFFIX = "_words.bin"
+ALIGN = 16
+_PREFIX = struct.Struct("<8sII")
+
+# TextAnnotation.DetectedBreak.BreakType -> 単語の後ろに付ける文字（Vision API の全文テキストと同じ規則）
+_BREAK_TEXT = {1: " ", 2: " ", 3: "\n", 4: "-\n", 5: "\n"}
+# 行の終わりとみなす区切り（EOL_SURE_SPACE, HYPHEN, LINE_BREAK）
+_LINE_ENDS = frozenset({3, 4, 5})
+
+# 配列の名前 -> (dtype, 1要素の列数)。番号はすべて0始まりで、ページ・ブロックをまたいで通し番号にする
+COLUMNS: Dict[str, Tuple[str, int]] = {
+    "page_size": ("<f4", 2),          # ページの (幅, 高さ)
+    "page_confidence": ("<f4", 1),
+    "page_first_block": ("<u4", 1),   # ページ p のブロックは [page_first_block[p], page_first_block[p + 1])（要素数 ページ数+1）
+    "block_box": ("<f4", 4),          # (x0, y0, x1, y1)
+    "block_confidence": ("<f4", 1),
+    "block_type": ("<u1", 1),         # Block.BlockType（1=TEXT, 2=TABLE, ...）
+    "block_page": ("<u2", 1),
+    "block_first_line": ("<u4", 1),   # 要素数 ブロック数+1
+    "line_box": ("<f4", 4),           # 行の単語の座標を囲む矩形
+    "line_block": ("<u4", 1),
+    "line_first_word": ("<u4", 1),    # 要素数 行数+1
+    "word_box": ("<f4", 4),
+    "word_confidence": ("<f4", 1),
+    "word_text": ("<u4", 2),          # テキストバッファの [開始, 終了) のバイト位置（後ろの区切り文字を含まない）
+    "word_break": ("<u1", 1),         # 単語の後ろの区切り（DetectedBreak.BreakType）
+    "word_page": ("<u2", 1),
+    "word_block": ("<u4", 1),
+    "word_paragraph": ("<u4", 1),
+    "word_line": ("<u4", 1),
+}
+
+
+def _box(bounding_poly, width: float, height: float) -> Tuple[float, float, float, float]:
+    """BoundingPoly を囲む矩形（正規化座標しかない場合はページの大きさを掛けてピクセルにする）"""
+    if bounding_poly.vertices:
+        xs = [v.x for v in bounding_poly.vertices]
+        ys = [v.y for v in bounding_poly.vertices]
+    elif bounding_poly.normalized_vertices:
+        xs = [v.x * width for v in bounding_poly.normalized_vertices]
+        ys = [v.y * height for v in bounding_poly.normalized_vertices]
+    else:
+        return 0.0, 0.0, 0.0, 0.0
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def annotation_to_arrays(annotation) -> Tuple[Dict[str, np.ndarray], bytes]:
+    """
+    Vision API の TextAnnotation（full_text_annotation）を列ごとの配列とUTF-8テキストに変換
+
+    Args:
+        annotation: vision.TextAnnotation（proto-plus）または protobuf のメッセージ
+
+    Returns:
+        (COLUMNS の名前 -> 配列, テキストバッファ)
+    """
+    # proto-plus の属性アクセスは遅いため、protobuf のメッセージを直接たどる
+    pb = type(annotation).pb(annotation) if hasattr(type(annotation), "pb") else annotation
+    cols: Dict[str, list] = {name: [] for name in COLUMNS}
+    text = bytearray()
+    paragraph_id = 0
+    line_open = False
+
+    for page_index, page in enumerate(pb.pages):
+        cols["page_size"].append((page.width, page.height))
+        cols["page_confidence"].append(page.confidence)
+        cols["page_first_block"].append(len(cols["block_box"]))
+        for block in page.blocks:
+            block_id = len(cols["block_box"])
+            cols["block_box"].append(_box(block.bounding_box, page.width, page.height))
+            cols["block_confidence"].append(block.confidence)
+            cols["block_type"].append(block.block_type)
+            cols["block_page"].append(page_index)
+            cols["block_first_line"].append(len(cols["line_block"]))
+            for paragraph in block.paragraphs:
+                # 段落の境界では必ず行を区切る（行はブロック・段落をまたがない）
+                line_open = False
+                for word in paragraph.words:
+                    if not line_open:
+                        cols["line_block"].append(block_id)
+                        cols["line_first_word"].append(len(cols["word_box"]))
+                        line_open = True
+                    # 単語の中の文字の区切りも全文テキストと同じように入れ、最後の文字の区切りは単語の区切りにする
+                    symbols = word.symbols
+                    parts = []
+                    for i, symbol in enumerate(symbols):
+                        parts.append(symbol.text)
+                        if i < len(symbols) - 1:
+                            parts.append(_BREAK_TEXT.get(symbol.property.detected_break.type_, ""))
+                    break_type = symbols[-1].property.detected_break.type_ if symbols else 0
+                    start = len(text)
+                    text += "".join(parts).encode("utf-8")
+                    end = len(text)
+                    text += _BREAK_TEXT.get(break_type, "").encode("utf-8")
+                    cols["word_box"].append(_box(word.bounding_box, page.width, page.height))
+                    cols["word_confidence"].append(word.confidence)
+                    cols["word_text"].append((start, end))
+                    cols["word_break"].append(break_type)
+                    cols["word_page"].append(page_index)
+                    cols["word_block"].append(block_id)
+                    cols["word_paragraph"].append(paragraph_id)
+                    cols["word_line"].append(len(cols["line_block"]) - 1)
+                    if break_type in _LINE_ENDS:
+                        line_open = False
+                paragraph_id += 1
+    # 区切り位置の配列は末尾（全体の要素数）を足して、i 番目の範囲を [first[i], first[i + 1]) で取れるようにする
+    cols["page_first_block"].append(len(cols["block_box"]))
+    cols["block_first_line"].append(len(cols["line_block"]))
+    cols["line_first_word"].append(len(cols["word_box"]))
+
+    arrays = {}
+    for name, (dtype, width) in COLUMNS.items():
+        shape = (len(cols[name]), width) if width > 1 else (len(cols[name]),)
+        arrays[name] = np.array(cols[name], dtype=dtype).reshape(shape)
+    # 行の矩形は単語の矩形から計算する
+    line_box = np.zeros((len(cols["line_block"]), 4), dtype="<f4")
+    if len(line_box):
+        first = arrays["line_first_word"][:-1]
+        line_box[:, :2] = np.minimum.reduceat(arrays["word_box"][:, :2], first, axis=0)
+        line_box[:, 2:] = np.maximum.reduceat(arrays["word_box"][:, 2:], first, axis=0)
+    arrays["line_box"] = line_box
+    return arrays, bytes(text)
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def encode_word_boxes(annotation, meta: Optional[Dict[str, Any]] = None) -> bytes:
+    """TextAnnotation を *_words.bin の内容（バイト列）に変換"""
+    arrays, text = annotation_to_arrays(annotation)
+    header: Dict[str, Any] = {"meta": meta or {}, "arrays": {}, "text": None}
+
+    def layout(header_bytes: int) -> int:
+        offset = _aligned(_PREFIX.size + header_bytes)
+        for name, array in arrays.items():
+            header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset = _aligned(offset + array.nbytes)
+        header["text"] = {"offset": offset, "nbytes": len(text)}
+        return offset + len(text)
+
+    # ヘッダーの長さで配列の位置が変わるため、長さが変わらなくなるまで繰り返す（通常は2回）
+    header_json = b""
+    while True:
+        total = layout(len(header_json))
+        encoded = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        done = len(encoded) == len(header_json)
+        header_json = encoded
+        if done:
+            break
+
+    out = bytearray(total)
+    _PREFIX.pack_into(out, 0, MAGIC, len(header_json), 0)
+    out[_PREFIX.size:_PREFIX.size + len(header_json)] = header_json
+    for name, array in arrays.items():
+        offset = header["arrays"][name]["offset"]
+        out[offset:offset + array.nbytes] = array.tobytes()
+    out[header["text"]["offset"]:total] = text
+    return bytes(out)
+
+
+def save_word_boxes(annotation, path: Path, meta: Optional[Dict[str, Any]] = None) -> Path:
+    """
+    TextAnnotation を保存
+
+    Args:
+        annotation: vision.TextAnnotation（response.full_text_annotation）
+        path: 保存先（通常は "{stem}_words.bin"）
+        meta: ヘッダーに一緒に保存する情報（出典・言語ヒントなど。JSONにできる値）
+
+    Returns:
+        保存先のパス
+    """
+    path = Path(path)
+    # 読み込み中（メモリマップ中）のファイルを直接上書きしないよう、一時ファイルに書いてから置き換える
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(encode_word_boxes(annotation, meta))
+    os.replace(tmp, path)
+    return path
+
+
+class WordBoxes:
+    """
+    *_words.bin の内容（配列はメモリ上のバッファまたはメモリマップしたファイルのビュー）
+
+    COLUMNS の配列は同じ名前の属性で参照できる（例: boxes.word_box は (単語数, 4) の float32）。
+    メモリマップした場合は close()（または with 文）で閉じる。閉じたあとは配列を使わないこと。
+
+    Attributes:
+        path: 読み込んだファイル（バイト列から作った場合はNone）
+        meta: 保存時の meta
+    """
+
+    def __init__(self, buffer, path: Optional[Path] = None, mapped: Optional[mmap.mmap] = None):
+        magic, header_len, _ = _PREFIX.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"単語ボックスのファイルではありません: {path or '(bytes)'}")
+        header = json.loads(bytes(buffer[_PREFIX.size:_PREFIX.size + header_len]).decode("utf-8"))
+        self.path = path
+        self.meta: Dict[str, Any] = header.get("meta", {})
+        self._mmap = mapped
+        self._arrays: Dict[str, np.ndarray] = {}
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            count = int(np.prod(shape)) if shape else 0
+            self._arrays[name] = np.frombuffer(buffer, dtype=spec["dtype"], count=count,
+                                               offset=spec["offset"]).reshape(shape)
+        text = header["text"]
+        self._text_bytes = memoryview(buffer)[text["offset"]:text["offset"] + text["nbytes"]]
+        self._text: Optional[str] = None
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        arrays = self.__dict__.get("_arrays", {})
+        if name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    # ----------------------------
+    # 件数・テキスト
+    # ----------------------------
+    @property
+    def page_count(self) -> int:
+        return len(self._arrays["page_size"])
+
+    @property
+    def word_count(self) -> int:
+        return len(self._arrays["word_box"])
+
+    @property
+    def line_count(self) -> int:
+        return len(self._arrays["line_block"])
+
+    @property
+    def text(self) -> str:
+        """全文テキスト（初めてアクセスしたときにデコードする）"""
+        if self._text is None:
+            self._text = bytes(self._text_bytes).decode("utf-8")
+        return self._text
+
+    def _slice(self, start: int, end: int) -> str:
+        return bytes(self._text_bytes[start:end]).decode("utf-8")
+
+    def word_text(self, index: int) -> str:
+        """index 番目の単語の文字列"""
+        start, end = self._arrays["word_text"][index]
+        return self._slice(int(start), int(end))
+
+    def line_text(self, index: int) -> str:
+        """index 番目の行の文字列（単語の間の区切りを含む）"""
+        first = self._arrays["line_first_word"]
+        spans = self._arrays["word_text"]
+        return self._slice(int(spans[first[index], 0]), int(spans[first[index + 1] - 1, 1]))
+
+    def lines(self, page: Optional[int] = None) -> List[str]:
+        """行の文字列のリスト（page を指定した場合はそのページの行だけ）"""
+        indices = range(self.line_count) if page is None else self._lines_of_page(page)
+        return [self.line_text(i) for i in indices]
+
+    def _lines_of_page(self, page: int) -> range:
+        blocks = self._arrays["page_first_block"]
+        first_line = self._arrays["block_first_line"]
+        return range(int(first_line[blocks[page]]), int(first_line[blocks[page + 1]]))
+
+    # ----------------------------
+    # 座標・信頼度による検索
+    # ----------------------------
+    def words_in(self, box: Sequence[float], page: int = 0) -> np.ndarray:
+        """
+        中心が box（x0, y0, x1, y1）の内側にある単語の番号（読み順）
+
+        Args:
+            box: 領域（ピクセル座標）
+            page: ページ番号（0始まり）
+        """
+        words = self._arrays["word_box"]
+        cx = (words[:, 0] + words[:, 2]) / 2
+        cy = (words[:, 1] + words[:, 3]) / 2
+        x0, y0, x1, y1 = box
+        mask = (self._arrays["word_page"] == page) & (cx >= x0) & (cx <= x1) & (cy >= y0) & (cy <= y1)
+        return np.flatnonzero(mask)
+
+    def region_text(self, box: Sequence[float], page: int = 0) -> str:
+        """box の内側の単語を、行ごとに区切りを保って並べたテキスト（行の間は改行）"""
+        indices = self.words_in(box, page)
+        if not len(indices):
+            return ""
+        line_of = self._arrays["word_line"][indices]
+        parts: List[str] = []
+        for line in np.unique(line_of):
+            selected = indices[line_of == line]
+            spans = self._arrays["word_text"]
+            # 行の途中の単語だけが含まれる場合も、その範囲の区切り（スペースなど）は元のテキストのまま使う
+            parts.append(self._slice(int(spans[selected[0], 0]), int(spans[selected[-1], 1])))
+        return "\n".join(parts)
+
+    def low_confidence(self, threshold: float) -> np.ndarray:
+        """信頼度が threshold 未満の単語の番号"""
+        return np.flatnonzero(self._arrays["word_confidence"] < threshold)
+
+    # ----------------------------
+    # 後始末
+    # ----------------------------
+    def close(self) -> None:
+        """メモリマップを閉じる（配列のビューが残っている場合は、ガベージコレクションに任せる）"""
+        self._arrays = {}
+        self._text_bytes.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+
+    def __enter__(self) -> "WordBoxes":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def load_word_boxes(path: Union[str, Path], use_mmap: bool = True) -> WordBoxes:
+    """
+    save_word_boxes() で保存したファイルを読み込む
+
+    Args:
+        path: *_words.bin のパス
+        use_mmap: Trueの場合はファイルをメモリマップし、配列をコピーせずに使う（Falseの場合は全体を読み込む）
+    """
+    path = Path(path)
+    if not use_mmap:
+        return WordBoxes(path.read_bytes(), path)
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return WordBoxes(mapped, path, mapped)
+
+
+def decode_word_boxes(data: bytes) -> WordBoxes:
+    """encode_word_boxes() のバイト列を WordBoxes にする"""
+    return WordBoxes(data)
+
+
+def sample_annotation(n_words: int, n_pages: int = 1):
+    """
+    document_text_detection のレスポンスに近い構造の TextAnnotation（ベンチマーク・フェイクサーバー用）
+
+    1ページ n_words 単語を、1行8単語・1段落3行・1ブロック2段落に並べ、単語ごとに文字（symbols）と座標・信頼度を付ける。
+    """
+    import random
+
+    from google.cloud import vision
+
+    rng = random.Random(0)
+    TextAnnotation = vision.TextAnnotation
+    Break = TextAnnotation.DetectedBreak.BreakType
+
+    def poly(x0, y0, x1, y1):
+        return {"vertices": [{"x": x0, "y": y0}, {"x": x1, "y": y0}, {"x": x1, "y": y1}, {"x": x0, "y": y1}]}
+
+    def make_word(index: int, x: int, y: int, last_in_line: bool):
+        chars = list(f"項目{index:04d}")
+        symbols = []
+        for i, char in enumerate(chars):
+            brk = Break.UNKNOWN
+            if i == len(chars) - 1:
+                brk = Break.EOL_SURE_SPACE if last_in_line else Break.SPACE
+            symbols.append(vision.Symbol(
+                text=char, confidence=rng.uniform(0.7, 1.0), bounding_box=poly(x + i * 16, y, x + i * 16 + 15, y + 30),
+                property={"detected_break": {"type_": brk}} if brk else None,
+            ))
+        return vision.Word(symbols=symbols, confidence=rng.uniform(0.7, 1.0),
+                                   bounding_box=poly(x, y, x + len(chars) * 16, y + 30),
+                                   property={"detected_languages": [{"language_code": "ja"}]})
+
+    pages = []
+    for _ in range(n_pages):
+        blocks = []
+        index = 0
+        y = 100
+        while index < n_words:
+            paragraphs = []
+            for _ in range(2):
+                words = []
+                for _ in range(3):
+                    for column in range(8):
+                        if index >= n_words:
+                            break
+                        words.append(make_word(index, 100 + column * 180 + rng.randint(0, 10), y,
+                                               column == 7 or index == n_words - 1))
+                        index += 1
+                    y += 40
+                if words:
+                    paragraphs.append(vision.Paragraph(words=words, confidence=rng.uniform(0.8, 1.0)))
+            blocks.append(vision.Block(paragraphs=paragraphs, block_type=vision.Block.BlockType.TEXT,
+                                               confidence=rng.uniform(0.8, 1.0), bounding_box=poly(100, y - 240, 1540, y)))
+            y += 20
+        pages.append(vision.Page(width=2480, height=3508, blocks=blocks, confidence=0.95))
+    annotation = TextAnnotation(pages=pages)
+    # 全文テキストは単語ボックスのテキストバッファと同じ規則で作る
+    annotation.text = annotation_to_arrays(annotation)[1].decode("utf-8")
+    return annotation
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) > 2 and sys.argv[1] == "show":
+        with load_word_boxes(sys.argv[2]) as boxes:
+            print(f"{sys.argv[2]}: ページ {boxes.page_count}, ブロック {len(boxes.block_box)}, "
+                  f"行 {boxes.line_count}, 単語 {boxes.word_count}, テキスト {len(boxes.text)} 文字")
+            print(f"meta: {boxes.meta}")
+            for i, line in enumerate(boxes.lines()[:20]):
+                x0, y0, x1, y1 = boxes.line_box[i]
+                print(f"  [{i:3}] ({x0:6.0f},{y0:6.0f})-({x1:6.0f},{y1:6.0f}) {line}")
+            low = boxes.low_confidence(0.8)
+            print(f"信頼度0.8未満の単語: {len(low)} 件")
+        sys.exit(0)
+
+    # 元のレスポンス（JSON）と、サイズ・読み込み時間・領域のテキストの取得時間を比較する
+    import tempfile
+
+    from google.cloud import vision
+    from google.protobuf import json_format
+
+    n_words = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[1] == "bench" else 3000
+    annotation = sample_annotation(n_words)
+    response = vision.AnnotateImageResponse.pb(vision.AnnotateImageResponse(full_text_annotation=annotation))
+    runs = 20
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = Path(tmp) / "response.json"
+        start = time.perf_counter()
+        json_path.write_text(json_format.MessageToJson(response, indent=2), encoding="utf-8")
+        json_write = time.perf_counter() - start
+        start = time.perf_counter()
+        bin_path = save_word_boxes(annotation, Path(tmp) / f"page{SUFFIX}")
+        bin_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(runs):
+            json_format.Parse(json_path.read_text(encoding="utf-8"), type(response)())
+        json_load = (time.perf_counter() - start) / runs
+        start = time.perf_counter()
+        for _ in range(runs):
+            with load_word_boxes(bin_path) as boxes:
+                pass
+        bin_load = (time.perf_counter() - start) / runs
+        with load_word_boxes(bin_path) as boxes:
+            assert boxes.text == annotation.text and boxes.word_count == n_words
+            start = time.perf_counter()
+            for _ in range(runs):
+                boxes.region_text((0, 0, 1000, 1000))
+            region = (time.perf_counter() - start) / runs
+
+        print(f"1ページ {n_words} 単語")
+        print(f"レスポンスのJSON: {json_path.stat().st_size / 1024:6.0f} KB, 書き込み {json_write * 1000:7.1f} ms, "
+              f"読み込み {json_load * 1000:7.1f} ms")
+        print(f"単語ボックス    : {bin_path.stat().st_size / 1024:6.0f} KB, 書き込み {bin_write * 1000:7.1f} ms, "
+              f"読み込み {bin_load * 1000:7.3f} ms, 領域のテキスト {region * 1000:6.3f} ms")